@@ -1,2 +1 @@
-python match.py CA_DREAMS-Usage-Data-2025.10.xlsx Feature-Mapping-2025.11.06.xlsx CA_DREAMS.Y2.Admin-Users-List-2025.11.xlsx CA_DREAMS-Provisioning-2025.12.xlsx
-python match.py CA_DREAMS-Usage-Data-2025.11.xlsx Feature-Mapping-2025.11.06.xlsx CA_DREAMS.Y2.Admin-Users-List-2025.11.xlsx CA_DREAMS-Provisioning-2025.12.xlsx
+python batch.py --features Feature-Mapping-2025.11.06.xlsx --users CA_DREAMS.Y2.Admin-Users-List-2025.11.xlsx --provisioning CA_DREAMS-Provisioning-2025.12.xlsx CA_DREAMS-Usage-Data-2025.10.xlsx CA_DREAMS-Usage-Data-2025.11.xlsx
@@ -0,0 +1,213 @@
+import sys
+import os
+import glob
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import match as mt
+import cache as ch
+import instrument as ins
+import preflight as pf
+
+# Batch mode: process many monthly usage files of one or more hubs in one run.
+#
+# The shared feature mapping is parsed once and the user list of each hub is
+# parsed once; the per-month pipeline (enrich, pivot, reconcile, write) of every
+# usage file is then run in a pool of worker processes.  Each input still gets
+# its own <usage>-processed.xlsx, and a run summary with per-file timings and
+# failures is printed and written as JSON.
+#
+# Manifest (JSON), relative paths are relative to the manifest file:
+# {
+#   "features": "Feature-Mapping-2025.11.06.xlsx",
+#   "hubs": [
+#     { "name": "CA_DREAMS",
+#       "usage": ["CA_DREAMS-Usage-Data-2025.*.xlsx"],
+#       "users": "CA_DREAMS.Y2.Admin-Users-List-2025.11.xlsx",
+#       "provisioning": "CA_DREAMS-Provisioning-2025.12.xlsx" }
+#   ]
+# }
+
+SUMMARY_FILE = "batch-summary.json"
+
+# lookups and cache shared by the tasks of a worker process, set once by init_worker
+_feature_lookup = None
+_user_lookups = None
+_cache = None
+
+def init_worker(feature_lookup, user_lookups, cache):
+    global _feature_lookup, _user_lookups, _cache
+    _feature_lookup = feature_lookup
+    _user_lookups = user_lookups
+    _cache = cache
+
+def expand_usage_files(patterns, base_dir=None):
+    files = []
+    for pattern in patterns:
+        if base_dir:
+            pattern = os.path.join(base_dir, pattern)
+        matched = sorted(glob.glob(pattern)) or [pattern]	# keep missing names so they are reported
+        for f in matched:
+            if f.endswith("-processed.xlsx") or os.path.isdir(f) or f in files:
+                continue
+            files.append(f)
+    return files
+
+def load_manifest(manifest_file, expand=True):
+    """(features file, hubs); with expand=False the usage globs are left unexpanded (watch.py)."""
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    hubs = []
+    for i, hub in enumerate(manifest["hubs"]):
+        hubs.append({
+            "name": hub.get("name", "hub%d" % (i + 1)),
+            "usage": expand_usage_files(hub["usage"], base_dir) if expand else
+                     [os.path.join(base_dir, pattern) for pattern in hub["usage"]],
+            "users": os.path.join(base_dir, hub["users"]),
+            "provisioning": os.path.join(base_dir, hub["provisioning"]),
+        })
+    return (os.path.join(base_dir, manifest["features"]), hubs)
+
+def process_task(hub_name, file_a, lookup_files, file_d, output_formats=("xlsx",), profile=None, timeline=None,
+                 copy_sheets=False, compact=False, unknown=False, what_if=None, coalesce=None, constant_memory=False):
+    """
+    Run the per-month pipeline on one usage file. Never raises; failures are returned.
+    profile: None, "profile" (run report) or "cprofile" (run report and cProfile dump).
+    """
+    result = {"hub": hub_name, "usage": file_a, "output": None, "seconds": 0.0, "error": None}
+    t0 = time.perf_counter()
+    try:
+        if profile:
+            with ins.Profiler(cprofile=(profile == "cprofile")) as profiler:
+                result["output"] = mt.process_usage_file(file_a, _feature_lookup, _user_lookups[hub_name], file_d,
+                                                         _cache, lookup_files, output_formats, timeline,
+                                                         copy_sheets, compact, unknown, what_if, coalesce,
+                                                         constant_memory)
+            result["report"] = profiler.write_report(file_a, hub=hub_name, features=lookup_files[0],
+                                                     users=lookup_files[1], provisioning=file_d,
+                                                     outputs=result["output"], cache=_cache.enabled)
+        else:
+            result["output"] = mt.process_usage_file(file_a, _feature_lookup, _user_lookups[hub_name], file_d,
+                                                     _cache, lookup_files, output_formats, timeline, copy_sheets,
+                                                     compact, unknown, what_if, coalesce, constant_memory)
+    except SystemExit:
+        result["error"] = "pipeline exited (see messages above)"
+    except Exception as e:
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+        traceback.print_exc()
+    if os.path.exists(pf.report_path(file_a)):	# problems found in the usage rows
+        result["validation"] = pf.report_path(file_a)
+    result["seconds"] = round(time.perf_counter() - t0, 3)
+    return result
+
+def run_batch(file_b, hubs, jobs=None, cache=None, output_formats=("xlsx",), profile=None, timeline=None,
+              copy_sheets=False, compact=False, unknown=False, what_if=None, coalesce=None, constant_memory=False):
+    cache = cache or ch.Cache(enabled=False)
+    t_start = time.perf_counter()
+    summary = {"features": file_b, "files": [], "setup_seconds": {}}
+
+    # --- shared lookups, built once ---
+    t0 = time.perf_counter()
+    print("[1] Build mapping dictionary from EDA feature file: %s" % file_b)
+    feature_lookup = cache.cached("features", [file_b], lambda: mt.setup_feature_dictionary(file_b))
+    summary["setup_seconds"]["features"] = round(time.perf_counter() - t0, 3)
+
+    user_lookups = {}
+    for hub in hubs:
+        t0 = time.perf_counter()
+        print("[2] Build mapping dictionary from User list file: %s (%s)" % (hub["users"], hub["name"]))
+        user_lookups[hub["name"]] = cache.cached("users", [hub["users"]], lambda: mt.setup_user_dictionary(hub["users"]))
+        summary["setup_seconds"]["users:" + hub["name"]] = round(time.perf_counter() - t0, 3)
+
+    # --- per-month pipeline in worker processes ---
+    tasks = [(hub["name"], f, [file_b, hub["users"]], hub["provisioning"], output_formats, profile, timeline,
+              copy_sheets, compact, unknown, what_if, coalesce, constant_memory)
+             for hub in hubs for f in hub["usage"]]
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(feature_lookup, user_lookups, cache)) as pool:
+        futures = [pool.submit(process_task, *task) for task in tasks]
+        for future in as_completed(futures):
+            summary["files"].append(future.result())
+
+    order = {task[1]: i for i, task in enumerate(tasks)}
+    summary["files"].sort(key=lambda r: order[r["usage"]])
+    summary["failures"] = sum(1 for r in summary["files"] if r["error"])
+    summary["total_seconds"] = round(time.perf_counter() - t_start, 3)
+    return summary
+
+def print_summary(summary):
+    print("\n=== Batch summary: %d file(s), %d failure(s), %.1f s ===" % (
+        len(summary["files"]), summary["failures"], summary["total_seconds"]))
+    for r in summary["files"]:
+        status = "❌ " + r["error"] if r["error"] else "✅ " + r["output"]
+        if r.get("validation"):
+            status += "  (validation report: %s)" % r["validation"]
+        print("  [%s] %s  %.1f s  %s" % (r["hub"], r["usage"], r["seconds"], status))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process many monthly usage files in one run.")
+    parser.add_argument("usage", nargs="*", help="usage files (.xlsx/.csv/.parquet) or glob patterns (single hub)")
+    parser.add_argument("--manifest", help="JSON manifest listing the hubs and their files")
+    parser.add_argument("--features", help="feature mapping file (single hub)")
+    parser.add_argument("--users", help="user list file (single hub)")
+    parser.add_argument("--provisioning", help="current provisioning file (single hub)")
+    parser.add_argument("--hub", default="hub", help="hub name (single hub)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--summary", default=SUMMARY_FILE, help="run summary JSON file")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the on-disk cache")
+    parser.add_argument("--rebuild-cache", action="store_true", help="ignore cached entries and rebuild them")
+    parser.add_argument("--profile", action="store_true", help="write a run report per usage file")
+    parser.add_argument("--cprofile", action="store_true", help="--profile plus a cProfile dump per usage file")
+    parser.add_argument("--timeline", metavar="BUCKET", help="add concurrency timeline sheets (e.g. 15min, 1h, 1D)")
+    parser.add_argument("--copy-sheets", action="store_true",
+                        help="copy the other sheets of the usage workbooks as is, with their formatting")
+    parser.add_argument("--compact", action="store_true",
+                        help="keep the name columns of the usage frames as categoricals (less memory)")
+    parser.add_argument("--unknown", action="store_true",
+                        help="count unknown users and unmapped features under 'Unknown' instead of stopping")
+    parser.add_argument("--what-if", metavar="SEATS",
+                        help="add provisioning what-if sheets for these seat counts (e.g. 0-20 or 1,2,4,8)")
+    parser.add_argument("--coalesce", metavar="GAP",
+                        help="merge overlapping sessions of a user and feature within GAP (e.g. 0, 5min)")
+    parser.add_argument("--constant-memory", action="store_true",
+                        help="write the workbooks in xlsxwriter's constant-memory mode (Usage rows in chunks)")
+    parser.add_argument("--output-format", default="xlsx",
+                        help="xlsx, csv, parquet or a comma-separated list (default: xlsx)")
+    args = parser.parse_args(argv)
+    output_formats = mt.parse_output_formats(args.output_format)
+    profile = "cprofile" if args.cprofile else "profile" if args.profile else None
+    if args.timeline:
+        import timeline as tl
+        tl.parse_bucket(args.timeline)
+    if args.what_if:
+        import whatif as wi
+        wi.parse_seats(args.what_if)
+    if args.coalesce is not None:
+        import coalesce as cs
+        cs.parse_gap(args.coalesce)
+
+    if args.manifest:
+        (file_b, hubs) = load_manifest(args.manifest)
+    elif args.usage and args.features and args.users and args.provisioning:
+        file_b = args.features
+        hubs = [{"name": args.hub, "usage": expand_usage_files(args.usage),
+                 "users": args.users, "provisioning": args.provisioning}]
+    else:
+        parser.print_usage()
+        print("❌ Give either --manifest, or usage files with --features, --users and --provisioning.")
+        sys.exit(1)
+
+    cache = ch.Cache(enabled=not args.no_cache, rebuild=args.rebuild_cache)
+    summary = run_batch(file_b, hubs, args.jobs, cache, output_formats, profile, args.timeline, args.copy_sheets,
+                        args.compact, args.unknown, args.what_if, args.coalesce, args.constant_memory)
+    print_summary(summary)
+    with open(args.summary, "w") as f:
+        json.dump(summary, f, indent=2)
+    if summary["failures"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
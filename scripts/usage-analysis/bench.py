@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import platform
+import argparse
+import numpy as np
+import pandas as pd
+import xlsxwriter
+import match as mt
+import provision as pr
+import workbook as wb
+import cache as ch
+import instrument as ins
+
+# Benchmark of the match.py pipeline on synthetic CA-DREAMS inputs.
+#
+# generate() writes a usage workbook, a multi-vendor feature mapping, an
+# Admin-User List and a Current Provisioning workbook of the requested size
+# (numpy random data, fixed seed, no network).  run() processes them with
+# match.process_usage_file under instrument.Profiler, which records the wall
+# and CPU time, rows and peak memory of each stage.  Results are written as
+# JSON, and --compare prints the change of each stage against an earlier
+# result file.
+#
+#   python bench.py --rows 1000,100000,1000000 --json bench.json
+#   python bench.py --rows 100000 --compare bench.json
+#   python bench.py --rows 100000 --compact --compare bench.json
+
+RESULTS_FILE = "bench-results.json"
+DATA_DIR = "bench-data"
+
+VENDORS = ["Cadence", "Synopsys", "Siemens", "Ansys", "Keysight", "Silvaco"]
+ORGS = [("UCLA", "ProjA"), ("USC", "ProjA"), ("UCSD", "ProjB"), ("UCR", "ProjB"),
+        ("Stanford", "ProjC"), ("Caltech", "ProjC"), ("UCI", "ProjD"), ("UCSB", "ProjD")]
+FEATURES_PER_PRODUCT = 8
+DURATIONS_MIN = [0, 0, 5, 30, 60, 90, 240, 480]
+UNKNOWN_FEATURE_SHARE = 0.03	# usage rows with a feature missing from the mapping
+REMOVED_USER_SHARE = 0.02	# user list rows marked NOTES=remove
+
+def _excel_serial(ts):
+    # datetime64[s] -> Excel date serial number (1900 date system)
+    return (ts - np.datetime64("1899-12-30T00:00:00", "s")).astype(np.int64) / 86400.0
+
+def generate(out_dir, rows, num_users=2000, num_features=3000, header_row=2, seed=0):
+    """Write usage.xlsx, features.xlsx, users.xlsx and prov.xlsx to out_dir; returns their paths."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {k: os.path.join(out_dir, k + ".xlsx") for k in ("usage", "features", "users", "prov")}
+
+    # --- feature mapping: products of FEATURES_PER_PRODUCT features, spread over the vendors ---
+    num_products = max(1, num_features // FEATURES_PER_PRODUCT)
+    products = ["%s_P%d" % (VENDORS[p % len(VENDORS)], p) for p in range(num_products)]
+    features = ["%s_f%d" % (products[i % num_products], i // num_products) for i in range(num_features)]
+    feature_product = np.arange(num_features) % num_products
+
+    book = xlsxwriter.Workbook(paths["features"], {"constant_memory": True})
+    book.add_worksheet("ReadMe").write(0, 0, "Synthetic feature mapping")
+    for v, vendor in enumerate(VENDORS):
+        sheet = book.add_worksheet(vendor)
+        sheet.write(0, 0, "%s features" % vendor)
+        sheet.write_row(2, 0, ["Product", "Feature"])
+        row = 3
+        for i in np.flatnonzero(feature_product % len(VENDORS) == v):
+            sheet.write_row(row, 0, [products[feature_product[i]], features[i]])
+            row += 1
+    book.close()
+
+    # --- user list, with removed users and users without an organization ---
+    org = rng.integers(0, len(ORGS), num_users)
+    removed = rng.random(num_users) < REMOVED_USER_SHARE
+    book = xlsxwriter.Workbook(paths["users"], {"constant_memory": True})
+    book.add_worksheet("Other").write(0, 0, "x")
+    sheet = book.add_worksheet("Admin-User List")
+    sheet.write(0, 0, "Admin list")
+    sheet.write_row(2, 0, [mt.USER_LAST_NAME, mt.USER_FIRST_NAME, mt.USER_ORGANIZATION, mt.USER_PROJECT_NAME,
+                           mt.USER_EMAIL, "NOTES"])
+    for u in range(num_users):
+        sheet.write_row(3 + u, 0, ["Last%d" % u, "First%d" % u, ORGS[org[u]][0], ORGS[org[u]][1],
+                                   "user%d@example.org" % u, "Remove" if removed[u] else ""])
+    sheet.write_row(3 + num_users, 0, ["NoOrg", "N", "", "", "noorg@example.org", ""])
+    book.close()
+
+    # --- usage sessions over one month, by active users only ---
+    active = np.flatnonzero(~removed)
+    user = active[rng.integers(0, len(active), rows)]
+    feature = rng.integers(0, num_features, rows)
+    unknown = rng.random(rows) < UNKNOWN_FEATURE_SHARE
+    month = np.datetime64("2025-10-01T00:00:00", "s")
+    start = month + rng.integers(0, 30 * 24 * 3600, rows).astype("timedelta64[s]")
+    minutes = rng.choice(DURATIONS_MIN, rows)
+    end = start + (minutes * 60).astype("timedelta64[s]")
+    hours = np.round(minutes / 60.0, 2)
+    start_serial = _excel_serial(start)
+    end_serial = _excel_serial(end)
+
+    book = xlsxwriter.Workbook(paths["usage"], {"constant_memory": True})
+    date_format = book.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+    sheet = book.add_worksheet("Summary")
+    sheet.write_row(0, 0, ["Info", "Rows"])
+    sheet.write_row(1, 0, ["sessions", rows])
+    sheet = book.add_worksheet("Sessions")
+    first = header_row - 1
+    if header_row == 2:
+        sheet.write(0, 0, "Usage export")
+    sheet.write_row(first, 0, [mt.USG_USERNAME, "Email", mt.USG_FEATURE, "Feature", "Start Time", "End Time", mt.USG_TIME])
+    for r in range(rows):
+        name = "Unknown_feat%d" % feature[r] if unknown[r] else features[feature[r]]
+        sheet.write_string(first + 1 + r, 0, "user%d" % user[r])
+        sheet.write_string(first + 1 + r, 1, "user%d@example.org" % user[r])
+        sheet.write_string(first + 1 + r, 2, name)
+        sheet.write_string(first + 1 + r, 3, name)
+        sheet.write_number(first + 1 + r, 4, start_serial[r], date_format)
+        sheet.write_number(first + 1 + r, 5, end_serial[r], date_format)
+        sheet.write_number(first + 1 + r, 6, hours[r])
+    book.close()
+
+    # --- current provisioning: a subset of (project, performer, vendor, product) ---
+    book = xlsxwriter.Workbook(paths["prov"], {"constant_memory": True})
+    sheet = book.add_worksheet(pr.PROV_SHEET)
+    sheet.write(0, 0, "Select:")
+    sheet.write(1, 0, "All")
+    sheet.write_row(3, 0, [pr.PROV_PROJECT, pr.PROV_PERFORMER, pr.PROV_VENDOR, pr.PROV_PRODUCT,
+                           pr.PROV_CURRENT_PROV, "Comment"])
+    row = 4
+    for (org_name, project) in ORGS:
+        for p in rng.choice(num_products, min(num_products, 20), replace=False):
+            sheet.write_row(row, 0, [project, org_name, VENDORS[p % len(VENDORS)], products[p],
+                                     int(rng.integers(0, 5)), ""])
+            row += 1
+    book.close()
+    return paths
+
+def run(paths, compact=False):
+    """Process the generated inputs once; returns ({stage: wall seconds, "total": ...}, profiler report)."""
+    wb._CACHE.clear()
+    cache = ch.Cache(enabled=False)
+    with ins.Profiler() as profiler:
+        feature_lookup = mt.setup_feature_dictionary(paths["features"])
+        user_lookup = mt.setup_user_dictionary(paths["users"])
+        mt.process_usage_file(paths["usage"], feature_lookup, user_lookup, paths["prov"], cache, compact=compact)
+    report = profiler.report()
+    stages = {s["stage"]: s["wall"] for s in report["stages"]}
+    stages["total"] = report["total"]["wall"]
+    return (stages, report)
+
+def environment():
+    return {
+        "code_version": ch.code_version(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+def compare(results, baseline):
+    """Print each stage of `results` against the run of the same size in `baseline`."""
+    before = {(r["rows"], r["header_row"]): r["stages"] for r in baseline["runs"]}
+    for r in results["runs"]:
+        old = before.get((r["rows"], r["header_row"]))
+        if old is None:
+            continue
+        print("\n%d rows: %s -> %s" % (r["rows"], baseline["environment"]["code_version"],
+                                      results["environment"]["code_version"]))
+        for stage, s in r["stages"].items():
+            if stage in old:
+                print("  %-32s %9.3f s  %9.3f s  %+7.1f%%" % (stage, old[stage], s,
+                                                             100.0 * (s - old[stage]) / max(old[stage], 1e-9)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark match.py on synthetic inputs (offline).")
+    parser.add_argument("--rows", default="1000,100000", help="comma-separated usage row counts")
+    parser.add_argument("--users", type=int, default=2000, help="number of users in the user list")
+    parser.add_argument("--features", type=int, default=3000, help="number of mapped features")
+    parser.add_argument("--header-row", type=int, choices=[1, 2], default=2, help="row of the usage header")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per size; the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=DATA_DIR, help="where the generated inputs are kept")
+    parser.add_argument("--regenerate", action="store_true", help="regenerate inputs that already exist")
+    parser.add_argument("--json", default=RESULTS_FILE, help="results file")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--compact", action="store_true", help="run the pipeline with --compact usage frames")
+    args = parser.parse_args()
+
+    results = {"environment": environment(), "runs": []}
+    for rows in [int(n) for n in args.rows.split(",")]:
+        out_dir = os.path.join(args.data_dir, "%d-u%d-f%d-h%d-s%d" % (
+            rows, args.users, args.features, args.header_row, args.seed))
+        paths = {k: os.path.join(out_dir, k + ".xlsx") for k in ("usage", "features", "users", "prov")}
+        if args.regenerate or not all(os.path.exists(p) for p in paths.values()):
+            t0 = time.perf_counter()
+            generate(out_dir, rows, args.users, args.features, args.header_row, args.seed)
+            print("Generated %d rows in %s (%.1f s)" % (rows, out_dir, time.perf_counter() - t0))
+
+        runs = [run(paths, args.compact) for _ in range(args.repeat)]
+        (best, report) = min(runs, key=lambda r: r[0]["total"])
+        results["runs"].append({"rows": rows, "users": args.users, "features": args.features,
+                                "header_row": args.header_row, "compact": args.compact, "stages": best,
+                                "profile": {"total": report["total"], "stages": report["stages"]}})
+        print("\n%d rows:" % rows)
+        for stage, s in best.items():
+            print("  %-32s %9.3f s" % (stage, s))
+
+    with open(args.json, "w") as f:
+        json.dump(results, f, indent=2)
+    print("\nResults written to %s" % args.json)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
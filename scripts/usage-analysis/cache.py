@@ -0,0 +1,136 @@
+import os
+import glob
+import time
+import pickle
+import hashlib
+
+# Persistent on-disk cache of parsed lookups and enriched usage frames.
+#
+# An entry is keyed by the content hash of its source files plus the code
+# version (a hash of the scripts in this directory), so editing an input file
+# or the code invalidates it automatically.  Entries are stored with pickle,
+# which round-trips DataFrames exactly, including mixed object columns that
+# Parquet/Arrow would coerce.  When the cache grows over its size limit the
+# least recently used entries are removed.
+
+CACHE_DIR = os.environ.get("USAGE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ca-dreams-usage"))
+CACHE_MAX_MB = int(os.environ.get("USAGE_CACHE_MAX_MB", "1024"))
+
+_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+_code_version = None
+_file_hashes = {}	# (path, size, mtime) -> content hash
+
+def code_version():
+    global _code_version
+    if _code_version is None:
+        h = hashlib.sha256()
+        for path in sorted(glob.glob(os.path.join(_SCRIPT_DIR, "*.py"))):
+            with open(path, "rb") as f:
+                h.update(f.read())
+        _code_version = h.hexdigest()[:16]
+    return _code_version
+
+def file_hash(path):
+    st = os.stat(path)
+    memo = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo not in _file_hashes:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        _file_hashes[memo] = h.hexdigest()
+    return _file_hashes[memo]
+
+class Cache:
+    """
+    enabled=False (--no-cache) neither reads nor writes entries;
+    rebuild=True (--rebuild-cache) ignores existing entries and overwrites them.
+    """
+    def __init__(self, directory=CACHE_DIR, max_mb=CACHE_MAX_MB, enabled=True, rebuild=False):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.enabled = enabled
+        self.rebuild = rebuild
+
+    def key(self, kind, sources):
+        h = hashlib.sha256((kind + ":" + code_version()).encode())
+        for source in sources:
+            h.update(file_hash(source).encode())
+        return "%s-%s" % (kind, h.hexdigest()[:32])
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def get(self, key):
+        if not self.enabled or self.rebuild:
+            return None
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(path)		# mark as recently used
+        return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)	# atomic, safe with parallel batch workers
+        self.evict()
+
+    def cached(self, kind, sources, build):
+        """Return the cached value for `kind` built from `sources`, or build() and store it."""
+        if not self.enabled:
+            return build()
+        key = self.key(kind, sources)
+        value = self.get(key)
+        if value is None:
+            value = build()
+            self.put(key, value)
+        else:
+            print("    (cached %s: %s)" % (kind, ", ".join(os.path.basename(s) for s in sources)))
+        return value
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*.pkl")):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(e[1] for e in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+def from_args(argv):
+    """Build a Cache from the --no-cache / --rebuild-cache flags in argv."""
+    return Cache(enabled="--no-cache" not in argv, rebuild="--rebuild-cache" in argv)
+
+if __name__ == "__main__":
+    # python cache.py [--clear]: show (or clear) the cache directory
+    import sys
+    files = glob.glob(os.path.join(CACHE_DIR, "*.pkl"))
+    if "--clear" in sys.argv:
+        for path in files:
+            os.remove(path)
+        print("Removed %d cache entries from %s" % (len(files), CACHE_DIR))
+    else:
+        size = sum(os.path.getsize(p) for p in files)
+        print("%s: %d entries, %.1f MB (limit %d MB)" % (CACHE_DIR, len(files), size / 1e6, CACHE_MAX_MB))
+        for path in sorted(files, key=os.path.getmtime, reverse=True):
+            print("  %s  %s  %.1f MB" % (time.strftime("%Y-%m-%d %H:%M", time.localtime(os.path.getmtime(path))),
+                                      os.path.basename(path), os.path.getsize(path) / 1e6))
@@ -0,0 +1,122 @@
+import sys
+import os
+import argparse
+
+# Command line entry point with subcommands.
+#
+# Only the standard library is imported up front: pandas, openpyxl and
+# xlsxwriter are loaded by the subcommands that process data (run, batch,
+# ytd, store, watch), and `validate` / `inspect-headers` never load them.  Usage
+# errors and missing input files are reported before anything heavy is
+# imported.
+#
+#   python cli.py run <usage> <features> <users> <provisioning> [match.py options]
+#   python cli.py batch [batch.py options]
+#   python cli.py ytd [ytd.py options]
+#   python cli.py store <load|months|hours|...> [store.py options]
+#   python cli.py watch [watch.py options]
+#   python cli.py validate <usage> <features> <users> [<provisioning>]
+#   python cli.py inspect-headers <file> ...
+
+# match.py options followed by a value
+RUN_VALUE_OPTIONS = ("--output-format", "--timeline", "--what-if", "--coalesce")
+
+def positional(argv, value_options=RUN_VALUE_OPTIONS):
+    """The arguments of argv that are not options or option values."""
+    args = []
+    skip = False
+    for a in argv:
+        if skip:
+            skip = False
+        elif a in value_options:
+            skip = True
+        elif not a.startswith("--"):
+            args.append(a)
+    return args
+
+def missing_files(paths):
+    missing = [p for p in paths if not os.path.exists(p)]
+    for p in missing:
+        print("❌ %s: file not found" % p)
+    return missing
+
+def run(argv):
+    files = positional(argv)
+    if len(files) < 4:
+        print("Usage: python cli.py run <Usage log> <EDA feature> <User list> <Current provisioning> [match.py options]")
+        sys.exit(1)
+    if missing_files(files[:4]):
+        sys.exit(1)
+    import match
+    match.main(["cli.py run"] + argv)
+
+def batch(argv):
+    import batch
+    batch.main(argv)
+
+def ytd(argv):
+    import ytd
+    ytd.main(argv)
+
+def store(argv):
+    import store
+    store.main(argv)
+
+def watch(argv):
+    import watch
+    watch.main(argv)
+
+# subcommands that hand their arguments to a script as they are
+COMMANDS = {
+    "run": (run, "process one usage file (match.py options)"),
+    "batch": (batch, "process many usage files (batch.py options)"),
+    "ytd": (ytd, "fold monthly usage into a year-to-date summary (ytd.py options)"),
+    "store": (store, "load and query the local usage store (store.py subcommands)"),
+    "watch": (watch, "process usage files as they arrive in a folder, with an HTTP API (watch.py options)"),
+}
+
+def validate(args):
+    import validate as vl
+    paths = [args.usage, args.features, args.users] + ([args.provisioning] if args.provisioning else [])
+    if missing_files(paths):
+        sys.exit(1)
+    errors = vl.validate(args.usage, args.features, args.users, args.provisioning)
+    if errors:
+        print("❌ %d problem(s) found" % errors)
+        sys.exit(1)
+    print("✅ inputs look good")
+
+def inspect_headers(args):
+    import validate as vl
+    if missing_files(args.files):
+        sys.exit(1)
+    for path in args.files:
+        vl.inspect_headers(path)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:	# not parsed here: the script parses its own options
+        COMMANDS[argv[0]][0](argv[1:])
+        return
+
+    parser = argparse.ArgumentParser(description="Analyze monthly EDA tool usage.")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+    for (name, (_, text)) in COMMANDS.items():
+        commands.add_parser(name, help=text)
+
+    p = commands.add_parser("validate", help="check the input headers and key coverage, without processing")
+    p.add_argument("usage")
+    p.add_argument("features")
+    p.add_argument("users")
+    p.add_argument("provisioning", nargs="?")
+    p.set_defaults(func=validate)
+
+    p = commands.add_parser("inspect-headers", help="show the sheets and detected header rows of input files")
+    p.add_argument("files", nargs="+")
+    p.set_defaults(func=inspect_headers)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import sys
+import numpy as np
+import pandas as pd
+import match as mt
+import concurrency as cc
+
+# Per-user session coalescing before aggregation (--coalesce GAP).
+#
+# License servers often log overlapping checkouts of one feature by one user
+# (several tool windows, re-checkouts after a network blip).  Counted row by
+# row they inflate both the concurrency and the hours.  Here the sessions of
+# each (project, org, vendor, product, feature, user) group of the usage
+# aggregate are sorted by start time, and a session is merged into the one
+# before it if it starts no later than GAP after the latest end so far
+# (GAP 0 merges overlapping and back-to-back sessions only).  A merged
+# session runs from its first start to its last end.  Its hours are counted
+# per run of overlapping rows within it: the sum of the usage hours of the
+# run, capped at the run's span, so the gaps between runs are never counted
+# and the hours do not grow with GAP.
+#
+# Only sessions with usage time and valid times (start <= end) are merged;
+# other rows are passed on as they are.  The merged session takes the place
+# of its earliest row, so groups keep their order of first appearance.  The
+# Usage sheet keeps the original rows; only the aggregate (summaries,
+# concurrency, timeline and what-if sheets) sees the merged sessions.
+
+NS_PER_HOUR = 3600 * 10**9
+
+def parse_gap(value):
+    """Gap tolerance such as 0, 30s or 5min, as a timedelta64[ns]."""
+    try:
+        gap = pd.Timedelta(0 if str(value).strip() == "0" else value)
+    except ValueError:
+        gap = None
+    if gap is None or gap < pd.Timedelta(0):
+        print("❌ Invalid coalescing gap '%s' (e.g. 0, 30s, 5min)" % value)
+        sys.exit(1)
+    return gap.to_timedelta64().astype("timedelta64[ns]")
+
+def coalesce_sessions(df, gap):
+    """
+    The rows of the enriched usage frame that aggregate_usage reads (PIVOT_KEYS,
+    Start/End Time and usage time), with the sessions of each group merged
+    within `gap`.  Returns (frame, number of rows merged away).
+    """
+    gap = parse_gap(gap) if isinstance(gap, str) else np.timedelta64(gap, "ns")
+    frame = pd.DataFrame({k: df[k] for k in mt.PIVOT_KEYS})
+    starts = cc.to_datetime64(df["Start Time"].to_numpy())
+    ends = cc.to_datetime64(df["End Time"].to_numpy())
+    hours = pd.to_numeric(df[mt.USG_TIME], errors="coerce").to_numpy(dtype=float)
+
+    # sessions that can be merged, sorted by group, then start time
+    codes = frame.groupby(mt.PIVOT_KEYS, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+    rows = np.flatnonzero((hours > 0) & (starts <= ends))	# False for NaT
+    rows = rows[np.lexsort((starts[rows], codes[rows]))]
+    (g, s, e) = (codes[rows], starts[rows].view(np.int64), ends[rows].view(np.int64))
+
+    # a session opens a new merged session if it is the first of its group or
+    # starts more than `gap` after the latest end of the sessions before it
+    latest = pd.Series(e).groupby(g).cummax().to_numpy()
+    new = np.r_[True, (g[1:] != g[:-1]) | (s[1:] > latest[:-1] + gap.astype(np.int64))]
+    first = np.flatnonzero(new)
+    merged_away = len(rows) - len(first)
+
+    # the hours of a merged session: per run of overlapping rows (gap 0), the
+    # sum of their usage hours capped at the run's span, summed over the runs
+    run = np.flatnonzero(np.r_[True, (g[1:] != g[:-1]) | (s[1:] > latest[:-1])])
+    run_span = (np.maximum.reduceat(e, run) - s[run]) / NS_PER_HOUR if len(run) else np.zeros(0)
+    run_total = np.add.reduceat(hours[rows], run) if len(run) else np.zeros(0)
+    run_hours = np.where(np.diff(np.r_[run, len(rows)]) > 1, np.minimum(run_total, run_span), run_total)
+
+    keep = np.ones(len(df), dtype=bool)
+    start_col = starts.copy()
+    end_col = ends.copy()
+    hour_col = hours.copy()
+    if merged_away:
+        merged = np.searchsorted(first, run, side="right") - 1	# merged session of each run
+        rep = np.minimum.reduceat(rows, first)	# earliest row of each merged session
+        keep[rows] = False
+        keep[rep] = True
+        start_col[rep] = s[first].view("datetime64[ns]")
+        end_col[rep] = np.maximum.reduceat(e, first).view("datetime64[ns]")
+        hour_col[rep] = np.bincount(merged, weights=run_hours, minlength=len(first))
+
+    frame["Start Time"] = start_col
+    frame["End Time"] = end_col
+    frame[mt.USG_TIME] = hour_col
+    return (frame[keep].reset_index(drop=True), merged_away)
+
+def coalesce_usage(df, gap):
+    """Step 2.3: coalesce_sessions with a report of the merged rows and hours."""
+    print("[2.3] Coalesce overlapping sessions per user and feature (gap %s)" % gap)
+    (frame, merged_away) = coalesce_sessions(df, gap)
+    report(merged_away, len(df), pd.to_numeric(df[mt.USG_TIME], errors="coerce").sum() - frame[mt.USG_TIME].sum())
+    return frame
+
+def report(merged_away, nrows, hours_removed):
+    print("    %d of %d rows merged into the session before them, %.1f hours of overlap removed" % (
+        merged_away, nrows, hours_removed))
+
+# -- regression check: the hours of merged sessions do not grow with the gap
+
+def self_check():
+    day = pd.Timestamp("2025-10-01")
+    times = [("10:00", "11:00"), ("10:00", "11:00"), ("11:30", "12:00")]
+    df = pd.DataFrame({k: "x" for k in mt.PIVOT_KEYS}, index=range(len(times)))
+    df["Start Time"] = [day + pd.Timedelta(a + ":00") for (a, _) in times]
+    df["End Time"] = [day + pd.Timedelta(b + ":00") for (_, b) in times]
+    df[mt.USG_TIME] = [1.0, 1.0, 0.5]
+    for gap in ["0", "5min", "1h"]:
+        (frame, _) = coalesce_sessions(df, gap)
+        hours = frame[mt.USG_TIME].sum()
+        assert abs(hours - 1.5) < 1e-9, "gap %s: %.2f hours, expected 1.5" % (gap, hours)
+    print("coalesce self-check passed")
+
+if __name__ == "__main__":
+    # python coalesce.py
+    self_check()
@@ -0,0 +1,120 @@
+import re
+import itertools
+
+# Column names and header keywords of the input files, the rules that find
+# header rows and columns, and the conversion of numeric and CSV cells, shared
+# by the pipeline (match.py, provision.py, workbook.py, stream.py) and the
+# quick checks of validate.py, so both always read the inputs the same way.
+# The header rules take rows as lists of cell values (any iterable of rows;
+# they stop at the row they need).
+#
+# Standard library only: validate.py imports it without loading pandas.
+
+# -- usage sheet
+USG_USERNAME = "User Name"
+USG_EMAIL = "Email"
+USG_FEATURE = "Product"
+USG_KEY_FEATURE = "Feature"
+USG_START = "Start Time"
+USG_END = "End Time"
+USG_TIME = "Total usage time (hours)"
+# columns of the usage sheet the pipeline reads
+USAGE_COLUMNS = [USG_USERNAME, USG_EMAIL, USG_FEATURE, USG_KEY_FEATURE, USG_START, USG_END, USG_TIME]
+# lower-case header cells that mark the header row (row 1 or 2) of a usage
+# sheet; "product name" is the column match.py adds, as in a processed workbook
+USAGE_MARKERS = [USG_USERNAME.lower(), "product name"]
+
+# -- feature file
+F_PRODUCT = "Product"
+F_FEATURE = "Feature"
+# optional rule kind of the Feature cell: exact, prefix, glob or regex (see featurematch.py)
+F_MATCH = "Match"
+# vendor column of a CSV/Parquet feature file (an Excel file has one sheet per vendor)
+F_VENDOR = "Vendor"
+
+# -- user list
+USER_SHEET = "Admin-User List"
+USER_LAST_NAME = "LAST NAME"
+USER_FIRST_NAME = "FIRST NAME"
+USER_ORGANIZATION = "ORGANIZATION"
+USER_PROJECT_NAME = "PROJECT NAME"
+USER_EMAIL = "microelectornics.us E-MAIL"
+USER_NOTES = "NOTES"
+USER_COLUMNS = [USER_LAST_NAME, USER_FIRST_NAME, USER_ORGANIZATION, USER_PROJECT_NAME, USER_EMAIL, USER_NOTES]
+
+# -- provisioning file
+PROV_SHEET = "Current Provisioning"
+# candidate column name keywords (case-insensitive, partial matches allowed)
+PROV_PROJECT = "Project"
+PROV_PERFORMER = "Performer"
+PROV_VENDOR = "Vendor"
+PROV_PRODUCT = "Product Feature"
+PROV_CURRENT_PROV = "Current Provision"   # value column to accumulate
+PROV_KEYWORDS = [PROV_PROJECT, PROV_PERFORMER, PROV_VENDOR, PROV_PRODUCT, PROV_CURRENT_PROV]
+# how far to search for the header row (some tolerance)
+MAX_HEADER_SEARCH_ROWS = 20
+
+# -- single-table files, read as a workbook with one sheet
+CSV_EXTENSIONS = (".csv",)
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+
+def _blank(value):
+    return value is None or value == "" or (isinstance(value, float) and value != value)
+
+def cell_text(value):
+    """A cell as stripped text ("" for empty and NaN cells)."""
+    return "" if _blank(value) else str(value).strip()
+
+def usage_header_row(rows):
+    """Header row (0 or 1) of a usage sheet: the first of its first two rows with a USAGE_MARKERS cell, else 0."""
+    for (i, row) in enumerate(itertools.islice(rows, 2)):
+        if any(cell_text(v).lower() in USAGE_MARKERS for v in row):
+            return i
+    return 0
+
+def row_containing(rows, values, max_rows=None):
+    """Index of the first row that has every one of `values` as a cell (exact match), or None."""
+    for (i, row) in enumerate(itertools.islice(rows, max_rows)):
+        if all(v in row for v in values):
+            return i
+    return None
+
+def keyword_row(rows, keywords, max_rows=MAX_HEADER_SEARCH_ROWS):
+    """
+    Index of the first of `max_rows` rows in which every keyword is part of
+    some cell (case-insensitive), or None.
+    """
+    for (i, row) in enumerate(itertools.islice(rows, max_rows)):
+        cells = [c for c in (cell_text(v).lower() for v in row) if c]
+        if all(any(kw.lower() in c for c in cells) for kw in keywords):
+            return i
+    return None
+
+def keyword_column(names, keyword):
+    """The first of `names` that contains `keyword` (case-insensitive), or None."""
+    keyword = keyword.lower()
+    return next((name for name in names if keyword in cell_text(name).lower()), None)
+
+def convert_number(value):
+    # a numeric cell (a number, or its text in the sheet XML) as int if whole,
+    # else float, as pandas' openpyxl reader does
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return value
+    val = int(value)
+    if val == value:
+        return val
+    return float(value)
+
+_NUMBER = re.compile(r"[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$")
+
+def convert_csv_cell(value):
+    # numbers as int/float like convert_number, everything else stays text
+    if not _NUMBER.match(value):
+        return value
+    val = float(value)
+    if val.is_integer() and "." not in value and "e" not in value.lower():
+        return int(value)
+    return val
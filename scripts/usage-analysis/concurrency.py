@@ -0,0 +1,277 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# Sweep-line concurrency on datetime64 intervals.
+#
+# Sessions are (start, end) pairs of datetime64[ns].  Peak concurrency of many
+# groups is computed at once: start (+1) and end (-1) events of all groups are
+# concatenated and sorted by (group, time, change), so that at the same time
+# an end is processed before a start.  Because every group has as many ends as
+# starts, the running sum over all events returns to 0 at each group boundary
+# and a segment-wise max of the cumulative sum gives the peak of every group.
+# Zero-length sessions, sessions with a missing time and sessions that end
+# before they start are ignored.
+
+NO_INTERVALS = np.empty((0, 2), dtype="datetime64[ns]")
+
+def to_datetime64(values):
+    """Parse start/end time values once into a datetime64[ns] array (NaT if unparseable)."""
+    if isinstance(values, np.ndarray) and values.dtype.kind == "M":	# already parsed, e.g. by read_excel
+        return values.astype("datetime64[ns]")
+    return pd.to_datetime(pd.Series(values, dtype=object), errors="coerce").to_numpy("datetime64[ns]")
+
+def to_intervals(A):
+    """Convert a list of [start_time, end_time] into an (n, 2) datetime64 array."""
+    if len(A) == 0:
+        return NO_INTERVALS
+    A = list(A)
+    return np.column_stack([to_datetime64([a[0] for a in A]), to_datetime64([a[1] for a in A])])
+
+def _sorted_events(starts, ends, groups, ngroups):
+    """
+    Start (+1) and end (-1) events of all groups, sorted by (group, time,
+    change): (group, time as int64 ns, change, order key).  Zero-length, NaT
+    and reversed (end before start) sessions are dropped.
+    """
+    starts = np.asarray(starts, dtype="datetime64[ns]")
+    ends = np.asarray(ends, dtype="datetime64[ns]")
+    groups = np.asarray(groups, dtype=np.int64)
+
+    keep = starts < ends	# False for NaT
+    n = int(keep.sum())
+    times = np.concatenate([starts[keep], ends[keep]]).view(np.int64)
+    change = np.concatenate([np.ones(n, dtype=np.int64), -np.ones(n, dtype=np.int64)])
+    event_groups = np.concatenate([groups[keep], groups[keep]])
+    if n == 0:
+        return (event_groups, times, change, times)
+
+    # one sort: by group, then time, then end (-1) before start (+1)
+    rank = _time_rank(times, change)
+    order = _event_order(rank, times, change, event_groups, ngroups)
+    return (event_groups[order], times[order], change[order], rank[order])
+
+def _sweep(starts, ends, groups, ngroups):
+    """
+    Sorted start/end events of all groups: (group, time as int64 ns, number of
+    sessions open after the event).  Zero-length and NaT sessions are dropped.
+    """
+    (event_groups, times, change, _) = _sorted_events(starts, ends, groups, ngroups)
+    return (event_groups, times, np.cumsum(change))
+
+def peak_concurrency(starts, ends, groups, ngroups):
+    """
+    Peak number of overlapping sessions per group.
+    `groups` holds the group id (0 .. ngroups-1) of each session.
+    Groups without sessions get 0.
+    """
+    (event_groups, times, running) = _sweep(starts, ends, groups, ngroups)
+    peaks = np.zeros(ngroups, dtype=np.int64)
+    if len(times) == 0:
+        return peaks
+
+    first = np.flatnonzero(np.r_[True, event_groups[1:] != event_groups[:-1]])
+    peaks[event_groups[first]] = np.maximum.reduceat(running, first)
+    return peaks
+
+def _time_rank(times, change):
+    # (time, change) as one int64 that sorts like the pair: times are rebased
+    # and divided by their common step (e.g. whole seconds) to keep it small
+    rel = times - times.min()
+    step = int(np.gcd.reduce(rel)) or 1
+    return (rel // step) * 2 + (change > 0)
+
+def _event_order(rank, times, change, event_groups, ngroups, kind=None):
+    # Pack (group, time, change) into one int64 key when it fits, so a single
+    # argsort orders all events.
+    width = int(rank.max()) + 1 if len(rank) else 1
+    if ngroups * width < 2**62:
+        return np.argsort(event_groups * width + rank, kind=kind)
+    return np.lexsort((change, times, event_groups))
+
+def group_peaks(interval_arrays):
+    """Peak concurrency of each (n, 2) interval array in the list, computed in one sweep."""
+    lengths = [len(a) for a in interval_arrays]
+    if sum(lengths) == 0:
+        return np.zeros(len(interval_arrays), dtype=np.int64)
+    stacked = np.concatenate(interval_arrays)
+    groups = np.repeat(np.arange(len(interval_arrays)), lengths)
+    return peak_concurrency(stacked[:, 0], stacked[:, 1], groups, len(interval_arrays))
+
+class IntervalIndex:
+    """
+    Start/end events of the sessions of a set of groups (e.g. the features
+    of each performer), sorted by (group, time, end before start).
+
+    merge() combines the groups into parent groups (product, vendor, project,
+    all performers, ...).  The events of every child group are already a
+    sorted run, so the stable sort of merge() only merges those runs (numpy's
+    timsort finds and merges them) instead of sorting all events again, and
+    a hierarchy is built level by level from the index below it.
+    """
+    def __init__(self, groups, times, change, rank, ngroups):
+        self.groups = groups
+        self.times = times
+        self.change = change
+        self.rank = rank	# (time, change) order key
+        self.ngroups = ngroups
+
+    @classmethod
+    def from_intervals(cls, interval_arrays):
+        """Index of one group per (n, 2) interval array in the list."""
+        lengths = [len(a) for a in interval_arrays]
+        stacked = np.concatenate(interval_arrays) if sum(lengths) else NO_INTERVALS
+        groups = np.repeat(np.arange(len(interval_arrays)), lengths)
+        (groups, times, change, rank) = _sorted_events(stacked[:, 0], stacked[:, 1], groups, len(interval_arrays))
+        return cls(groups, times, change, rank, len(interval_arrays))
+
+    def merge(self, parents, nparents):
+        """Index of the parent groups; parents[g] is the parent (0 .. nparents-1) of group g."""
+        groups = np.asarray(parents, dtype=np.int64)[self.groups]
+        order = _event_order(self.rank, self.times, self.change, groups, nparents, kind="stable")
+        return IntervalIndex(groups[order], self.times[order], self.change[order], self.rank[order], nparents)
+
+    def peaks(self):
+        """Peak number of overlapping sessions per group (0 for groups without sessions)."""
+        peaks = np.zeros(self.ngroups, dtype=np.int64)
+        if len(self.times) == 0:
+            return peaks
+        running = np.cumsum(self.change)
+        first = np.flatnonzero(np.r_[True, self.groups[1:] != self.groups[:-1]])
+        peaks[self.groups[first]] = np.maximum.reduceat(running, first)
+        return peaks
+
+# -- timelines: concurrency over fixed time buckets and time spent (or sessions started) at each level
+
+def bucket_peaks(starts, ends, groups, ngroups, origin, bucket, nbuckets):
+    """
+    Peak concurrency of each group in each time bucket
+    [origin + i * bucket, origin + (i + 1) * bucket), as an (ngroups, nbuckets) array.
+    `origin` is a datetime64, `bucket` a timedelta64; all sessions must start at or after origin.
+    """
+    (event_groups, times, running) = _sweep(starts, ends, groups, ngroups)
+    peaks = np.zeros(ngroups * nbuckets, dtype=np.int64)
+    if len(times) == 0:
+        return peaks.reshape(ngroups, nbuckets)
+    origin = np.datetime64(origin, "ns").astype(np.int64)
+    bucket = np.timedelta64(bucket, "ns").astype(np.int64)
+
+    # the count at a time is the one after its last event (several sessions
+    # may end at once); events after the last bucket can only lower it
+    b = (times - origin) // bucket
+    inside = (b < nbuckets) & np.r_[(event_groups[1:] != event_groups[:-1]) | (times[1:] != times[:-1]), True]
+    (event_groups, times, running, b) = (event_groups[inside], times[inside], running[inside], b[inside])
+
+    # events are sorted by (group, time), so each (group, bucket) is a contiguous segment
+    key = event_groups * nbuckets + b
+    first = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    last = np.r_[first[1:], len(key)] - 1
+    peaks[key[first]] = np.maximum.reduceat(running, first)
+
+    # sessions still open from an earlier bucket: the count after the last event
+    # of the group before the bucket (forward filled within the group)
+    pos = np.arange(ngroups * nbuckets)
+    seen = np.full(ngroups * nbuckets, -1, dtype=np.int64)
+    seen[key[first]] = key[first]
+    before = np.r_[-1, np.maximum.accumulate(seen)[:-1]]
+    level_after = np.zeros(ngroups * nbuckets, dtype=np.int64)
+    level_after[key[last]] = running[last]
+    carried = np.where(before >= pos - pos % nbuckets, level_after[np.maximum(before, 0)], 0)
+
+    # a bucket with events at its very start begins at the level after them
+    at_start = np.zeros(ngroups * nbuckets, dtype=bool)
+    at_start[key[first]] = times[first] == origin + b[first] * bucket
+    carried[at_start] = 0
+    return np.maximum(peaks, carried).reshape(ngroups, nbuckets)
+
+def level_durations(starts, ends, groups, ngroups):
+    """
+    Time spent at each concurrency level, per group: an (ngroups, max level + 1)
+    float array of nanoseconds (column 0, idle time, is not counted).
+    """
+    return level_histograms(starts, ends, groups, ngroups)[0]
+
+def level_histograms(starts, ends, groups, ngroups):
+    """
+    Time spent at each concurrency level and number of sessions started at
+    each level (the count just after the session opens), per group: two
+    (ngroups, max level + 1) arrays, float nanoseconds and int64 counts.
+    Sessions starting at the same time are counted at successive levels.
+    """
+    (event_groups, times, change, _) = _sorted_events(starts, ends, groups, ngroups)
+    if len(times) == 0:
+        return (np.zeros((ngroups, 1)), np.zeros((ngroups, 1), dtype=np.int64))
+    running = np.cumsum(change)
+    levels = int(running.max()) + 1
+    same = event_groups[1:] == event_groups[:-1]
+    cell = event_groups[:-1][same] * levels + running[:-1][same]
+    spent = np.bincount(cell, weights=np.diff(times)[same], minlength=ngroups * levels)
+    opened = change > 0
+    started = np.bincount(event_groups[opened] * levels + running[opened], minlength=ngroups * levels)
+    return (spent.reshape(ngroups, levels), started.reshape(ngroups, levels))
+
+def first_peak_times(starts, ends, groups, ngroups):
+    """Peak concurrency per group and the time it is first reached (NaT for groups without sessions)."""
+    (event_groups, times, running) = _sweep(starts, ends, groups, ngroups)
+    peaks = np.zeros(ngroups, dtype=np.int64)
+    at = np.full(ngroups, np.datetime64("NaT"), dtype="datetime64[ns]")
+    if len(times) == 0:
+        return (peaks, at)
+    first = np.flatnonzero(np.r_[True, event_groups[1:] != event_groups[:-1]])
+    peaks[event_groups[first]] = np.maximum.reduceat(running, first)
+    hit = np.flatnonzero(running == peaks[event_groups])
+    (hit_groups, index) = np.unique(event_groups[hit], return_index=True)
+    at[hit_groups] = times[hit[index]].view("datetime64[ns]")
+    return (peaks, at)
+
+# -- microbenchmark against the former per-list string sweep
+
+def _legacy_concurrency(A):
+    events = []
+    for start_time, end_time in A:
+        if (start_time == end_time):
+            continue
+        events.append((start_time, 1))
+        events.append((end_time, -1))
+    events.sort(key=lambda x: (x[0], x[1]))
+    max_concurrency = 0
+    current = 0
+    for _, change in events:
+        current += change
+        max_concurrency = max(max_concurrency, current)
+    if (max_concurrency < 1): max_concurrency = 1
+    return max_concurrency
+
+def benchmark(num_sessions=200000, num_groups=500, seed=0):
+    rng = np.random.default_rng(seed)
+    base = np.datetime64("2025-10-01T00:00:00", "ns")
+    starts = base + rng.integers(0, 30 * 24 * 60, num_sessions).astype("timedelta64[m]")
+    ends = starts + rng.choice([0, 5, 30, 60, 240], num_sessions).astype("timedelta64[m]")
+    groups = rng.integers(0, num_groups, num_sessions)
+
+    # the former pipeline: one list of [str(start), str(end)] per group
+    str_starts = pd.Series(starts).map(str).tolist()
+    str_ends = pd.Series(ends).map(str).tolist()
+    lists = [[] for _ in range(num_groups)]
+    for g, s, e in zip(groups, str_starts, str_ends):
+        lists[g].append([s, e])
+
+    t0 = time.perf_counter()
+    legacy = [_legacy_concurrency(A) if A else 0 for A in lists]
+    t_legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    peaks = peak_concurrency(starts, ends, groups, num_groups)
+    peaks = np.where(np.bincount(groups, minlength=num_groups) > 0, np.maximum(peaks, 1), 0)
+    t_numpy = time.perf_counter() - t0
+
+    assert list(peaks) == legacy, "peak concurrency differs from the legacy sweep"
+    print("%d sessions, %d groups" % (num_sessions, num_groups))
+    print("  legacy string sweep : %8.3f s" % t_legacy)
+    print("  numpy sweep         : %8.3f s  (%.1fx)" % (t_numpy, t_legacy / max(t_numpy, 1e-9)))
+
+if __name__ == "__main__":
+    # python concurrency.py [sessions] [groups]
+    args = [int(a) for a in sys.argv[1:3]]
+    benchmark(*args)
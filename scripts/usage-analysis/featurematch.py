@@ -0,0 +1,143 @@
+import re
+import fnmatch
+
+# Feature rules of the feature mapping, compiled into one matcher.
+#
+# Each row of a vendor sheet maps a license feature to a product.  Its Feature
+# cell is an exact feature name, unless the sheet has a "Match" column saying
+# exact, prefix, glob or regex, or, without one, the cell
+#   ends in "*" and has no other wildcard   prefix   e.g. Virtuoso_*
+#   contains "*" or "?"                     glob     e.g. Spectre_f?_v*
+#   starts with "re:"                       regex    e.g. re:Calibre_f\d+(?:_v\d+)?
+# A usage feature is resolved by, in this order:
+#   1. the exact rule of that name (the last row wins, as before)
+#   2. the longest prefix rule, found by walking a character trie
+#   3. the first glob or regex rule, in sheet order, that matches the whole
+#      feature; they are all compiled into one pattern of named alternatives,
+#      so regex rules use (?:...) groups only (no capturing groups or
+#      backreferences, whose names and numbers would clash)
+# Each distinct feature string is resolved once and memoized, so the cost
+# grows with the number of distinct features rather than with session rows.
+#
+# Standard library only: the quick `cli.py validate` check uses it as well.
+
+EXACT = "exact"
+PREFIX = "prefix"
+GLOB = "glob"
+REGEX = "regex"
+KINDS = (EXACT, PREFIX, GLOB, REGEX)
+REGEX_MARK = "re:"
+
+_END = ""	# trie key of the rule ending at a node (trie edges are single characters)
+
+def _missing(value):
+    return value is None or value == "" or (isinstance(value, float) and value != value)
+
+def rule_kind(feature, match=None):
+    """(kind, pattern) of a Feature cell, given the sheet's Match cell if it has one."""
+    text = feature if isinstance(feature, str) else str(feature)
+    if not _missing(match):
+        kind = str(match).strip().lower()
+        if kind not in KINDS:
+            raise ValueError("unknown Match '%s' for feature '%s' (use %s)" % (match, feature, ", ".join(KINDS)))
+        if kind == EXACT:
+            return (EXACT, feature)
+        if kind == PREFIX and text.endswith("*"):
+            text = text[:-1]
+        elif kind == REGEX and text.startswith(REGEX_MARK):
+            text = text[len(REGEX_MARK):]
+        return (kind, text)
+    if not isinstance(feature, str):
+        return (EXACT, feature)
+    if text.startswith(REGEX_MARK):
+        return (REGEX, text[len(REGEX_MARK):])
+    if text.endswith("*") and "*" not in text[:-1] and "?" not in text:
+        return (PREFIX, text[:-1])
+    if "*" in text or "?" in text:
+        return (GLOB, text)
+    return (EXACT, feature)
+
+class FeatureMatcher:
+    """
+    Resolves usage features to rules.  `rules` is a list of (kind, pattern,
+    value) in sheet order, e.g. value = (vendor, product); match() returns
+    the index of the rule that resolves a feature, or None.
+    """
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.exact = {}
+        self.trie = {}
+        alternatives = []
+        for i, (kind, pattern, _) in enumerate(self.rules):
+            if kind == EXACT:
+                self.exact[pattern] = i
+            elif kind == PREFIX:
+                node = self.trie
+                for ch in pattern:
+                    node = node.setdefault(ch, {})
+                node[_END] = i
+            else:
+                regex = fnmatch.translate(pattern) if kind == GLOB else "(?:%s)" % pattern
+                try:
+                    groups = re.compile(regex).groups
+                except re.error as e:
+                    raise ValueError("bad %s rule '%s': %s" % (kind, pattern, e))
+                if kind == REGEX and groups:	# names and numbers would clash in the combined pattern
+                    raise ValueError("bad regex rule '%s': capturing groups and backreferences are not "
+                                     "supported, use (?:...)" % pattern)
+                alternatives.append("(?P<_r%d>%s)" % (i, regex))
+        try:
+            self.pattern = re.compile("|".join(alternatives)) if alternatives else None
+        except re.error as e:
+            raise ValueError("glob and regex rules do not combine: %s" % e)
+        self.duplicates = []	# filled in by the caller, e.g. match.compile_features
+        self._memo = {}
+
+    def __len__(self):
+        return len(self.rules)
+
+    @property
+    def exact_only(self):
+        """True if every rule is an exact feature name."""
+        return not self.trie and self.pattern is None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_memo"] = {}	# e.g. in the on-disk cache: resolved again on use
+        return state
+
+    def match(self, feature):
+        """Index of the rule that resolves `feature`, or None (memoized)."""
+        try:
+            return self._memo[feature]
+        except KeyError:
+            pass
+        i = self._resolve(feature)
+        self._memo[feature] = i
+        return i
+
+    def _resolve(self, feature):
+        if _missing(feature):
+            return None
+        i = self.exact.get(feature)
+        if i is not None or self.exact_only:
+            return i
+        text = feature if isinstance(feature, str) else str(feature)
+        node = self.trie
+        i = node.get(_END)
+        for ch in text:	# longest prefix
+            node = node.get(ch)
+            if node is None:
+                break
+            i = node.get(_END, i)
+        if i is not None or self.pattern is None:
+            return i
+        m = self.pattern.fullmatch(text)
+        return int(m.lastgroup[2:]) if m else None
+
+    def describe(self, i):
+        """The rule as written, e.g. 'prefix Virtuoso_*' ('exact' for exact rules)."""
+        (kind, pattern, _) = self.rules[i]
+        if kind == EXACT:
+            return EXACT
+        return "%s %s" % (kind, pattern + "*" if kind == PREFIX else pattern)
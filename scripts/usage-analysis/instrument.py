@@ -0,0 +1,175 @@
+import sys
+import os
+import json
+import time
+import platform
+import resource
+import cProfile
+import pandas as pd
+import cache as ch
+
+# Per-stage instrumentation of the pipeline (--profile).
+#
+# The stage and hot functions listed in HOT_FUNCTIONS are wrapped while a
+# Profiler is active, so the pipeline code itself is unchanged.  For each stage
+# the profiler records the number of calls, wall and CPU time, the rows handled
+# and the process peak RSS after the stage, plus how much the stage raised it.
+# Stages nest (e.g. the concurrency merge runs inside pivot_levels), so
+# their times do not add up to the total.  The run report is written as JSON
+# next to the processed workbook; with cprofile=True a cProfile dump is
+# written as well (python -m pstats <file>.prof).
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def write_started():
+    """(time, peak RSS) at the start of an output write, for report_write."""
+    return (time.perf_counter(), peak_rss_mb())
+
+def report_write(started, nrows):
+    """Print the time and peak RSS of an output write of nrows Usage rows."""
+    (t0, rss0) = started
+    print("    %d Usage rows written in %.1f s, peak RSS %.0f MB (+%.0f MB while writing)" % (
+        nrows, time.perf_counter() - t0, peak_rss_mb(), peak_rss_mb() - rss0))
+
+def _len_result(args, result):
+    return len(result)
+
+def _len_first_arg(args, result):
+    return len(args[0])
+
+# (stage, module, function, rows): rows(args, result) is the row count of one call, or None;
+# the function may be a method (Class.method)
+HOT_FUNCTIONS = [
+    ("[1] feature mapping", "match", "setup_feature_dictionary", _len_result),
+    ("[2] user list", "match", "setup_user_dictionary", _len_result),
+    ("[2.1] read + enrich usage", "match", "load_usage_file", lambda args, result: len(result[1])),
+    ("[2.1] stream + aggregate usage", "stream", "aggregate_stream", lambda args, result: result[1]),
+    ("[2.2] validate usage", "preflight", "validate_usage", _len_first_arg),
+    ("[2.3] coalesce sessions", "coalesce", "coalesce_sessions", _len_first_arg),
+    ("aggregate_usage", "match", "aggregate_usage", _len_first_arg),
+    ("[3] pivot_levels", "match", "pivot_levels", _len_first_arg),
+    ("concurrency (merge)", "concurrency", "IntervalIndex.merge", lambda args, result: len(result.times)),
+    ("[3] summary_table", "match", "summary_table", _len_result),
+    ("[3.2] timeline sheets", "timeline", "timeline_sheets", None),
+    ("[3.3] what-if sheets", "whatif", "whatif_sheets", None),
+    ("[4] provisioning", "provision", "build_current_provision_usage", _len_result),
+    ("update_df_provision_with_pivot", "provision", "update_df_provision_with_pivot", _len_result),
+    ("[5] write", "match", "write_new_file", lambda args, result: len(args[2])),
+    ("[5] write tables", "match", "write_tables", None),
+    ("[5] write (streamed)", "stream", "write_streamed_file", None),
+]
+
+def report_path(file_a):
+    return os.path.splitext(file_a)[0] + "-processed.run.json"
+
+def cprofile_path(file_a):
+    return os.path.splitext(file_a)[0] + "-processed.prof"
+
+class Profiler:
+    """
+    Context manager recording the HOT_FUNCTIONS stages.  `extra` maps a module
+    name to another module object to instrument under that name (match.py run
+    as a script is __main__, not match).
+    """
+    def __init__(self, functions=HOT_FUNCTIONS, extra=None, cprofile=False):
+        self.functions = functions
+        self.extra = extra or {}
+        self.stages = {}
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.total = None
+        self._active = set()
+        self._saved = []
+
+    def _modules(self, name):
+        # only modules already loaded; e.g. stream is imported for --stream runs
+        modules = [m for m in (sys.modules.get(name), self.extra.get(name)) if m is not None]
+        return list({id(m): m for m in modules}.values())
+
+    def _wrap(self, name, rows, func):
+        def timed(*args, **kwargs):
+            if name in self._active:	# recursive call, recorded by the outer one
+                return func(*args, **kwargs)
+            self._active.add(name)
+            rss0 = peak_rss_mb()
+            wall0 = time.perf_counter()
+            cpu0 = time.process_time()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                self._active.discard(name)
+            stage = self.stages.setdefault(name, {"calls": 0, "wall": 0.0, "cpu": 0.0, "rows": None,
+                                                  "peak_rss_mb": 0.0, "rss_growth_mb": 0.0})
+            stage["calls"] += 1
+            stage["wall"] += time.perf_counter() - wall0
+            stage["cpu"] += time.process_time() - cpu0
+            rss1 = peak_rss_mb()
+            stage["peak_rss_mb"] = max(stage["peak_rss_mb"], rss1)
+            stage["rss_growth_mb"] += rss1 - rss0
+            if rows is not None:
+                stage["rows"] = (stage["rows"] or 0) + int(rows(args, result))
+            return result
+        return timed
+
+    def __enter__(self):
+        for name, module_name, attr, rows in self.functions:
+            for module in self._modules(module_name):
+                (owner, _, func_name) = attr.rpartition(".")
+                owner = getattr(module, owner, None) if owner else module
+                func = getattr(owner, func_name, None)
+                if func is None:
+                    continue
+                self._saved.append((owner, func_name, func))
+                setattr(owner, func_name, self._wrap(name, rows, func))
+        self._wall0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+        if self.cprofile:
+            self.cprofile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.cprofile:
+            self.cprofile.disable()
+        self.total = {"wall": time.perf_counter() - self._wall0, "cpu": time.process_time() - self._cpu0,
+                      "peak_rss_mb": peak_rss_mb()}
+        for module, attr, func in reversed(self._saved):
+            setattr(module, attr, func)
+        self._saved = []
+
+    def report(self, **info):
+        """The run report as a dict; `info` (input files, outputs, options) is included as is."""
+        stages = []
+        for name, _, _, _ in self.functions:	# in pipeline order
+            if name in self.stages:
+                stage = dict(self.stages[name], stage=name)
+                for k in ("wall", "cpu", "peak_rss_mb", "rss_growth_mb"):
+                    stage[k] = round(stage[k], 4)
+                stages.append(stage)
+        return dict(info, **{
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "environment": {"code_version": ch.code_version(), "python": platform.python_version(),
+                            "pandas": pd.__version__, "machine": platform.machine()},
+            "total": {k: round(v, 4) for k, v in self.total.items()},
+            "stages": stages,
+        })
+
+    def write_report(self, file_a, **info):
+        """Write the JSON run report (and the cProfile dump) next to the processed file; returns its name."""
+        path = report_path(file_a)
+        with open(path, "w") as f:
+            json.dump(self.report(usage=file_a, **info), f, indent=2)
+        if self.cprofile:
+            self.cprofile.dump_stats(cprofile_path(file_a))
+        return path
+
+    def print_summary(self):
+        print("    %-32s %6s %9s %9s %10s %10s" % ("stage", "calls", "wall s", "cpu s", "rows", "peak MB"))
+        for name, _, _, _ in self.functions:
+            if name in self.stages:
+                s = self.stages[name]
+                print("    %-32s %6d %9.3f %9.3f %10s %10.0f" % (name, s["calls"], s["wall"], s["cpu"],
+                                                               "" if s["rows"] is None else s["rows"],
+                                                               s["peak_rss_mb"]))
+        print("    %-32s %6s %9.3f %9.3f %10s %10.0f" % ("total", "", self.total["wall"], self.total["cpu"],
+                                                       "", self.total["peak_rss_mb"]))
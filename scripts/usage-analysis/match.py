@@ -1,23 +1,32 @@
 import sys
 import os
+import contextlib
 import pandas as pd
 import json
-from openpyxl import load_workbook
-from collections import defaultdict
 import provision as pr
-import math
+import workbook as wb
+import concurrency as cc
+import cache as ch
+import instrument as ins
+import passthrough as pt
+import featurematch as fm
+from columns import (USG_USERNAME, USG_EMAIL, USG_FEATURE, USG_KEY_FEATURE, USG_TIME, USAGE_COLUMNS,
+                     F_PRODUCT, F_FEATURE, F_MATCH, F_VENDOR, USER_SHEET, USER_LAST_NAME,
+                     USER_FIRST_NAME, USER_ORGANIZATION, USER_PROJECT_NAME, USER_EMAIL, USER_NOTES,
+                     usage_header_row)
+import numpy as np
+from pandas.api.types import union_categoricals
 
 # -- pivot table keys
-# 1. fields from usage Excel file
-USG_USERNAME = "User Name"
-USG_FEATURE = "Product"
-USG_TIME = "Total usage time (hours)"
+# 1. fields from usage Excel file: USG_USERNAME, USG_FEATURE and USG_TIME (columns.py)
 
 # 2. newly added columns to usage table
 VENDOR = "Vendor Name"
 PRODUCT = "Product Name"
 ORG = "Organization"
 PROJECT = "Project Name"
+# rule that resolved the feature, e.g. "prefix Virtuoso_*" (only if the mapping has prefix/pattern rules)
+FEATURE_RULE = "Feature Rule"
 
 # 3. calculated columns
 P_NUMUSERS = "Number of Users"
@@ -25,110 +34,197 @@ P_CONCURUSERS = "Concurrent Users"
 P_INSTANCES = "_instances"
 P_TOTAL = "_total"
 
-# total number of columns output of pivot table in Excel file
-NUMCOLUMNS = 9	
+# columns of the Performer Summary and Tool Summary tables
+SUMMARY_COLUMNS_TEAM = ["Project", "Performer", "Vendor", "Product", "Product Feature", "User",
+                        "Total Usage Time", "Number of Users", "Concurrency (Estimated)"]
+SUMMARY_COLUMNS_TOOL = ["Project", "Vendor", "Product", "Product Feature", "Performer", "User",
+                        "Total Usage Time", "Number of Users", "Concurrency (Estimated)"]
 
 # -- end of pivot table keys
 
-# columns of feature file
-F_PRODUCT="Product"
-F_FEATURE="Feature"
+# name columns of the enriched usage frame, repeated on every session row;
+# --compact stores them as categoricals (integer codes plus one copy of each name)
+COMPACT_COLUMNS = [USG_USERNAME, USG_EMAIL, USG_FEATURE, USG_KEY_FEATURE, VENDOR, PRODUCT, ORG, PROJECT, FEATURE_RULE]
 
 # Sheet name for Comparison between provisioned and used 
 SHEET_NAME_STAT = "Tool Usage"
 
+# frame of an input sheet that is copied into the processed workbook as is (--copy-sheets)
+COPIED_SHEET = "copied"
+
+# output formats: the Excel report, and/or the Usage, Performer Summary,
+# Tool Summary and Tool Usage tables as CSV or Parquet files
+OUTPUT_FORMATS = ["xlsx", "csv", "parquet"]
+
 def setup_feature_dictionary(file_b):
-    mapping = []
-    xls_b = pd.ExcelFile(file_b)
-    
-    for sheet in xls_b.sheet_names:
-        df_raw = xls_b.parse(sheet, header=None)  # read without assuming header row
+    frames = []
+    book_b = wb.open_workbook(file_b)
     
+    for sheet in book_b.sheet_names:
         # Find the header row: the one that contains both "Product" and "Feature"
-        header_row = None
-        for i, row in df_raw.iterrows():
-            if F_PRODUCT in row.values and F_FEATURE in row.values:
-                header_row = i
-                break
+        header_row = wb.find_row_containing(book_b.grid(sheet), [F_PRODUCT, F_FEATURE])
     
         if header_row is not None:
-            # Re-read the sheet using that row as the header
-            df = xls_b.parse(sheet, header=header_row)
+            # Build the frame using that row as the header
+            df = book_b.parse(sheet, header=header_row)
     
             # Only proceed if both columns exist after header detection
             if F_PRODUCT in df.columns and F_FEATURE in df.columns:
-                for _, row in df.iterrows():
-                    mapping.append({
-                        "vendor" : sheet,
-                        "product" : row[F_PRODUCT],
-                        "feature" : row[F_FEATURE]
-                    })
+                vendor = sheet
+                if book_b.single_table and F_VENDOR in df.columns:
+                    vendor = df[F_VENDOR].values
+                frames.append(pd.DataFrame({
+                    "vendor" : vendor,
+                    "product" : df[F_PRODUCT].values,
+                    "feature" : df[F_FEATURE].values,
+                    "match" : df[F_MATCH].values if F_MATCH in df.columns else None
+                }))
 #        else:
 #            print(f"⚠️ Warning: 'Product'/'Feature' columns not found in sheet '{sheet}'")
-    # Build lookup dictionary
-    lookup = {
-        row["feature"]: (row["vendor"], row["product"])
-        for row in mapping if pd.notna(row["feature"])
-    }
+    # Compile the feature rules (later sheets win for exact features, as with a dict)
+    return compile_features(frames)
 
-    return lookup
+def compile_features(frames):
+    """
+    Compile the rows of the feature mapping sheets, in order, into a
+    fm.FeatureMatcher whose rule values are (vendor, product).
+    Repeated Feature cells are listed in its `duplicates` (for the validation report).
+    """
+    if not frames:
+        return fm.FeatureMatcher([])
+    rules = pd.concat(frames, ignore_index=True)
+    rules = rules[rules["feature"].notna()]
+    try:
+        kinds = [fm.rule_kind(f, m) for (f, m) in zip(rules["feature"], rules["match"])]
+        matcher = fm.FeatureMatcher([(kind, pattern, (vendor, product)) for ((kind, pattern), vendor, product)
+                                     in zip(kinds, rules["vendor"], rules["product"])])
+    except ValueError as e:
+        print("❌ Feature mapping: %s" % e)
+        sys.exit(1)
+    matcher.duplicates = duplicate_keys(rules, "feature", ["vendor", "product"])
+    return matcher
 
-USER_LAST_NAME="LAST NAME"
-USER_FIRST_NAME="FIRST NAME"
-USER_ORGANIZATION="ORGANIZATION"
-USER_PROJECT_NAME="PROJECT NAME"
-USER_EMAIL="microelectornics.us E-MAIL"
+def feature_frame(matcher, keys):
+    """
+    Lookup frame (vendor, product, rule) of the distinct `keys` that a feature
+    rule resolves, indexed by key; each key is resolved once by the matcher.
+    """
+    found = [(k, matcher.match(k)) for k in pd.unique(keys.dropna())]
+    found = [(k, i) for (k, i) in found if i is not None]
+    return pd.DataFrame({
+        "vendor": [matcher.rules[i][2][0] for (_, i) in found],
+        "product": [matcher.rules[i][2][1] for (_, i) in found],
+        "rule": [matcher.describe(i) for (_, i) in found],
+    }, index=pd.Index([k for (k, _) in found], dtype=object))
+
+def matched_features(matcher, keys):
+    """Boolean Series: True where a feature rule resolves the key."""
+    return keys.isin(feature_frame(matcher, keys).index)
 
 def setup_user_dictionary(file_c):
-    mapping = []
-    xls_c = pd.ExcelFile(file_c)
-    
-    for sheet in xls_c.sheet_names:
-        if str(sheet) != "Admin-User List": continue
-        df_raw = xls_c.parse(sheet, header=None)  # read without assuming header row
+    frames = []
+    book_c = wb.open_workbook(file_c)
     
+    for sheet in book_c.sheet_names:
+        if str(sheet) != USER_SHEET and not book_c.single_table: continue
         # Find the header row: the one that contains both "LAST NAME" and "ORGANIZATION"
-        header_row = None
-        for i, row in df_raw.iterrows():
-            if "LAST NAME" in row.values and "ORGANIZATION" in row.values:
-                header_row = i
-                break
+        header_row = wb.find_row_containing(book_c.grid(sheet), [USER_LAST_NAME, USER_ORGANIZATION])
     
         if header_row is not None:
-            # Re-read the sheet using that row as the header
-            df = xls_c.parse(sheet, header=header_row)
+            # Build the frame using that row as the header
+            df = book_c.parse(sheet, header=header_row)
     
             # Only proceed if both columns exist after header detection
-            if "LAST NAME" in df.columns and "ORGANIZATION" in df.columns:
-                for _, row in df.iterrows():
-                    if (str(row["NOTES"]).lower() == "remove"): continue
-                    mapping.append({
-                        "last": row[USER_LAST_NAME],
-                        "first": row[USER_FIRST_NAME],
-                        "org": row[USER_ORGANIZATION],
-                        "pname": row[USER_PROJECT_NAME],
-                        "email": row[USER_EMAIL]
-                    })
+            if USER_LAST_NAME in df.columns and USER_ORGANIZATION in df.columns:
+                df = df[df[USER_NOTES].astype(str).str.lower() != "remove"]
+                df = df[df[USER_ORGANIZATION].notna()]
+                frames.append(pd.DataFrame({
+                    "last": df[USER_LAST_NAME].values,
+                    "first": df[USER_FIRST_NAME].values,
+                    "org": df[USER_ORGANIZATION].values,
+                    "pname": df[USER_PROJECT_NAME].values,
+                    "email": df[USER_EMAIL].values
+                }))
         else:
             print(f"⚠️ Warning: 'LAST NAME'/'ORGANIZATION' columns not found in sheet '{sheet}'")
     
-    # Build user_lookup dictionary
-    user_lookup = {
-        row["email"]: (row["last"], row["first"], row["pname"], row["org"])
-        for row in mapping if pd.notna(row["org"])
-    }
-    return user_lookup
+    # Build user_lookup frame indexed by email
+    return build_lookup(frames, "email", ["last", "first", "pname", "org"])
+
+def build_lookup(frames, key, columns):
+    """
+    Concatenate the mapping frames and index them by `key`.
+    NaN keys are dropped and, for repeated keys, the last row wins; the
+    repeated keys are listed in attrs["duplicates"] (for the validation report).
+    """
+    if not frames:
+        return pd.DataFrame(columns=columns, index=pd.Index([], name=key))
+    lookup = pd.concat(frames, ignore_index=True)
+    lookup = lookup[lookup[key].notna()]
+    duplicates = duplicate_keys(lookup, key, columns)
+    lookup = lookup.drop_duplicates(subset=key, keep="last").set_index(key)[columns]
+    lookup.attrs["duplicates"] = duplicates
+    return lookup
+
+def duplicate_keys(lookup, key, columns):
+    """[{"key", "entries", "values"}] of the keys listed more than once in the `lookup` rows."""
+    repeated = lookup[lookup[key].duplicated(keep=False)]
+    duplicates = []
+    for (k, entries) in repeated.groupby(key, sort=False):
+        values = [" / ".join("" if pd.isna(v) else str(v) for v in row)
+                  for row in entries[columns].itertuples(index=False)]
+        duplicates.append({"key": k, "entries": len(entries), "values": list(dict.fromkeys(values))})
+    return duplicates
+
+def apply_lookup(df, key_col, lookup, columns, report=True):
+    """
+    Add columns to `df` by mapping `df[key_col]` through the lookup frame,
+    one vectorized map per column. `columns` is a list of
+    (new column, lookup column, value for unmatched rows).
+    Returns {new column: number of matched rows}; prints them if `report`.
+    """
+    keys = df[key_col]
+    matched = keys.notna() & keys.isin(lookup.index)
+    counts = {}
+    for new_col, lookup_col, missing in columns:
+        values = keys.map(lookup[lookup_col]).where(matched, missing)
+        counts[new_col] = int((matched & values.notna()).sum())
+        if report:
+            print("    %s: %d matched, %d missing" % (new_col, counts[new_col], len(df) - counts[new_col]))
+        df[new_col] = values
+    return counts
+
+def enrich_usage(df, feature_lookup, user_lookup, report=True):
+    """Add Vendor/Product Name and Organization/Project Name to the usage frame; returns match counts."""
+    # Add Vendor and Product Name columns (and the matching rule, if not all rules are exact)
+    columns = [(VENDOR, "vendor", ""), (PRODUCT, "product", "")]
+    if not feature_lookup.exact_only:
+        columns.append((FEATURE_RULE, "rule", ""))
+    counts = apply_lookup(df, "Feature", feature_frame(feature_lookup, df["Feature"]), columns, report)
+
+    # Add Organization Name
+    counts.update(apply_lookup(df, "Email", user_lookup, [
+        (ORG, "org", ""),
+        (PROJECT, "pname", float("nan"))], report))
+    return counts
+
+def compact_usage(df):
+    """Convert the COMPACT_COLUMNS of an enriched usage frame to categoricals, in place."""
+    for col in COMPACT_COLUMNS:
+        if col in df.columns and df[col].dtype == object:
+            df[col] = df[col].astype("category")
+    return df
 
 def add_extra_fields(file_a, feature_lookup, user_lookup):
-    xls_a = pd.ExcelFile(file_a)
+    book_a = wb.open_workbook(file_a)
     target_sheet = None
     header_row = 0
 
     # Find the header row
-    for sheet in xls_a.sheet_names:
-        guessed_header_row = detect_header_row_usagefile(file_a, sheet)
-        df_temp = pd.read_excel(file_a, sheet_name=sheet, header=guessed_header_row)
-        if USG_USERNAME in df_temp.columns:
+    for sheet in book_a.sheet_names:
+        guessed_header_row = detect_header_row_usagefile(book_a, sheet)
+        columns = book_a.parse(sheet, header=guessed_header_row, nrows=0).columns
+        if USG_USERNAME in columns:
             target_sheet = sheet
             header_row = guessed_header_row
             break
@@ -137,292 +233,433 @@ def add_extra_fields(file_a, feature_lookup, user_lookup):
         print("❌ Could not find a sheet with 'User Name' in first or second row.")
         sys.exit(1)
 
-    # Load the target sheet with correct header row ---
-    df = pd.read_excel(file_a, sheet_name=target_sheet, header=header_row)
+    # Build the target sheet frame with correct header row ---
+    df = book_a.parse(target_sheet, header=header_row)
+    check_usage_columns(df.columns)
+    df.attrs["first_row"] = header_row + 2	# sheet row of the first session (validation report)
 
-    if "Product" not in df.columns:
-        print("❌ Column 'Product' not found in target sheet.")
-        sys.exit(1)
+    enrich_usage(df, feature_lookup, user_lookup)
+    return (book_a, target_sheet, df)
 
-    # Add Vendor and Product Name columns
-    df["Vendor Name"] = ""
-    df["Product Name"] = ""
-
-    for idx, prod in df["Feature"].items():
-        if pd.notna(prod) and prod in feature_lookup:
-            vendor, pname = feature_lookup[prod]
-            df.at[idx, "Vendor Name"] = vendor
-            df.at[idx, "Product Name"] = pname
-
-    # Add Organization Name
-    df["Organization"] = ""
-
-    for idx, email in df["Email"].items():
-        if pd.notna(email) and email in user_lookup:
-            last, first, pname, org = user_lookup[email]
-            df.at[idx, "Organization"] = org
-            df.at[idx, "Project Name"] = pname 
-    return (xls_a, target_sheet, df)
+def check_usage_columns(columns):
+    """Exit with the list of USAGE_COLUMNS missing from the usage sheet, if any."""
+    missing = [c for c in USAGE_COLUMNS if c not in columns]
+    for c in missing:
+        print("❌ Column '%s' not found in target sheet." % c)
+    if missing:
+        sys.exit(1)
 
 def calculate_concurrency(A):
-    events = []
-
-    # Build event points: +1 for start, -1 for end
-    for start_time, end_time in A:
-        if (start_time == end_time): 
-            continue;
-        events.append((start_time, 1))     # start event
-        events.append((end_time, -1))      # end event
-
-    # Sort events: if same time, process end (-1) before start (+1)
-    events.sort(key=lambda x: (x[0], x[1]))
-
-    max_concurrency = 0
-    current = 0
-
-    # Sweep line: accumulate current usage
-    for _, change in events:
-        current += change
-        max_concurrency = max(max_concurrency, current)
-
+    # A: list of [start_time, end_time] or an (n, 2) datetime64 array
+    intervals = A if isinstance(A, np.ndarray) else cc.to_intervals(A)
+    max_concurrency = int(cc.group_peaks([intervals])[0])
     if (max_concurrency < 1): max_concurrency = 1
     return max_concurrency
 
-# Sort keys: put "_total" first, put NUMUSERS and P_CONCURUSERS last
-def sort_key(k):
-    if k == "_total":
-        return (0, k)
-    elif k == P_NUMUSERS:
-        return (98, k)
-    elif k == P_CONCURUSERS:
-        return (99, k)
-    else:
-        return (1, k)
-
-def flatten_defaultdict(d, parent_keys=None, show_blank=True):
-    """
-    Recursively flatten nested defaultdicts into a list of key paths + value,
-    with these features:
-      1. Key name appears only once per group (other rows under it are blank)
-      2. Keys ending with '_total' appear first at each level
-    """
-    if parent_keys is None:
-        parent_keys = []
-    rows = []
-    keys = sorted(d.keys(), key=sort_key)
-
-    max_concurrency = 0
-    for i, k in enumerate(keys):
-        if k == P_INSTANCES:	# list of [start_time, end_time]
-            _max_concurrency = calculate_concurrency(d[k])
-            if (_max_concurrency > max_concurrency):
-                max_concurrency = _max_concurrency
-            continue
-        v = d[k]
-        if isinstance(v, dict):
-            (child_rows, _max_concurrency)  = flatten_defaultdict(v, parent_keys + [k], show_blank)
-            if (_max_concurrency > max_concurrency):
-                max_concurrency = _max_concurrency
-        elif (k == P_CONCURUSERS): 
-            d[P_CONCURUSERS] = max_concurrency
-            if ("_total" in keys):
-                rows[0][-1] = max_concurrency
-            continue
-        elif (k == P_NUMUSERS):
-            if ("_total" in keys):
-                rows[0][-2] = d[P_NUMUSERS]
-            continue
-        else:	# value is added at the end of the child_rows, which becomes first row of rows
-            if (k == "_total"):
-                t = [v]
-            else:
-                t = [k, v]
-            # insert "" to make the columns aligned
-            diff = NUMCOLUMNS - 2 - len(parent_keys) - len(t)
-            child_row = list(parent_keys)
-            child_row.extend([""]*diff)
-            child_rows = [child_row + t]
-            child_rows[0].append("")
-            child_rows[0].append("")
-        # If we’re not at the topmost level, blank out repeated parent keys
-        if show_blank and rows:
-            for r in child_rows[0:]:
-                # Blank all parent columns for visual grouping
-                for j in range(len(parent_keys)):
-                    r[j] = ""
-
-        rows.extend(child_rows)
-
-    return (rows, max_concurrency)
-
-def write_new_file(file_a, xls_a, target_sheet, df, df_pivot_data, df_pivot_data_tool, df_prov):
+def write_new_file(file_a, sheets, df, df_pivot_data, df_pivot_data_tool, df_prov, extra_sheets=()):
     processed_filename = os.path.splitext(file_a)[0] + "-processed.xlsx"
     print("[5] Write all to file: %s" % processed_filename)
+    started = ins.write_started()
     with pd.ExcelWriter(processed_filename, engine="xlsxwriter") as writer:
-        for sheet in xls_a.sheet_names:
-            if sheet == target_sheet:	# usage sheet
+        for (sheet, df_other) in sheets:
+            if df_other is None:	# usage sheet
                 df.to_excel(writer, sheet_name="Usage", index=False)
+            elif isinstance(df_other, str):	# COPIED_SHEET, inserted below
+                continue
             else:
-                # Detect if header in row 2 for other sheets as well
-                guessed_header_row = detect_header_row(file_a, sheet)
-                df_other = pd.read_excel(file_a, sheet_name=sheet, header=guessed_header_row)
                 df_other.to_excel(writer, sheet_name=sheet, index=False)
         df_pivot_data.to_excel(writer, sheet_name="Performer Summary", index=False)
         df_pivot_data_tool.to_excel(writer, sheet_name="Tool Summary", index=False)
         df_prov.to_excel(writer, sheet_name=SHEET_NAME_STAT, index=False)
         pr.set_color_column(writer, df_prov, SHEET_NAME_STAT)
+        # e.g. the timeline sheets: (sheet name, frame, formatter or None)
+        for (sheet, df_extra, set_format) in extra_sheets:
+            df_extra.to_excel(writer, sheet_name=sheet, index=False)
+            if set_format:
+                set_format(writer.book, writer.sheets[sheet], df_extra)
+    pt.copy_sheets(file_a, processed_filename, copied_sheets(sheets))
+    ins.report_write(started, 0 if df is None else len(df))
 
     # Set writable permission 
     os.chmod(processed_filename, 0o666)
+    return processed_filename
 
-def tree():
-    return defaultdict(tree)
-
-# build pivot_table
-# calculate # of users per tool
-# estimate # of concurrent users
-def build_pivot_table(df, nested_data, per_team=True):
-    # Fill nested structure
-    prod_user = tree()
-    for _, row in df.iterrows():
-        project = row[PROJECT]
-        org = row[ORG]
-
-        if isinstance(project, float) and math.isnan(project):
-            # no such user exists in AdminUser list.
-            print("No such user exists: Exit")
-            sys.exit(1)
-
-        vendor = row[VENDOR]
-        product = row[PRODUCT]
-        feature = row[USG_FEATURE]
-        username = row[USG_USERNAME]
-        time = float(row[USG_TIME])
-        start_t = str(row["Start Time"])
-        end_t = str(row["End Time"])
-
-        if (per_team):  
-            # project, org, vendor, product, feature
-            proj_node = nested_data[project]
-            org_node = proj_node[org]
-            vend_node = org_node[vendor]
-            prod_node = vend_node[product]
-            prod_node[P_CONCURUSERS] = 0
-            feature_node = prod_node[feature]
-        else:
-            # project, vendor, product, feature, org
-            proj_node = nested_data[project]
-            vend_node = proj_node[vendor]
-            prod_node = vend_node[product]
-            prod_node[P_CONCURUSERS] = 0
-            feature_node = prod_node[feature]
-            org_node = feature_node[org]
-
-        t_prod = prod_user[product] 
-    
-        # Store total per username at feature-level
-        if (feature_node.get(username, 0) == 0 and time > 0):
-            feature_node[P_NUMUSERS]= feature_node.get(P_NUMUSERS, 0) + 1
-        feature_node[username] = feature_node.get(username, 0) + time
-        feature_node[P_CONCURUSERS]= 1	# initial value
-
-        # Store username per product
-        if (t_prod.get(username, 0) == 0 and time > 0):
-            # prod_node[P_NUMUSERS] = prod_node[P_NUMUSERS] + 1
-            t_prod[username] = t_prod.get(username, 0) + time	# not used, but set for value for the key "username"
-
-#        if (prod_node.get(username, 0) == 0 and time > 0):
-#            prod_node[P_NUMUSERS]= prod_node.get(P_NUMUSERS, 0) + 1
-    
-        if (per_team):  
-            # Update accumulated totals at each level
-            proj_node["_total"] = proj_node.get("_total", 0) + time
-            org_node["_total"] = org_node.get("_total", 0) + time
-            vend_node["_total"] = vend_node.get("_total", 0) + time
-            prod_node["_total"] = prod_node.get("_total", 0) + time
-            feature_node["_total"] = feature_node.get("_total", 0) + time
-        else:
-            # Update accumulated totals at each level
-            proj_node["_total"] = proj_node.get("_total", 0) + time
-            vend_node["_total"] = vend_node.get("_total", 0) + time
-            prod_node["_total"] = prod_node.get("_total", 0) + time
-            feature_node["_total"] = feature_node.get("_total", 0) + time
-            org_node["_total"] = org_node.get("_total", 0) + time
- 
-        # get concurrency (TODO)
-        # concurrency of tool per performer
-        #                     across performers
-        # build a list of [[start1, end1], [star2, end2], ...]
-        if (time > 0):
-            feature_node[P_INSTANCES] = feature_node.get(P_INSTANCES, [])
-            feature_node[P_INSTANCES].append([start_t, end_t])
-  
-    # remove prod_node[username]    
-
-    # Print nicely formatted result
-
-def detect_header_row_usagefile(file_path, sheet_name):
+def copied_sheets(sheets):
+    """(position, sheet name) of the COPIED_SHEET entries of a sheet list."""
+    return [(i, sheet) for i, (sheet, df_other) in enumerate(sheets) if isinstance(df_other, str)]
+
+def parse_output_formats(value):
+    """'xlsx', 'csv', 'parquet' or a comma-separated list of them."""
+    formats = [f.strip().lower() for f in value.split(",") if f.strip()]
+    if not formats or any(f not in OUTPUT_FORMATS for f in formats):
+        print("❌ Unknown output format '%s' (choose from %s)" % (value, ", ".join(OUTPUT_FORMATS)))
+        sys.exit(1)
+    if "parquet" in formats:
+        wb.require_parquet()
+    return formats
+
+def write_tables(file_a, fmt, usage, df_pivot_data, df_pivot_data_tool, df_prov, extra_sheets=()):
+    """
+    Write the report tables as <usage>-processed/<table>.<fmt> (fmt 'csv' or 'parquet').
+    `usage` is a frame, None (not written), or for CSV an iterable of frames appended in order.
+    Returns the output directory.
+    """
+    out_dir = os.path.splitext(file_a)[0] + "-processed"
+    print("[5] Write tables as %s to: %s" % (fmt, out_dir))
+    os.makedirs(out_dir, exist_ok=True)
+    tables = [("Usage", usage), ("Performer Summary", df_pivot_data),
+              ("Tool Summary", df_pivot_data_tool), (SHEET_NAME_STAT, df_prov)] + \
+             [(sheet, df_extra) for (sheet, df_extra, _) in extra_sheets]
+    for (name, df) in tables:
+        if df is None:
+            continue
+        path = os.path.join(out_dir, name.lower().replace(" ", "_") + "." + fmt)
+        if fmt == "parquet":
+            wb.write_parquet(df, path)
+            continue
+        for i, chunk in enumerate([df] if isinstance(df, pd.DataFrame) else df):
+            chunk.to_csv(path, index=False, mode="a" if i else "w", header=(i == 0))
+    return out_dir
+
+# pivot hierarchies: project, org, vendor, product, feature (Performer Summary)
+#                    project, vendor, product, feature, org (Tool Summary)
+PIVOT_ORDER_TEAM = [PROJECT, ORG, VENDOR, PRODUCT, USG_FEATURE]
+PIVOT_ORDER_TOOL = [PROJECT, VENDOR, PRODUCT, USG_FEATURE, ORG]
+# group keys of the usage aggregate
+PIVOT_KEYS = PIVOT_ORDER_TEAM + [USG_USERNAME]
+
+# aggregate usage per project, org, vendor, product, feature and user
+# in a single groupby pass; both pivot orderings are built from this result
+def aggregate_usage(df):
+    if df[PROJECT].isna().any():
+        # no such user exists in AdminUser list.
+        print("No such user exists: Exit")
+        sys.exit(1)
+
+    time = df[USG_TIME].astype(float)
+    grouped = pd.DataFrame({k: df[k] for k in PIVOT_KEYS}).assign(**{P_TOTAL: time}) \
+        .groupby(PIVOT_KEYS, sort=False, dropna=False, observed=True)	# groups in order of first appearance
+    agg = grouped[P_TOTAL].sum().reset_index()
+    codes = grouped.ngroup().to_numpy()
+
+    # (n, 2) datetime64 array of [start_time, end_time] of the sessions
+    # with usage time > 0, per group
+    used = np.flatnonzero(time.to_numpy() > 0)
+    used = used[np.argsort(codes[used], kind="stable")]
+    bounds = np.searchsorted(codes[used], np.arange(len(agg) + 1))
+    intervals = np.column_stack([cc.to_datetime64(df["Start Time"].to_numpy()[used]),
+                                 cc.to_datetime64(df["End Time"].to_numpy()[used])])
+    agg[P_INSTANCES] = [intervals[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+    return agg
+
+def concat_intervals(grouped_instances):
+    # one (n, 2) interval array per group of a grouped P_INSTANCES column
+    return [np.concatenate(list(arrays)) for _, arrays in grouped_instances]
+
+def union_categories(frames, columns):
+    """Recode each categorical key column to the union of its categories, so the frames concatenate as categoricals."""
+    frames = list(frames)
+    for col in columns:
+        if len(frames) < 2 or not all(isinstance(f[col].dtype, pd.CategoricalDtype) for f in frames):
+            continue
+        try:
+            categories = union_categoricals([f[col] for f in frames]).categories
+        except TypeError:	# categories of different types; concatenated as objects
+            continue
+        frames = [f.assign(**{col: f[col].cat.set_categories(categories)}) for f in frames]
+    return frames
+
+# merge usage aggregates (e.g. of consecutive chunks of one usage log)
+def merge_aggregates(aggs):
+    both = pd.concat(union_categories(aggs, PIVOT_KEYS), ignore_index=True)
+    grouped = both.groupby(PIVOT_KEYS, sort=False, dropna=False, observed=True)
+    merged = grouped[P_TOTAL].sum().reset_index()
+    merged[P_INSTANCES] = concat_intervals(grouped[P_INSTANCES])
+    return merged
+
+# totals, peak concurrency and number of users at each level of a pivot
+# hierarchy, from the usage aggregate
+def pivot_levels(agg, order):
+    """
+    One frame per level of `order` (project; project, org; ... down to the
+    last key) with the group keys, P_TOTAL and P_CONCURUSERS, and P_NUMUSERS
+    at the feature level; groups in depth-first order, children in order of
+    first appearance.  Also returns the total per user and feature.
+    """
+    feat_keys = order[:order.index(USG_FEATURE) + 1]
+    grouped_levels = [agg.groupby(order[:depth], sort=False, dropna=False, observed=True) for depth in range(1, len(order) + 1)]
+    codes = [grouped.ngroup().to_numpy() for grouped in grouped_levels]
+
+    # peak concurrency at each level: the sessions of each user (the rows of
+    # agg) are merged level by level up the hierarchy, so a product counts
+    # overlapping sessions of different features, and a Tool Summary product
+    # those of all performers of the project (0 for groups without usage)
+    index = cc.IntervalIndex.from_intervals(list(agg[P_INSTANCES]))
+    sessions = agg[P_INSTANCES].map(len).to_numpy()
+    child_codes = np.arange(len(agg))
+    peaks = []
+    for grouped, level_codes in zip(reversed(grouped_levels), reversed(codes)):
+        parents = np.zeros(index.ngroups, dtype=np.int64)
+        parents[child_codes] = level_codes
+        index = index.merge(parents, grouped.ngroups)
+        sessions = np.bincount(parents, weights=sessions, minlength=grouped.ngroups)
+        child_codes = level_codes
+        peaks.insert(0, np.where(sessions > 0, np.maximum(index.peaks(), 1), 0))
+
+    # total per username at feature-level, and the number of users with usage
+    users = agg.groupby(feat_keys + [USG_USERNAME], sort=False, dropna=False, observed=True)[P_TOTAL].sum()
+    num_users = (users > 0).reset_index().groupby(feat_keys, sort=False, dropna=False, observed=True)[P_TOTAL].sum()
+
+    levels = []
+    for depth, (grouped, level_peaks) in enumerate(zip(grouped_levels, peaks), 1):
+        level = grouped[P_TOTAL].sum().reset_index()
+        level[P_CONCURUSERS] = level_peaks
+        if depth == len(feat_keys):
+            level[P_NUMUSERS] = num_users.to_numpy()
+        # depth first: by the first-appearance number of the group and its parents
+        first = np.unique(codes[depth - 1], return_index=True)[1]
+        level = level.iloc[np.lexsort([c[first] for c in reversed(codes[:depth])])]
+        levels.append(level.reset_index(drop=True))
+    return (levels, users.reset_index())
+
+# Performer Summary or Tool Summary table from the pivot levels of `order`.
+# Each group's row (its total, number of users and concurrency) comes first,
+# then its children: sub-groups and, at the feature level, users, sorted by
+# name.  A row shows only its own key; the keys of its parents are blank.
+def summary_table(levels, users, order, columns):
+    feat_depth = order.index(USG_FEATURE) + 1
+    parts = [(level, order[:depth]) for depth, level in enumerate(levels, 1)]
+    parts.append((users, order[:feat_depth] + [USG_USERNAME]))
+    sizes = [len(part) for part, _ in parts]
+    part_of = np.repeat(np.arange(len(parts)), sizes)
+
+    # row order: sort by the key path, with the rank of the key at each
+    # position (-1 past the end of a row's path, so a group precedes its children)
+    ranks = []
+    for pos in range(len(order) + 1):
+        rank = np.full(len(part_of), -1, dtype=np.int64)
+        has = np.array([pos < len(keys) for _, keys in parts])[part_of]
+        if has.any():
+            keys = np.concatenate([part[keys[pos]].to_numpy(dtype=object) for part, keys in parts if pos < len(keys)])
+            rank[has] = pd.factorize(keys, sort=True, use_na_sentinel=False)[0]
+        ranks.append(rank)
+    rows = np.lexsort(ranks[::-1])
+
+    own = np.concatenate([part[keys[-1]].to_numpy(dtype=object) for part, keys in parts])[rows]
+    own_col = np.repeat([len(keys) - 1 for _, keys in parts[:-1]] + [len(order)], sizes)[rows]
+    num_users = np.full(len(part_of), "", dtype=object)
+    concurrency = np.full(len(part_of), "", dtype=object)
+    offset = 0
+    for level in levels:
+        concurrency[offset:offset + len(level)] = level[P_CONCURUSERS].to_numpy().astype(object)
+        if P_NUMUSERS in level:
+            n = level[P_NUMUSERS].to_numpy()
+            num_users[offset:offset + len(level)] = np.where(n > 0, n.astype(object), "")
+        offset += len(level)
+
+    table = {columns[col]: np.where(own_col == col, own, "") for col in range(len(order) + 1)}
+    table[columns[-3]] = np.concatenate([part[P_TOTAL].to_numpy(dtype=float) for part, _ in parts])[rows]
+    table[columns[-2]] = num_users[rows]
+    table[columns[-1]] = concurrency[rows]
+    return pd.DataFrame(table)
+
+def detect_header_row_usagefile(book, sheet_name):
     """Detect whether headers are in row 1 or 2 based on 'User Name' or 'Product'."""
-    df_preview = pd.read_excel(file_path, sheet_name=sheet_name, nrows=2, header=None)
-    for row_idx in [0, 1]:  # check first and second row
-        row_values = df_preview.iloc[row_idx].astype(str).str.strip().tolist()
-        if any(x.lower() in [USG_USERNAME.lower(), PRODUCT.lower()] for x in row_values):
-            return row_idx  # return 0 for first row, 1 for second row
-    return 0  # default to first row if not found
+    return detect_usage_header(book.preview(sheet_name, 2))
 
-def detect_header_row_featurefile(file_path, sheet_name):
+def detect_usage_header(df_preview):
+    """Same as detect_header_row_usagefile, on a preview of the first rows of a sheet (columns.usage_header_row)."""
+    return usage_header_row(df_preview.itertuples(index=False))
+
+def detect_header_row_featurefile(book, sheet_name):
     """Detect whether headers are in row 1 or 2 based on 'User Name' or 'Product'."""
-    df_preview = pd.read_excel(file_path, sheet_name=sheet_name, nrows=2, header=None)
-    for row_idx in [0, 20]:  # check first and second row
+    df_preview = book.preview(sheet_name, 2)
+    for row_idx in range(len(df_preview)):  # check first and second row
         row_values = df_preview.iloc[row_idx].astype(str).str.strip().tolist()
         if any(x.lower() in [F_PRODUCT.lower(), F_FEATURE.lower()] for x in row_values):
             return row_idx  # return 0 for first row, 1 for second row
     return 0  # default to first row if not found
 
-def main():
-    if len(sys.argv) < 5:
-        print("Usage: python match.py <Usage log.xlsx> <EDA feature.xlsx> <User list.xlsx> <Current provisioning.xlsx")
-        sys.exit(1)
-
-    file_a = sys.argv[1]
-    file_b = sys.argv[2]
-    file_c = sys.argv[3]
-    file_d = sys.argv[4]
-
-    # --- Step 1: Build mapping dictionary from EDA feature.xlsx ---
-    print("[1] Build mapping dictionary from EDA feature file: %s" % file_b)
-    feature_lookup = setup_feature_dictionary(file_b)
-    
-    # --- Step 2: Build mapping dictionary from User list.xlsx ---
-    print("[2] Build mapping dictionary from User list file: %s" % file_c)
-    user_lookup = setup_user_dictionary(file_c)
-
-    # --- Step 2.1: Read A.xlsx and add extra fields ---
-    (xls_a, target_sheet, df) = add_extra_fields(file_a, feature_lookup, user_lookup)
-
+# Steps 3 - 4: Performer/Tool Summary tables and the provisioning comparison
+# from the usage aggregate
+def summarize_usage(agg, file_a, file_d):
     print("[3] Make Pivot table from usage file: %s" % file_a)
-    # -- Step 3: Collect data for a pivot table
-    pivot_data = tree()
-    build_pivot_table(df, pivot_data)
-    (rows, max_concurrency) = flatten_defaultdict(pivot_data)
-    
-    df_pivot_data = pd.DataFrame(rows) 
-    df_pivot_data.columns = ["Project", "Performer", "Vendor", "Product", "Product Feature", "User", "Total Usage Time", "Number of Users", "Concurrency (Estimated)"]
+    # -- Step 3: Performer Summary
+    (levels, users) = pivot_levels(agg, PIVOT_ORDER_TEAM)
+    df_pivot_data = summary_table(levels, users, PIVOT_ORDER_TEAM, SUMMARY_COLUMNS_TEAM)
 
-    # -- Step 3.1: Collect data for a pivot table
-    pivot_data_tool = tree()
-    build_pivot_table(df, pivot_data_tool, False)
-    (rows_tool, max_concurrency) = flatten_defaultdict(pivot_data_tool)
-    
-    df_pivot_data_tool = pd.DataFrame(rows_tool) 
-    df_pivot_data_tool.columns = ["Project", "Vendor", "Product", "Product Feature", "Performer", "User", "Total Usage Time", "Number of Users", "Concurrency (Estimated)"]
+    # -- Step 3.1: Tool Summary
+    (levels_tool, users_tool) = pivot_levels(agg, PIVOT_ORDER_TOOL)
+    df_pivot_data_tool = summary_table(levels_tool, users_tool, PIVOT_ORDER_TOOL, SUMMARY_COLUMNS_TOOL)
 
     # -- Step 4: read current_provisiong Exel file and create usage table
     print("[4] Build table comparing current provisions (from file: %s) and actual usage" % file_d)
-    (df_prov) = pr.build_current_provision_usage(file_d, pivot_data)
+    (df_prov) = pr.build_current_provision_usage(file_d, levels[PIVOT_ORDER_TEAM.index(PRODUCT)])
+
+    return (df_pivot_data, df_pivot_data_tool, df_prov)
+
+# Read the usage workbook: the enriched usage frame plus the other sheets,
+# as a list of (sheet name, frame) in workbook order (frame None for the usage
+# sheet).  With copy_sheets, the sheets that can be copied as is are not read
+# (frame COPIED_SHEET).  With compact, the name columns are categoricals.
+# The workbook is then dropped from the load-once cache.
+def load_usage_file(file_a, feature_lookup, user_lookup, copy_sheets=False, compact=False):
+    (book_a, target_sheet, df) = add_extra_fields(file_a, feature_lookup, user_lookup)
+    if compact:
+        compact_usage(df)
+    copyable = pt.copyable_sheets(file_a) if copy_sheets else set()
+    sheets = []
+    for sheet in book_a.sheet_names:
+        if sheet == target_sheet:
+            sheets.append((sheet, None))
+        elif sheet in copyable:
+            sheets.append((sheet, COPIED_SHEET))
+        else:
+            # Detect if header in row 2 for other sheets as well
+            guessed_header_row = detect_header_row_usagefile(book_a, sheet)
+            sheets.append((sheet, book_a.parse(sheet, header=guessed_header_row)))
+    wb.release_workbook(file_a)	# keep only the frames, not the raw cells of the usage workbook
+    return (sheets, df)
+
+# Steps 2.1 - 5 for one usage file: enrich, pivot, reconcile and write.
+# With a cache and the feature/user files the lookups came from, the
+# enriched usage is reused from the cache when none of the inputs changed.
+# Returns the names of the written file/directories, comma separated.
+def process_usage_file(file_a, feature_lookup, user_lookup, file_d, cache=None, lookup_files=None,
+                       output_formats=("xlsx",), timeline=None, copy_sheets=False, compact=False, unknown=False,
+                       what_if=None, coalesce=None, constant_memory=False):
+    # --- Step 2.1: Read A.xlsx and add extra fields ---
+    if cache is not None and lookup_files:
+        kind = "usage" + ("-copy" if copy_sheets else "") + ("-compact" if compact else "")
+        (sheets, df) = cache.cached(kind, [file_a] + list(lookup_files),
+                                    lambda: load_usage_file(file_a, feature_lookup, user_lookup, copy_sheets, compact))
+    else:
+        (sheets, df) = load_usage_file(file_a, feature_lookup, user_lookup, copy_sheets, compact)
 
-    # --- Step 5: Write all sheets into A-processed.xlsx ---
-    write_new_file(file_a, xls_a, target_sheet, df, df_pivot_data, df_pivot_data_tool, df_prov)
+    # --- Step 2.2: check all rows (exits if a problem stops the run) ---
+    import preflight as pf
+    issues = pf.validate_usage(df, feature_lookup, user_lookup, file_a, unknown)
+
+    # --- Step 2.3: merge overlapping sessions of a user and feature (the Usage sheet keeps all rows) ---
+    if coalesce is not None:
+        import coalesce as cs
+        agg = aggregate_usage(cs.coalesce_usage(df, coalesce))
+    else:
+        agg = aggregate_usage(df)
+    (df_pivot_data, df_pivot_data_tool, df_prov) = summarize_usage(agg, file_a, file_d)
+    extra_sheets = pf.validation_sheets(issues, unknown)
+    if timeline:
+        import timeline as tl
+        extra_sheets += tl.timeline_sheets(agg, timeline)
+    if what_if:
+        import whatif as wi
+        extra_sheets += wi.whatif_sheets(agg, df_prov, what_if)
+
+    # --- Step 5: Write all sheets into A-processed.xlsx (and/or the tables as CSV/Parquet) ---
+    outputs = []
+    for fmt in output_formats:
+        if fmt == "xlsx" and constant_memory:	# Usage rows streamed to xlsxwriter in chunks
+            import stream
+            outputs.append(stream.write_streamed_file(file_a, sheets, [str(c) for c in df.columns],
+                                                      stream.frame_chunks(df), df_pivot_data, df_pivot_data_tool,
+                                                      df_prov, extra_sheets))
+        elif fmt == "xlsx":
+            outputs.append(write_new_file(file_a, sheets, df, df_pivot_data, df_pivot_data_tool, df_prov,
+                                          extra_sheets))
+        else:
+            outputs.append(write_tables(file_a, fmt, df, df_pivot_data, df_pivot_data_tool, df_prov,
+                                        extra_sheets))
+    return ", ".join(outputs)
+
+def pop_option(argv, name, default=None):
+    """Remove `name VALUE` or `name=VALUE` from argv; returns VALUE or default."""
+    for i, a in enumerate(argv):
+        if a == name and i + 1 < len(argv):
+            value = argv[i + 1]
+            del argv[i:i + 2]
+            return value
+        if a.startswith(name + "="):
+            del argv[i]
+            return a[len(name) + 1:]
+    return default
+
+def main(argv=None):
+    # argv: the command line, program name first (default sys.argv)
+    # --no-cache / --rebuild-cache control the on-disk cache of parsed inputs
+    # --stream reads the usage log row by row with bounded memory
+    # --output-format xlsx|csv|parquet (or a list, e.g. csv,xlsx) selects the outputs
+    # --profile writes a run report with per-stage time and memory; --cprofile adds a cProfile dump
+    # --timeline BUCKET (e.g. 15min, 1h, 1D) adds the concurrency timeline sheets
+    # --copy-sheets copies the other sheets of the usage workbook as is, with their formatting
+    # --compact keeps the name columns of the usage frame as categoricals (less memory, faster grouping)
+    # --unknown goes on past unknown users and unmapped features, counting them under "Unknown"
+    # --what-if SEATS (e.g. 0-20 or 1,2,4,8) adds the provisioning what-if sheets for those seat counts
+    # --coalesce GAP (e.g. 0, 5min) merges overlapping sessions of a user and feature before aggregation
+    # --constant-memory writes the workbook with xlsxwriter in constant-memory mode, the Usage rows in chunks
+    argv = list(sys.argv if argv is None else argv)
+    cache = ch.from_args(argv)
+    streaming = "--stream" in argv
+    cprofile = "--cprofile" in argv
+    profiling = cprofile or "--profile" in argv
+    copy_sheets = "--copy-sheets" in argv
+    compact = "--compact" in argv
+    unknown = "--unknown" in argv
+    constant_memory = "--constant-memory" in argv
+    argv = [a for a in argv if a not in ("--no-cache", "--rebuild-cache", "--stream", "--profile", "--cprofile",
+                                             "--copy-sheets", "--compact", "--unknown", "--constant-memory")]
+    output_formats = parse_output_formats(pop_option(argv, "--output-format", "xlsx"))
+    timeline = pop_option(argv, "--timeline")
+    if timeline:
+        import timeline as tl
+        tl.parse_bucket(timeline)	# fail early on a bad bucket
+    what_if = pop_option(argv, "--what-if")
+    if what_if:
+        import whatif as wi
+        wi.parse_seats(what_if)
+    coalesce = pop_option(argv, "--coalesce")
+    if coalesce is not None:
+        import coalesce as cs
+        cs.parse_gap(coalesce)
+    if len(argv) < 5:
+        print("Usage: python match.py <Usage log> <EDA feature> <User list> <Current provisioning> [--no-cache | --rebuild-cache] [--stream] [--output-format xlsx|csv|parquet] [--profile | --cprofile] [--timeline BUCKET] [--copy-sheets] [--compact] [--unknown] [--what-if SEATS] [--coalesce GAP] [--constant-memory]")
+        print("       inputs are .xlsx, .csv or .parquet files")
+        sys.exit(1)
+
+    file_a = argv[1]
+    file_b = argv[2]
+    file_c = argv[3]
+    file_d = argv[4]
+
+    import preflight	# step 2.2; loaded before the profiler, which instruments loaded modules only
+    if streaming or constant_memory:
+        import stream
+    profiler = ins.Profiler(extra={"match": sys.modules[__name__]}, cprofile=cprofile) \
+        if profiling else contextlib.nullcontext()
+    with profiler:
+        # --- Step 1: Build mapping dictionary from EDA feature.xlsx ---
+        print("[1] Build mapping dictionary from EDA feature file: %s" % file_b)
+        feature_lookup = cache.cached("features", [file_b], lambda: setup_feature_dictionary(file_b))
+        
+        # --- Step 2: Build mapping dictionary from User list.xlsx ---
+        print("[2] Build mapping dictionary from User list file: %s" % file_c)
+        user_lookup = cache.cached("users", [file_c], lambda: setup_user_dictionary(file_c))
+
+        if streaming:
+            outputs = stream.process_usage_file_streaming(file_a, feature_lookup, user_lookup, file_d,
+                                                          output_formats=output_formats, timeline=timeline,
+                                                          copy_sheets=copy_sheets, compact=compact, unknown=unknown,
+                                                          what_if=what_if, coalesce=coalesce)
+        else:
+            outputs = process_usage_file(file_a, feature_lookup, user_lookup, file_d, cache, [file_b, file_c],
+                                         output_formats, timeline, copy_sheets, compact, unknown, what_if, coalesce,
+                                         constant_memory)
+
+    if profiling:
+        profiler.print_summary()
+        report = profiler.write_report(file_a, features=file_b, users=file_c, provisioning=file_d,
+                                       outputs=outputs, stream=streaming, cache=cache.enabled, copy_sheets=copy_sheets,
+                                       compact=compact, unknown=unknown, constant_memory=constant_memory)
+        print("    run report: %s" % report)
 
 if __name__ == "__main__":
     main()
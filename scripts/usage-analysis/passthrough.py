@@ -0,0 +1,239 @@
+import os
+import re
+import zipfile
+import posixpath
+from xml.sax.saxutils import quoteattr
+import xml.etree.ElementTree as ET
+
+# Sheet pass-through for the processed workbook (--copy-sheets).
+#
+# The sheets of the usage workbook other than the usage sheet are normally
+# parsed with pandas and written back with to_excel, which costs time on large
+# exports and drops their formatting.  With pass-through they are not parsed
+# at all: after the processed workbook is written, the worksheet XML of those
+# sheets is copied from the source .xlsx into it, at their original position.
+# Only the parts a copied sheet refers to are adapted:
+#   - shared strings become inline strings (the output has its own table)
+#   - cell/row/column styles and conditional-format styles are appended to the
+#     output styles, and the style indexes of the sheet are shifted to them
+# A sheet with its own relationships (drawings, comments, tables, hyperlinks,
+# ...) or that is not plain SpreadsheetML cannot be copied this way; it is
+# still written through pandas.
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+WORKSHEET_TYPE = REL_NS + "/worksheet"
+WORKSHEET_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+FIRST_CUSTOM_NUMFMT = 164	# ids below are built-in number formats
+# item element of each styles.xml section
+STYLE_ITEMS = {"numFmts": "numFmt", "fonts": "font", "fills": "fill", "borders": "border", "cellXfs": "xf",
+               "dxfs": "dxf"}
+
+# top-level items of a styles.xml section, e.g. <font>...</font> or <xf .../>
+def _items(tag, xml):
+    return re.findall(r"<%s\b[^>]*/>|<%s\b[^>]*>.*?</%s>" % (tag, tag, tag), xml, re.S)
+
+def _section(tag, xml):
+    """(whole element, items) of a styles.xml section such as fonts, or (None, [])."""
+    m = re.search(r"<%s\b[^>]*/>|<%s\b[^>]*>.*?</%s>" % (tag, tag, tag), xml, re.S)
+    if m is None:
+        return (None, [])
+    return (m.group(0), _items(STYLE_ITEMS[tag], m.group(0)))
+
+def _prefixed(xml):
+    # namespace prefixes (x14ac:..., xr:uid) that the output stylesheet does not declare
+    return re.search(r"<\w+:|\s\w+:\w+=", xml) is not None
+
+def _read(z, name):
+    return z.read(name).decode("utf-8")
+
+def _part(base, target):
+    # absolute part name of a relationship target
+    if target.startswith("/"):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base), target))
+
+def _rels_name(part):
+    return posixpath.join(posixpath.dirname(part), "_rels", posixpath.basename(part) + ".rels")
+
+def sheet_parts(z):
+    """[(sheet name, part name or None, <sheet> attributes)] of a workbook package, in tab order."""
+    workbook = ET.fromstring(z.read("xl/workbook.xml"))
+    rels = ET.fromstring(z.read(_rels_name("xl/workbook.xml")))
+    targets = {r.get("Id"): (r.get("Type"), _part("xl/workbook.xml", r.get("Target")))
+               for r in rels.iter("{%s}Relationship" % PKG_REL_NS)}
+    sheets = []
+    for sheet in workbook.iter("{%s}sheet" % MAIN_NS):
+        (rel_type, part) = targets.get(sheet.get("{%s}id" % REL_NS), (None, None))
+        sheets.append((sheet.get("name"), part if rel_type == WORKSHEET_TYPE else None, sheet.attrib))
+    return sheets
+
+def copyable_sheets(file_a):
+    """Names of the sheets of file_a that can be copied at the XML level (empty if it is not an .xlsx)."""
+    if not zipfile.is_zipfile(file_a):
+        return set()
+    try:
+        with zipfile.ZipFile(file_a) as z:
+            names = set(z.namelist())
+            styles = _read(z, "xl/styles.xml") if "xl/styles.xml" in names else ""
+            if any(_prefixed("".join(_section(tag, styles)[1])) for tag in STYLE_ITEMS):
+                return set()
+            copyable = set()
+            for (name, part, _) in sheet_parts(z):
+                if part is None or part not in names or _rels_name(part) in names:
+                    continue
+                with z.open(part) as f:
+                    head = f.read(1024).decode("utf-8", "replace")
+                if re.search(r'<worksheet\b[^>]*\sxmlns="%s"' % re.escape(MAIN_NS), head):
+                    copyable.add(name)
+            return copyable
+    except (KeyError, ET.ParseError, zipfile.BadZipFile):
+        return set()
+
+class _StyleMerge:
+    """Appends the styles of a source workbook to the output stylesheet."""
+    def __init__(self, source_styles, target_styles):
+        self.xml = target_styles
+        self.xf_offset = len(_section("cellXfs", target_styles)[1])
+        self.dxf_offset = len(_section("dxfs", target_styles)[1])
+        if not source_styles:
+            return
+
+        # custom number formats get ids after the ones already in the output
+        used = [int(i) for i in re.findall(r'numFmtId="(\d+)"', _section("numFmts", target_styles)[0] or "")]
+        next_id = max(used + [FIRST_CUSTOM_NUMFMT - 1]) + 1
+        self.numfmt = {}
+        numfmts = []
+        for item in _section("numFmts", source_styles)[1]:
+            old = int(re.search(r'numFmtId="(\d+)"', item).group(1))
+            self.numfmt[old] = next_id
+            numfmts.append(re.sub(r'numFmtId="\d+"', 'numFmtId="%d"' % next_id, item))
+            next_id += 1
+
+        offsets = {}
+        for tag in ("fonts", "fills", "borders"):
+            offsets[tag] = len(_section(tag, target_styles)[1])
+            self._append(tag, _section(tag, source_styles)[1])
+        xfs = []
+        for item in _section("cellXfs", source_styles)[1]:
+            item = self._shift(item, "fontId", offsets["fonts"])
+            item = self._shift(item, "fillId", offsets["fills"])
+            item = self._shift(item, "borderId", offsets["borders"])
+            item = re.sub(r'numFmtId="(\d+)"', lambda m: 'numFmtId="%d"' % self._numfmt(int(m.group(1))), item)
+            xfs.append(re.sub(r'xfId="\d+"', 'xfId="0"', item))	# named cell styles are not copied
+        self._append("cellXfs", xfs)
+        dxfs = [re.sub(r'numFmtId="(\d+)"', lambda m: 'numFmtId="%d"' % self._numfmt(int(m.group(1))), item)
+                for item in _section("dxfs", source_styles)[1]]
+        self._append("dxfs", dxfs)
+        self._append("numFmts", numfmts)
+
+    def _numfmt(self, old):
+        return self.numfmt.get(old, old)
+
+    @staticmethod
+    def _shift(item, attr, offset):
+        return re.sub(r'%s="(\d+)"' % attr, lambda m: '%s="%d"' % (attr, int(m.group(1)) + offset), item)
+
+    def _append(self, tag, items):
+        if not items:
+            return
+        (whole, current) = _section(tag, self.xml)
+        section = '<%s count="%d">%s</%s>' % (tag, len(current) + len(items), "".join(current + items), tag)
+        if whole is not None:
+            self.xml = self.xml.replace(whole, section, 1)
+        elif tag == "numFmts":	# first child of styleSheet
+            self.xml = re.sub(r"(<styleSheet\b[^>]*>)", lambda m: m.group(1) + section, self.xml, count=1)
+        else:	# dxfs, after cellStyles
+            self.xml = re.sub(r"(</cellStyles>|<cellStyles\b[^>]*/>)", lambda m: m.group(1) + section,
+                              self.xml, count=1)
+
+def _shared_strings(z):
+    names = z.namelist()
+    if "xl/sharedStrings.xml" not in names:
+        return []
+    return [m.group(1) or "" for m in
+            re.finditer(r"<si>(.*?)</si>|<si/>", _read(z, "xl/sharedStrings.xml"), re.S)]
+
+def _copy_sheet(xml, strings, styles):
+    # shared strings -> inline strings (an <si> and an <is> have the same content)
+    xml = re.sub(r'<c\b([^>]*?)\st="s"([^>]*)>\s*<v>(\d+)</v>\s*</c>',
+                 lambda m: '<c%s t="inlineStr"%s><is>%s</is></c>' % (m.group(1), m.group(2), strings[int(m.group(3))]),
+                 xml)
+    # style indexes of cells, rows and columns, and conditional-format styles
+    xml = re.sub(r'(<(?:c|row)\b[^>]*?\ss=")(\d+)"', lambda m: '%s%d"' % (m.group(1), int(m.group(2)) + styles.xf_offset), xml)
+    xml = re.sub(r'(<col\b[^>]*?\sstyle=")(\d+)"', lambda m: '%s%d"' % (m.group(1), int(m.group(2)) + styles.xf_offset), xml)
+    xml = re.sub(r'(<cfRule\b[^>]*?\sdxfId=")(\d+)"', lambda m: '%s%d"' % (m.group(1), int(m.group(2)) + styles.dxf_offset), xml)
+    # only the first sheet of the output is selected
+    return re.sub(r'\stabSelected="(1|true)"', "", xml)
+
+def _select(xml, selected):
+    xml = re.sub(r'\stabSelected="(1|true)"', "", xml)
+    if selected:
+        xml = re.sub(r"<sheetView\b", '<sheetView tabSelected="1"', xml, count=1)
+    return xml
+
+def copy_sheets(file_a, processed_filename, sheets):
+    """
+    Insert the sheets of file_a named in `sheets`, a list of (position, sheet
+    name), into the processed workbook at those tab positions.
+    """
+    if not sheets:
+        return
+    tmp = "%s.%d.tmp" % (processed_filename, os.getpid())
+    with zipfile.ZipFile(file_a) as src, zipfile.ZipFile(processed_filename) as out:
+        source = {name: (part, attrs) for (name, part, attrs) in sheet_parts(src)}
+        names = out.namelist()
+        parts = {name: out.read(name) for name in names}
+        generated = sheet_parts(out)
+        strings = _shared_strings(src)
+        styles = _StyleMerge(_read(src, "xl/styles.xml") if "xl/styles.xml" in src.namelist() else "",
+                             parts["xl/styles.xml"].decode("utf-8"))
+        parts["xl/styles.xml"] = styles.xml.encode("utf-8")
+
+        rels_part = _rels_name("xl/workbook.xml")
+        rels = parts[rels_part].decode("utf-8")
+        content_types = parts["[Content_Types].xml"].decode("utf-8")
+        next_rel = max([int(i) for i in re.findall(r'Id="rId(\d+)"', rels)] + [0]) + 1
+        next_sheet = len(generated) + 1
+        sheet_ids = [int(attrs.get("sheetId")) for (_, _, attrs) in generated]
+        next_sheet_id = max(sheet_ids + [0]) + 1
+
+        # the <sheet> entries of workbook.xml in the final tab order
+        entries = [None] * (len(generated) + len(sheets))
+        for (position, name) in sheets:
+            (part, attrs) = source[name]
+            while "xl/worksheets/sheet%d.xml" % next_sheet in parts:
+                next_sheet += 1
+            new_part = "xl/worksheets/sheet%d.xml" % next_sheet
+            parts[new_part] = _copy_sheet(_read(src, part), strings, styles).encode("utf-8")
+            rel_id = "rId%d" % next_rel
+            rels = rels.replace("</Relationships>", '<Relationship Id="%s" Type="%s" Target="worksheets/sheet%d.xml"/>'
+                                "</Relationships>" % (rel_id, WORKSHEET_TYPE, next_sheet))
+            content_types = content_types.replace("</Types>", '<Override PartName="/%s" ContentType="%s"/></Types>'
+                                                  % (new_part, WORKSHEET_CONTENT_TYPE))
+            state = ' state=%s' % quoteattr(attrs["state"]) if attrs.get("state") else ""
+            entries[position] = ('<sheet name=%s sheetId="%d"%s r:id="%s"/>'
+                                 % (quoteattr(name), next_sheet_id, state, rel_id), new_part)
+            next_rel += 1
+            next_sheet += 1
+            next_sheet_id += 1
+        free = iter(i for i, e in enumerate(entries) if e is None)
+        for (name, part, attrs) in generated:
+            entries[next(free)] = ('<sheet name=%s sheetId="%s" r:id="%s"/>'
+                                   % (quoteattr(name), attrs["sheetId"], attrs["{%s}id" % REL_NS]), part)
+        for i, (_, part) in enumerate(entries):
+            parts[part] = _select(parts[part].decode("utf-8"), i == 0).encode("utf-8")
+
+        workbook = parts["xl/workbook.xml"].decode("utf-8")
+        workbook = re.sub(r"<sheets>.*?</sheets>", lambda m: "<sheets>%s</sheets>" % "".join(e for e, _ in entries),
+                          workbook, count=1, flags=re.S)
+        workbook = re.sub(r'\sactiveTab="\d+"', "", workbook)
+        parts["xl/workbook.xml"] = workbook.encode("utf-8")
+        parts[rels_part] = rels.encode("utf-8")
+        parts["[Content_Types].xml"] = content_types.encode("utf-8")
+
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as z:
+            for name in names + [p for p in parts if p not in names]:
+                z.writestr(name, parts[name])
+    os.replace(tmp, processed_filename)
@@ -0,0 +1,245 @@
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+import match as mt
+import concurrency as cc
+
+# Pre-flight validation of the enriched usage rows.
+#
+# Rather than exiting on the first usage row whose user is not in the
+# Admin-User List, one vectorized pass over all rows finds every problem:
+#   unknown user          email not in the user list                 (stops the run)
+#   user without project  listed user without a project name         (stops the run)
+#   bad usage time        usage time that is not a number, or < 0    (stops the run)
+#   unmapped feature      feature no rule of the feature mapping resolves
+#                         (blank vendor/product)
+#   bad time              start or end time missing or not a date
+#   end before start      session that ends before it starts
+#   zero length           session with usage time but start == end
+#   duplicate feature / duplicate user
+#                         feature cell or email listed more than once in the
+#                         feature mapping or user list (the last entry is used)
+# Sessions with bad times are left out of the concurrency estimate; zero-length
+# sessions with no usage time are normal and not reported.
+#
+# Problems are grouped by the key to fix (an email or a feature), with their
+# number of rows, usage hours, first sheet row and an example value.  They
+# are written to <usage>-processed.validation.json.  With --unknown the run
+# goes on: unknown users and users without a project are counted under
+# Organization/Project "Unknown", and unmapped features under Vendor/Product
+# "Unknown"; the report is added as a Validation sheet.
+
+UNKNOWN = "Unknown"
+BLANK = "(blank)"
+SHEET_NAME = "Validation"
+
+UNKNOWN_USER = "unknown user"
+NO_PROJECT = "user without project"
+BAD_HOURS = "bad usage time"
+UNMAPPED_FEATURE = "unmapped feature"
+BAD_TIME = "bad time"
+END_BEFORE_START = "end before start"
+ZERO_LENGTH = "zero length"
+DUPLICATE_FEATURE = "duplicate feature"
+DUPLICATE_USER = "duplicate user"
+
+STOPS = "stops the run"
+LEFT_OUT = "left out of the concurrency"
+LAST_ENTRY = "the last entry is used"
+# check -> (effect, effect with --unknown), in report order
+EFFECTS = {
+    UNKNOWN_USER: (STOPS, "counted under Organization and Project 'Unknown'"),
+    NO_PROJECT: (STOPS, "counted under Project 'Unknown'"),
+    BAD_HOURS: (STOPS, STOPS),
+    UNMAPPED_FEATURE: ("blank Vendor and Product Name", "counted under Vendor and Product Name 'Unknown'"),
+    BAD_TIME: (LEFT_OUT, LEFT_OUT),
+    END_BEFORE_START: (LEFT_OUT, LEFT_OUT),
+    ZERO_LENGTH: (LEFT_OUT, LEFT_OUT),
+    DUPLICATE_FEATURE: (LAST_ENTRY, LAST_ENTRY),
+    DUPLICATE_USER: (LAST_ENTRY, LAST_ENTRY),
+}
+
+COLUMNS = ["Check", "Key", "Rows", "Hours", "First Row", "Detail"]
+
+def report_path(file_a):
+    return os.path.splitext(file_a)[0] + "-processed.validation.json"
+
+def _labels(values):
+    # keys and details as plain values, blanks spelled out
+    values = pd.Series(values, dtype=object)
+    return values.where(values.notna() & (values != ""), BLANK).to_numpy()
+
+def _issues(check, mask, keys, hours, rows, detail):
+    """The rows of one check, grouped by key."""
+    if not mask.any():
+        return None
+    frame = pd.DataFrame({
+        "Key": _labels(keys[mask]),
+        "Rows": 1,
+        "Hours": hours[mask],
+        "First Row": rows[mask],
+        "Detail": _labels(detail[mask]),
+    })
+    frame = frame.groupby("Key", sort=False).agg(
+        {"Rows": "sum", "Hours": "sum", "First Row": "min", "Detail": "first"}).reset_index()
+    frame.insert(0, "Check", check)
+    return frame
+
+def check_usage(df, feature_lookup, user_lookup, first_row=None):
+    """
+    Problems in the rows of an enriched usage frame (before --unknown bucketing),
+    one row per (check, key).  first_row is the sheet row of df's first row.
+    """
+    if first_row is None:
+        first_row = df.attrs.get("first_row", 2)
+    rows = np.arange(first_row, first_row + len(df))
+    features = df[mt.USG_FEATURE].to_numpy(dtype=object)
+    users = df[mt.USG_USERNAME].to_numpy(dtype=object)
+
+    raw_hours = df[mt.USG_TIME]
+    hours = pd.to_numeric(raw_hours, errors="coerce")
+    bad_hours = (hours.isna() & raw_hours.notna()).to_numpy() | (hours < 0).to_numpy()
+    hours = hours.fillna(0).to_numpy(dtype=float)
+
+    known_user = df["Email"].isin(user_lookup.index).to_numpy()
+    no_project = known_user & df[mt.PROJECT].isna().to_numpy()
+    known_feature = mt.matched_features(feature_lookup, df["Feature"]).to_numpy()
+
+    starts = cc.to_datetime64(df["Start Time"].to_numpy())
+    ends = cc.to_datetime64(df["End Time"].to_numpy())
+    bad_start = np.isnat(starts)
+    bad_end = np.isnat(ends)
+    bad_time = bad_start | bad_end
+    which = np.where(bad_start & bad_end, "Start Time, End Time", np.where(bad_start, "Start Time", "End Time"))
+
+    emails = df["Email"].to_numpy(dtype=object)
+    parts = [
+        _issues(UNKNOWN_USER, ~known_user, emails, hours, rows, users),
+        _issues(NO_PROJECT, no_project, emails, hours, rows, users),
+        _issues(BAD_HOURS, bad_hours, features, hours, rows, raw_hours.to_numpy(dtype=object)),
+        _issues(UNMAPPED_FEATURE, ~known_feature, df["Feature"].to_numpy(dtype=object), hours, rows, features),
+        _issues(BAD_TIME, bad_time, features, hours, rows, which),
+        _issues(END_BEFORE_START, ends < starts, features, hours, rows, users),
+        _issues(ZERO_LENGTH, (starts == ends) & (hours > 0), features, hours, rows, users),
+    ]
+    return merge_issues(parts)
+
+def _duplicates(check, duplicates):
+    if not duplicates:
+        return None
+    return pd.DataFrame({
+        "Check": check,
+        "Key": [d["key"] for d in duplicates],
+        "Rows": [d["entries"] for d in duplicates],
+        "Hours": np.nan,
+        "First Row": np.nan,
+        "Detail": [" | ".join(d["values"]) + (" (identical entries)" if len(d["values"]) == 1 else "")
+                   for d in duplicates],
+    })
+
+def check_lookups(feature_lookup, user_lookup):
+    """Keys listed more than once in the feature mapping or the user list (see mt.duplicate_keys)."""
+    return merge_issues([_duplicates(DUPLICATE_FEATURE, feature_lookup.duplicates),
+                         _duplicates(DUPLICATE_USER, user_lookup.attrs.get("duplicates", []))])
+
+def merge_issues(parts):
+    """Combine issue frames, e.g. of the chunks of a streamed usage sheet."""
+    parts = [p for p in parts if p is not None and len(p)]
+    if not parts:
+        return pd.DataFrame(columns=COLUMNS)
+    if len(parts) == 1:
+        return parts[0][COLUMNS]
+    issues = pd.concat(parts, ignore_index=True)
+    return issues.groupby(["Check", "Key"], sort=False).agg(
+        {"Rows": "sum", "Hours": lambda h: h.sum(min_count=1), "First Row": "min", "Detail": "first"}
+    ).reset_index()[COLUMNS]
+
+def stops_run(issues, unknown=False):
+    """True if one of the issues stops the run."""
+    stops = [check for (check, effects) in EFFECTS.items() if effects[1 if unknown else 0] == STOPS]
+    return bool(issues["Check"].isin(stops).any())
+
+def report(issues, file_a, nrows, unknown=False):
+    """
+    Print the issues and write them as JSON next to the output; exit if one of them
+    stops the run.  Returns the issues in report order, with their effect.
+    """
+    order = {check: i for i, check in enumerate(EFFECTS)}
+    issues = issues.assign(_order=issues["Check"].map(order)) \
+        .sort_values(["_order", "First Row"], kind="stable").drop(columns="_order").reset_index(drop=True)
+    issues["First Row"] = issues["First Row"].astype("Int64")	# blank for the lookup checks
+    issues["Effect"] = issues["Check"].map({check: effects[1 if unknown else 0]
+                                            for (check, effects) in EFFECTS.items()})
+    path = report_path(file_a)
+    if len(issues) == 0:
+        print("    %d rows, no problems found" % nrows)
+        if os.path.exists(path):	# from an earlier run
+            os.remove(path)
+        return issues
+
+    for (check, found) in issues.groupby("Check", sort=False):
+        first = found.iloc[0]
+        mark = "❌" if first["Effect"] == STOPS else "⚠️"
+        where = "" if pd.isna(first["First Row"]) else ", row %d" % first["First Row"]
+        print("    %s %s: %d key(s), %d row(s), e.g. %s%s (%s)" % (
+            mark, check, len(found), found["Rows"].sum(), first["Key"], where, first["Effect"]))
+    summary = {
+        "usage": file_a,
+        "rows": nrows,
+        "unknown": unknown,
+        "stops_run": stops_run(issues, unknown),
+        "checks": {check: {"keys": len(found), "rows": int(found["Rows"].sum())}
+                   for (check, found) in issues.groupby("Check", sort=False)},
+        "issues": json.loads(issues.to_json(orient="records", date_format="iso")),
+    }
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=2)
+    print("    validation report: %s" % path)
+
+    if summary["stops_run"]:
+        if unknown:
+            print("❌ Fix the problems above and run again.")
+        else:
+            print("❌ Fix the problems above, or run with --unknown to count unmatched users as '%s'." % UNKNOWN)
+        sys.exit(1)
+    return issues
+
+def _fill(df, mask, columns, value=UNKNOWN):
+    if not mask.any():
+        return
+    for col in columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            if value not in df[col].cat.categories:
+                df[col] = df[col].cat.add_categories([value])
+        elif df[col].dtype != object:	# e.g. a Project Name column without any match
+            df[col] = df[col].astype(object)
+        df.loc[mask, col] = value
+
+def bucket_unknown(df, feature_lookup, user_lookup):
+    """Count unmatched users and features under 'Unknown' (--unknown), in place."""
+    known_user = df["Email"].isin(user_lookup.index)
+    _fill(df, ~known_user, [mt.ORG, mt.PROJECT])
+    _fill(df, df[mt.PROJECT].isna(), [mt.PROJECT])
+    _fill(df, ~mt.matched_features(feature_lookup, df["Feature"]), [mt.VENDOR, mt.PRODUCT])
+    return df
+
+def validate_usage(df, feature_lookup, user_lookup, file_a, unknown=False):
+    """
+    Step 2.2: check all usage rows and the lookups, report the problems, and
+    with unknown bucket the unmatched rows.  Exits if a problem stops the run.
+    """
+    print("[2.2] Validate usage rows")
+    issues = merge_issues([check_lookups(feature_lookup, user_lookup),
+                           check_usage(df, feature_lookup, user_lookup)])
+    issues = report(issues, file_a, len(df), unknown)
+    if unknown:
+        bucket_unknown(df, feature_lookup, user_lookup)
+    return issues
+
+def validation_sheets(issues, unknown=False):
+    """The Validation sheet, as an extra sheet of the report (with --unknown and problems found)."""
+    if not unknown or len(issues) == 0:
+        return []
+    return [(SHEET_NAME, issues, None)]
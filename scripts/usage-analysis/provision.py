@@ -1,20 +1,14 @@
 import pandas as pd
-from collections import defaultdict
-import math
+import workbook as wb
+from columns import (PROV_SHEET, PROV_PROJECT, PROV_PERFORMER, PROV_VENDOR, PROV_PRODUCT, PROV_CURRENT_PROV,
+                     PROV_KEYWORDS, MAX_HEADER_SEARCH_ROWS, keyword_row, keyword_column)
 
 # pivot table column, which comes from match.py
 P_CONCURUSERS = "Concurrent Users"
 P_TOTAL = "_total"
 
 # ---------- CONFIG ----------
-SHEET = "Current Provisioning"
-
-# Candidate column name keywords (case-insensitive, partial matches allowed)
-PROV_PROJECT = "Project"
-PROV_PERFORMER = "Performer"
-PROV_VENDOR = "Vendor"
-PROV_PRODUCT = "Product Feature"
-PROV_CURRENT_PROV = "Current Provision"   # value column to accumulate
+# sheet name, column name keywords and header search depth: PROV_* (columns.py)
 PROV_CONCURRENT_USERS = P_CONCURUSERS
 PROV_OVER = "Over Provision"
 PROV_UNDER = "Under Provision"
@@ -23,67 +17,27 @@ PROV_TOTAL = "Usage time (hours)"	# from P_TOTAL
 
 # How many top rows may contain selection controls (not data headers)
 MAX_SELECTION_ROWS = 9
-# How far to search for header row (some tolerance)
-MAX_HEADER_SEARCH_ROWS = 20
 # ----------------------------
 
 
 def find_header_row(raw_df, required_keywords, max_search=20):
     """
     Scan the first `max_search` rows to find a row that contains all required keywords
-    (partial, case-insensitive match). Returns header_row_index (0-based) or None.
+    (partial, case-insensitive match, columns.keyword_row). Returns header_row_index (0-based) or None.
     """
-    for i in range(min(max_search, len(raw_df))):
-        row_vals = ["" if pd.isna(v) else str(v).strip().lower() for v in raw_df.iloc[i].tolist()]
-        found_all = True
-        for kw in required_keywords:
-            # check if any cell contains the keyword substring
-            if not any(kw.lower() in cell for cell in row_vals if cell):
-                found_all = False
-                break
-        if found_all:
-            return i
-    return None
-
-def normalize_col_name(col):
-    return "" if pd.isna(col) else str(col).strip().lower()
-
-def match_column_name(cols, keyword):
-    """
-    Return the actual column name from `cols` that best matches `keyword` (partial, case-insensitive).
-    If none found, return None.
-    """
-    keyword = keyword.lower()
-    for c in cols:
-        if keyword in normalize_col_name(c):
-            return c
-    # fallback: exact match ignoring case/whitespace
-    for c in cols:
-        if normalize_col_name(c) == keyword:
-            return c
-    return None
-
-# Helper to detect NaN
-def is_nan(x):
-    return isinstance(x, float) and math.isnan(x)
-
-# Depth-first traversal of pivot_data
-def traverse_pivot(pivot_data, callback, path=None):
-    if path is None:
-        path = []
-
-    if not isinstance(pivot_data, dict):
-        # Reached a leaf value
-        callback(path, pivot_data)
-        return
-
-    for key, value in pivot_data.items():
-        if key is None or is_nan(key):
-            continue
-
-        traverse_pivot(value, callback, path + [key])
-
-def update_df_provision_with_pivot(df_provision, pivot_data):
+    return keyword_row(raw_df.itertuples(index=False), required_keywords, max_search)
+
+# Flat frame of the product-level pivot groups: one row per [proj, perf, vend, prod]
+# with its P_CONCURUSERS and P_TOTAL values (groups with a blank key are left out)
+def pivot_leaves(df_product):
+    keys = [PROV_PROJECT, PROV_PERFORMER, PROV_VENDOR, PROV_PRODUCT]
+    df_leaves = df_product.iloc[:, :len(keys)].astype(object)
+    df_leaves.columns = keys
+    df_leaves[PROV_CONCURRENT_USERS] = df_product[P_CONCURUSERS].to_numpy()
+    df_leaves[PROV_TOTAL] = df_product[P_TOTAL].to_numpy()
+    return df_leaves[df_leaves.notna().all(axis=1)].reset_index(drop=True)
+
+def update_df_provision_with_pivot(df_provision, df_product):
 
     """
     df_provision must contain columns:
@@ -95,6 +49,7 @@ def update_df_provision_with_pivot(df_provision, pivot_data):
     - Fills/updates concurrency values
     - Appends new rows if not found
     """
+    keys = [PROV_PROJECT, PROV_PERFORMER, PROV_VENDOR, PROV_PRODUCT]
 
     # sort df_provision first
     df_provision = df_provision.copy()
@@ -106,10 +61,7 @@ def update_df_provision_with_pivot(df_provision, pivot_data):
         "USC-ISI, The MOSIS Services": "MOSIS 2.0",
         "UCR, The MOSIS Services": "UCR"
     }
-
-    for i, row in df_provision.iterrows():
-        if (row[PROV_PERFORMER] in trans_performer):
-            row[PROV_PERFORMER] = trans_performer[row[PROV_PERFORMER]]
+    df_provision[PROV_PERFORMER] = df_provision[PROV_PERFORMER].replace(trans_performer)
 
     if PROV_CONCURRENT_USERS not in df_provision.columns:
         df_provision.loc[:,PROV_CONCURRENT_USERS] = 0
@@ -117,79 +69,45 @@ def update_df_provision_with_pivot(df_provision, pivot_data):
         df_provision.loc[:,PROV_UNDER] = 0	# red
         df_provision.loc[:,PROV_EVEN] = "No"    # blue
         df_provision.loc[:,PROV_TOTAL] = 0
- 
-    # This callback is executed for each leaf of pivot_data
-    def handle_leaf(path, value):
-        # path = [proj, perf, vend, prod, P_CONCURUSERS]
-        if len(path) != 5:
-            return
-
-        proj, perf, vend, prod, field = path
-
-        # Only process the P_CONCURUSERS leaves
-        if field != P_CONCURUSERS and field != P_TOTAL:
-            return
-
-        # Build filter
-        match = (
-            (df_provision[PROV_PROJECT] == proj) &
-            (df_provision[PROV_PERFORMER] == perf) &
-            (df_provision[PROV_VENDOR] == vend) &
-            (df_provision[PROV_PRODUCT] == prod)
-        )
-
-        column_name = PROV_CONCURRENT_USERS
-        if (field == P_TOTAL):
-            column_name = PROV_TOTAL
-        if match.any():
-            # Update existing row
-            df_provision.loc[match, column_name] = value
-        else:
-            # Append a new row
-            #df_provision.loc[match, "concurrency"] = value
-            new_row = {
-                PROV_PROJECT: proj,
-                PROV_PERFORMER: perf,
-                PROV_VENDOR: vend,
-                PROV_PRODUCT: prod,
-                PROV_CURRENT_PROV: 0,
-                column_name: value,
-            }
-            df_provision.loc[len(df_provision)] = new_row
-
-    # Traverse the tree
-    traverse_pivot(pivot_data, handle_leaf)
+
+    # Keyed join between the provisioning rows and the pivot leaves
+    df_leaves = pivot_leaves(df_product)
+    joined = df_provision[keys].merge(df_leaves, on=keys, how="left", indicator=True)
+    found = (joined["_merge"] == "both").to_numpy()
+    for column_name in [PROV_CONCURRENT_USERS, PROV_TOTAL]:
+        # Update existing rows
+        values = pd.Series(joined[column_name].to_numpy(), index=df_provision.index)
+        df_provision[column_name] = values.where(found, df_provision[column_name])
+
+    # Append the leaves not found in the provisioning table
+    known = df_provision[keys].dropna().drop_duplicates()
+    new_rows = df_leaves.merge(known, on=keys, how="left", indicator=True)
+    new_rows = new_rows[new_rows["_merge"] == "left_only"].drop(columns="_merge")
+    new_rows.insert(len(keys), PROV_CURRENT_PROV, 0)
+    new_rows.index = pd.RangeIndex(len(df_provision), len(df_provision) + len(new_rows))
+    df_provision = pd.concat([df_provision, new_rows.reindex(columns=df_provision.columns)])
 
     # Add 'diff' field
-    for i, row in df_provision.iterrows():
-        if (pd.isna(row[PROV_PROJECT]) or row[PROV_PROJECT] == ""):
-            df_provision.loc[i, PROV_EVEN] = ""
-            df_provision.loc[i, PROV_OVER] = ""
-            df_provision.loc[i, PROV_UNDER] = ""
-            continue 
-        diff = row[PROV_CURRENT_PROV] - row[PROV_CONCURRENT_USERS]
-        if diff == 0: # adequate
-            df_provision.loc[i, PROV_EVEN] = "Yes"
-            df_provision.loc[i, PROV_OVER] = ""
-            df_provision.loc[i, PROV_UNDER] = ""
-        elif diff > 0: # over
-            df_provision.loc[i, PROV_EVEN] = ""
-            df_provision.loc[i, PROV_OVER] = diff
-            df_provision.loc[i, PROV_UNDER] = ""
-        else : # under
-            df_provision.loc[i, PROV_EVEN] = ""
-            df_provision.loc[i, PROV_OVER] = ""
-            df_provision.loc[i, PROV_UNDER] = diff
+    blank = df_provision[PROV_PROJECT].isna() | (df_provision[PROV_PROJECT] == "")
+    diff = df_provision.loc[~blank, PROV_CURRENT_PROV] - df_provision.loc[~blank, PROV_CONCURRENT_USERS]
+    diff = diff.reindex(df_provision.index)
+    even = ~blank & (diff == 0)	# adequate
+    over = ~blank & (diff > 0)	# over
+    under = ~blank & ~even & ~over	# under
+    df_provision[PROV_EVEN] = pd.Series("", index=df_provision.index, dtype=object).mask(even, "Yes")
+    df_provision[PROV_OVER] = diff.astype(object).where(over, "")
+    df_provision[PROV_UNDER] = diff.astype(object).where(under, "")
  
     return df_provision
 
-def build_current_provision_usage(file_prov, pivot_data):
-    # --- Step 0: read sheet with no header so we can detect header row ---
-    raw = pd.read_excel(file_prov, sheet_name=SHEET, header=None)
+def build_current_provision_usage(file_prov, df_product):
+    # --- Step 0: load the workbook once; its raw grid is used to detect the header row ---
+    book = wb.open_workbook(file_prov)
+    sheet = book.sheet_names[0] if book.single_table else PROV_SHEET
+    raw = book.grid(sheet)
     
     # --- Step 1: detect header row within first MAX_HEADER_SEARCH_ROWS rows ---
-    required_keywords = [PROV_PROJECT, PROV_PERFORMER, PROV_VENDOR, PROV_PRODUCT, PROV_CURRENT_PROV]
-    header_idx = find_header_row(raw, required_keywords, max_search=MAX_HEADER_SEARCH_ROWS)
+    header_idx = find_header_row(raw, PROV_KEYWORDS, max_search=MAX_HEADER_SEARCH_ROWS)
     
     if header_idx is None:
         raise RuntimeError(f"Failed to detect header row within first {MAX_HEADER_SEARCH_ROWS} rows. "
@@ -197,16 +115,16 @@ def build_current_provision_usage(file_prov, pivot_data):
     
     #print(f"Detected header row (1-based): {header_idx + 1}")
     
-    # --- Step 2: read again using detected header row ---
-    df_provision = pd.read_excel(file_prov, sheet_name=SHEET, header=header_idx, dtype=object)
+    # --- Step 2: build the frame from the cached grid using detected header row ---
+    df_provision = book.parse(sheet, header=header_idx, dtype=object)
     
     # --- Step 3: Map columns robustly (partial matches) ---
     cols = list(df_provision.columns)
-    project_col = match_column_name(cols, PROV_PROJECT)
-    performer_col = match_column_name(cols, PROV_PERFORMER)
-    vendor_col = match_column_name(cols, PROV_VENDOR)
-    product_col = match_column_name(cols, PROV_PRODUCT)
-    value_col = match_column_name(cols, PROV_CURRENT_PROV)
+    project_col = keyword_column(cols, PROV_PROJECT)
+    performer_col = keyword_column(cols, PROV_PERFORMER)
+    vendor_col = keyword_column(cols, PROV_VENDOR)
+    product_col = keyword_column(cols, PROV_PRODUCT)
+    value_col = keyword_column(cols, PROV_CURRENT_PROV)
     
     missing = [name for name, actual in [
         (PROV_PROJECT, project_col),
@@ -221,8 +139,10 @@ def build_current_provision_usage(file_prov, pivot_data):
    
     keep_cols = [ project_col, performer_col, vendor_col, product_col, value_col]
     df_provision_filtered = df_provision[keep_cols]
+    # use the standard names for the matched columns; the reconciliation joins on them
+    df_provision_filtered.columns = PROV_KEYWORDS
 
-    df_provision_final = update_df_provision_with_pivot(df_provision_filtered, pivot_data)
+    df_provision_final = update_df_provision_with_pivot(df_provision_filtered, df_product)
     return df_provision_final
 
 def set_color_column(writer, df_prov, sheet_name):
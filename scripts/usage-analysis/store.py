@@ -0,0 +1,385 @@
+import sys
+import os
+import time
+import sqlite3
+import hashlib
+import argparse
+import datetime
+import cache as ch
+
+# Local usage store for ad hoc queries (SQLite).
+#
+# The enriched usage frame of each monthly usage log (sessions with their
+# user, performer, project, vendor, product and feature) and the reconciled
+# provisioning table of that month are loaded into one SQLite file.  Rows are
+# partitioned by hub and month: loading a month again replaces that hub's
+# month, and a month whose input files have not changed is not read again.
+# The usage table is indexed on user, product, vendor, performer and start
+# time, so the lookups below answer in milliseconds without re-reading any
+# workbook.
+#
+#   python store.py load --db usage.db --hub CA_DREAMS --features F.xlsx \
+#                        --users U.xlsx [--provisioning P.xlsx] CA_DREAMS-Usage-Data-2025.*.xlsx
+#   python store.py load --db usage.db --manifest hubs.json
+#   python store.py hours --db usage.db --user jdoe --product Virtuoso --last 6 --by month
+#   python store.py features --db usage.db --performer UCLA
+#   python store.py provisioning --db usage.db --hub CA_DREAMS --month 2025-11
+#   python store.py sql --db usage.db "SELECT ..."
+
+STORE_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS partitions (
+    hub TEXT NOT NULL, month TEXT NOT NULL, usage_file TEXT, provisioning_file TEXT,
+    inputs_hash TEXT, sessions INTEGER, provisioning_rows INTEGER, loaded TEXT,
+    PRIMARY KEY (hub, month));
+CREATE TABLE IF NOT EXISTS usage (
+    hub TEXT NOT NULL, month TEXT NOT NULL, user TEXT, email TEXT, project TEXT, performer TEXT,
+    vendor TEXT, product TEXT, feature TEXT, start TEXT, end TEXT, hours REAL);
+CREATE INDEX IF NOT EXISTS usage_partition ON usage (hub, month);
+CREATE INDEX IF NOT EXISTS usage_user ON usage (user, product, month);
+CREATE INDEX IF NOT EXISTS usage_product ON usage (product, feature, month);
+CREATE INDEX IF NOT EXISTS usage_vendor ON usage (vendor, product);
+CREATE INDEX IF NOT EXISTS usage_performer ON usage (performer, project, month);
+CREATE INDEX IF NOT EXISTS usage_start ON usage (start);
+CREATE TABLE IF NOT EXISTS provisioning (
+    hub TEXT NOT NULL, month TEXT NOT NULL, project TEXT, performer TEXT, vendor TEXT, product TEXT,
+    current_provision REAL, concurrent_users REAL, over_provision REAL, under_provision REAL,
+    adequate TEXT, hours REAL);
+CREATE INDEX IF NOT EXISTS provisioning_partition ON provisioning (hub, month);
+CREATE INDEX IF NOT EXISTS provisioning_performer ON provisioning (performer, product);
+CREATE INDEX IF NOT EXISTS provisioning_product ON provisioning (product);
+"""
+
+# query option -> usage/provisioning column
+FILTERS = {"hub": "hub", "user": "user", "project": "project", "performer": "performer",
+           "vendor": "vendor", "product": "product", "feature": "feature"}
+PROVISIONING_FILTERS = ["hub", "project", "performer", "vendor", "product"]
+GROUP_COLUMNS = ["hub", "month"] + list(FILTERS)[1:]
+
+def connect(path, create=False):
+    if not create and not os.path.exists(path):
+        print("❌ Usage store %s not found; create it with: python store.py load --db %s ..." % (path, path))
+        sys.exit(1)
+    con = sqlite3.connect(path)
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    if version == 0:
+        con.executescript(SCHEMA)
+        con.execute("PRAGMA user_version = %d" % STORE_VERSION)
+    elif version != STORE_VERSION:
+        print("❌ %s was written by another version of store.py; load the usage files into a new store." % path)
+        sys.exit(1)
+    return con
+
+# ---------- loading ----------
+
+def inputs_hash(files):
+    h = hashlib.sha256()
+    for f in files:
+        h.update((ch.file_hash(f) if f else "-").encode())
+    return h.hexdigest()
+
+def _text(values):
+    # object column -> list of str or None (NaN and "" are stored as NULL)
+    return [None if v is None or v != v or v == "" else str(v) for v in values]
+
+def _times(values):
+    import numpy as np
+    import concurrency as cc
+    stamps = np.datetime_as_string(cc.to_datetime64(values), unit="s")
+    return [None if s == "NaT" else s.replace("T", " ") for s in stamps]
+
+def _numbers(values):
+    out = []
+    for v in values:
+        try:
+            v = float(v)
+        except (TypeError, ValueError):
+            v = None
+        out.append(None if v is None or v != v else v)
+    return out
+
+def usage_rows(hub, month, df):
+    import match as mt
+    n = len(df)
+    email = df["Email"] if "Email" in df.columns else [None] * n
+    columns = [[hub] * n, [month] * n,
+               _text(df[mt.USG_USERNAME]), _text(email), _text(df[mt.PROJECT]), _text(df[mt.ORG]),
+               _text(df[mt.VENDOR]), _text(df[mt.PRODUCT]), _text(df[mt.USG_FEATURE]),
+               _times(df["Start Time"].to_numpy()), _times(df["End Time"].to_numpy()),
+               _numbers(df[mt.USG_TIME])]
+    return list(zip(*columns))
+
+def provisioning_rows(hub, month, df_prov):
+    import provision as pr
+    n = len(df_prov)
+    columns = [[hub] * n, [month] * n] + \
+        [_text(df_prov[c]) for c in [pr.PROV_PROJECT, pr.PROV_PERFORMER, pr.PROV_VENDOR, pr.PROV_PRODUCT]] + \
+        [_numbers(df_prov[c]) for c in [pr.PROV_CURRENT_PROV, pr.PROV_CONCURRENT_USERS, pr.PROV_OVER,
+                                        pr.PROV_UNDER]] + \
+        [_text(df_prov[pr.PROV_EVEN]), _numbers(df_prov[pr.PROV_TOTAL])]
+    return list(zip(*columns))
+
+def reconciled_provisioning(df, file_d):
+    """The Tool Usage table of the month: the provisioning file joined with the product-level usage."""
+    import match as mt
+    import provision as pr
+    (levels, users) = mt.pivot_levels(mt.aggregate_usage(df), mt.PIVOT_ORDER_TEAM)
+    return pr.build_current_provision_usage(file_d, levels[mt.PIVOT_ORDER_TEAM.index(mt.PRODUCT)])
+
+def load_month(con, hub, file_a, feature_lookup, user_lookup, lookup_files, file_d=None, cache=None, month=None,
+               unknown=False):
+    """Load one usage log (and its provisioning table) as the hub's month; returns the month."""
+    import match as mt
+    import ytd as yt
+    import preflight as pf
+    digest = inputs_hash([file_a] + list(lookup_files) + [file_d])
+    for (m,) in con.execute("SELECT month FROM partitions WHERE hub = ? AND inputs_hash = ?", (hub, digest)):
+        if month in (None, m):
+            print("    %s %s: %s already loaded, unchanged" % (hub, m, file_a))
+            return m
+
+    print("[2.1] Read usage file: %s" % file_a)
+    if cache is not None:
+        (sheets, df) = cache.cached("usage", [file_a] + list(lookup_files),
+                                    lambda: mt.load_usage_file(file_a, feature_lookup, user_lookup))
+    else:
+        (sheets, df) = mt.load_usage_file(file_a, feature_lookup, user_lookup)
+    pf.validate_usage(df, feature_lookup, user_lookup, file_a, unknown)
+    month = month or yt.usage_month(df)
+    prov = []
+    if file_d:
+        print("[4] Build table comparing current provisions (from file: %s) and actual usage" % file_d)
+        prov = provisioning_rows(hub, month, reconciled_provisioning(df, file_d))
+    sessions = usage_rows(hub, month, df)
+
+    previous = con.execute("SELECT usage_file, loaded FROM partitions WHERE hub = ? AND month = ?",
+                           (hub, month)).fetchone()
+    if previous is not None:
+        print("⚠️ %s %s was already loaded (from %s on %s); replacing it with %s" % (
+            hub, month, previous[0], previous[1], file_a))
+    with con:	# one transaction: a month is replaced completely or not at all
+        for table in ("usage", "provisioning", "partitions"):
+            con.execute("DELETE FROM %s WHERE hub = ? AND month = ?" % table, (hub, month))
+        con.executemany("INSERT INTO usage VALUES (%s)" % ", ".join("?" * 12), sessions)
+        con.executemany("INSERT INTO provisioning VALUES (%s)" % ", ".join("?" * 12), prov)
+        con.execute("INSERT INTO partitions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (hub, month, file_a, file_d, digest, len(sessions), len(prov),
+                     time.strftime("%Y-%m-%d %H:%M:%S")))
+    print("    %s %s: %d sessions, %d provisioning rows" % (hub, month, len(sessions), len(prov)))
+    return month
+
+def load(args):
+    import match as mt
+    import batch as bt
+    if args.manifest:
+        (file_b, hubs) = bt.load_manifest(args.manifest)
+    elif args.hub and args.features and args.users and args.usage:
+        file_b = args.features
+        hubs = [{"name": args.hub, "usage": bt.expand_usage_files(args.usage), "users": args.users,
+                 "provisioning": args.provisioning}]
+    else:
+        print("❌ Give either --manifest, or usage files with --hub, --features and --users.")
+        sys.exit(1)
+    if args.month and sum(len(hub["usage"]) for hub in hubs) > 1:
+        print("❌ --month applies to a single usage file.")
+        sys.exit(1)
+    cache = ch.Cache(enabled=not args.no_cache, rebuild=args.rebuild_cache)
+    con = connect(args.db, create=True)
+
+    print("[1] Build mapping dictionary from EDA feature file: %s" % file_b)
+    feature_lookup = cache.cached("features", [file_b], lambda: mt.setup_feature_dictionary(file_b))
+    for hub in hubs:
+        print("[2] Build mapping dictionary from User list file: %s" % hub["users"])
+        user_lookup = cache.cached("users", [hub["users"]], lambda: mt.setup_user_dictionary(hub["users"]))
+        for file_a in hub["usage"]:
+            load_month(con, hub["name"], file_a, feature_lookup, user_lookup, [file_b, hub["users"]],
+                       hub["provisioning"], cache, args.month, args.unknown)
+    con.close()
+
+def remove(args):
+    con = connect(args.db)
+    with con:
+        for month in args.month:
+            removed = 0
+            for table in ("usage", "provisioning", "partitions"):
+                removed += con.execute("DELETE FROM %s WHERE hub = ? AND month = ?" % table,
+                                       (args.hub, month)).rowcount
+            if not removed:
+                print("⚠️ %s %s is not in %s" % (args.hub, month, args.db))
+    con.execute("VACUUM")
+
+# ---------- queries ----------
+
+def period_bounds(value, option):
+    """YYYY-MM or YYYY-MM-DD as the [first, next) start-time strings of that month or day."""
+    try:
+        if len(value) == 7:
+            first = datetime.datetime.strptime(value, "%Y-%m")
+            following = (first + datetime.timedelta(days=32)).replace(day=1)
+        else:
+            first = datetime.datetime.strptime(value, "%Y-%m-%d")
+            following = first + datetime.timedelta(days=1)
+    except ValueError:
+        print("❌ Invalid %s '%s' (YYYY-MM or YYYY-MM-DD)" % (option, value))
+        sys.exit(1)
+    return (first.strftime("%Y-%m-%d %H:%M:%S"), following.strftime("%Y-%m-%d %H:%M:%S"))
+
+def where_clause(con, args, columns, time_column=None):
+    """WHERE clause and parameters from the filter options that apply to `columns`."""
+    terms = []
+    params = []
+    for option in columns:
+        value = getattr(args, option, None)
+        if value is not None:
+            terms.append("%s = ?" % FILTERS[option])
+            params.append(value)
+    if args.month:
+        terms.append("month = ?")
+        params.append(args.month)
+    if args.last:
+        months = [m for (m,) in con.execute("SELECT DISTINCT month FROM partitions ORDER BY month DESC LIMIT ?",
+                                            (args.last,))]
+        terms.append("month >= ?")
+        params.append(months[-1] if months else "")
+    for (option, bound, op) in (("from", 0, ">="), ("to", 1, "<")):
+        value = getattr(args, option)
+        if value:
+            if time_column:
+                terms.append("%s %s ?" % (time_column, op))
+                params.append(period_bounds(value, "--" + option)[bound])
+            else:	# whole months
+                terms.append("month %s ?" % ("<=" if op == "<" else op))
+                params.append(period_bounds(value, "--" + option)[0][:7])
+    return ("WHERE " + " AND ".join(terms) if terms else "", params)
+
+def group_columns(value):
+    columns = [c.strip() for c in (value or "").split(",") if c.strip()]
+    unknown = [c for c in columns if c not in GROUP_COLUMNS]
+    if unknown:
+        print("❌ Unknown --by column(s) %s; choose from %s" % (", ".join(unknown), ", ".join(GROUP_COLUMNS)))
+        sys.exit(1)
+    return [FILTERS.get(c, c) for c in columns]
+
+def hours_query(con, args):
+    by = group_columns(args.by)
+    (where, params) = where_clause(con, args, FILTERS, "start")
+    select = ", ".join(by + ["COUNT(*) AS sessions", "COUNT(DISTINCT user) AS users",
+                             "ROUND(SUM(hours), 2) AS hours"])
+    group = ("GROUP BY %s ORDER BY %s" % (", ".join(by), ", ".join(by))) if by else ""
+    return ("SELECT %s FROM usage %s %s" % (select, where, group), params)
+
+def features_query(con, args):
+    (where, params) = where_clause(con, args, FILTERS, "start")
+    return ("SELECT vendor, product, feature, COUNT(*) AS sessions, COUNT(DISTINCT user) AS users, "
+            "ROUND(SUM(hours), 2) AS hours, MIN(start) AS first_use, MAX(end) AS last_use "
+            "FROM usage %s GROUP BY vendor, product, feature ORDER BY vendor, product, feature" % where, params)
+
+def provisioning_query(con, args):
+    (where, params) = where_clause(con, args, PROVISIONING_FILTERS)
+    return ("SELECT hub, month, project, performer, vendor, product, current_provision, concurrent_users, "
+            "over_provision, under_provision, adequate, hours FROM provisioning %s "
+            "ORDER BY hub, month, project, performer, vendor, product" % where, params)
+
+def months_query(con, args):
+    return ("SELECT hub, month, sessions, provisioning_rows, usage_file, loaded FROM partitions "
+            "ORDER BY hub, month", [])
+
+def format_value(v):
+    if v is None:
+        return ""
+    if isinstance(v, float):
+        return ("%d" % v) if v.is_integer() else ("%.2f" % v)
+    return str(v)
+
+def print_rows(columns, rows):
+    cells = [columns] + [[format_value(v) for v in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+    for row in cells:
+        print("  " + "  ".join(c.ljust(w) for c, w in zip(row, widths)).rstrip())
+
+def run_query(args, build):
+    con = connect(args.db)
+    if build is None:	# sql
+        (query, params) = (args.query, [])
+    else:
+        (query, params) = build(con, args)
+    t0 = time.perf_counter()
+    try:
+        cursor = con.execute(query, params)
+        rows = cursor.fetchall()
+    except sqlite3.Error as e:
+        print("❌ %s" % e)
+        sys.exit(1)
+    elapsed = time.perf_counter() - t0
+    columns = [d[0] for d in cursor.description] if cursor.description else []
+    if columns:
+        print_rows(columns, rows)
+    print("    %d row(s) in %.1f ms" % (len(rows), elapsed * 1000))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load usage logs into a local SQLite store and query it.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    db = argparse.ArgumentParser(add_help=False)
+    db.add_argument("--db", required=True, help="SQLite store file, e.g. usage.db")
+
+    period = argparse.ArgumentParser(add_help=False)
+    period.add_argument("--hub", help="only this hub")
+    period.add_argument("--month", help="only this month (YYYY-MM)")
+    period.add_argument("--last", type=int, metavar="N", help="only the last N months in the store")
+    period.add_argument("--from", metavar="DATE", help="from this month or day on (YYYY-MM or YYYY-MM-DD)")
+    period.add_argument("--to", metavar="DATE", help="up to and including this month or day")
+
+    tools = argparse.ArgumentParser(add_help=False)
+    for option in ["project", "performer", "vendor", "product"]:
+        tools.add_argument("--" + option, help="only this %s" % option)
+
+    sessions = argparse.ArgumentParser(add_help=False)
+    sessions.add_argument("--user", help="only this user name")
+    sessions.add_argument("--feature", help="only this product feature")
+
+    p = commands.add_parser("load", parents=[db], help="load monthly usage logs (replaces a reloaded month)")
+    p.add_argument("usage", nargs="*", help="usage files (globs allowed)")
+    p.add_argument("--hub", help="hub the usage files belong to")
+    p.add_argument("--manifest", help="batch.py manifest listing the hubs and their files")
+    p.add_argument("--features", help="feature mapping file")
+    p.add_argument("--users", help="user list file")
+    p.add_argument("--provisioning", help="current provisioning file (loads the Tool Usage table as well)")
+    p.add_argument("--month", help="YYYY-MM of the (single) usage file, instead of the session dates")
+    p.add_argument("--unknown", action="store_true",
+                   help="count unknown users and unmapped features under 'Unknown' instead of stopping")
+    p.add_argument("--no-cache", action="store_true", help="do not read or write the on-disk cache")
+    p.add_argument("--rebuild-cache", action="store_true", help="ignore cached entries and rebuild them")
+    p.set_defaults(func=load)
+
+    p = commands.add_parser("remove", parents=[db], help="drop months of a hub")
+    p.add_argument("--hub", required=True)
+    p.add_argument("--month", action="append", required=True, metavar="YYYY-MM")
+    p.set_defaults(func=remove)
+
+    p = commands.add_parser("months", parents=[db], help="list the loaded hubs and months")
+    p.set_defaults(func=lambda args: run_query(args, months_query))
+
+    p = commands.add_parser("hours", parents=[db, period, tools, sessions],
+                            help="sessions, users and hours, optionally grouped")
+    p.add_argument("--by", help="group by a comma-separated list of %s" % ", ".join(GROUP_COLUMNS))
+    p.set_defaults(func=lambda args: run_query(args, hours_query))
+
+    p = commands.add_parser("features", parents=[db, period, tools, sessions],
+                            help="features used, with sessions, users, hours and first/last use")
+    p.set_defaults(func=lambda args: run_query(args, features_query))
+
+    p = commands.add_parser("provisioning", parents=[db, period, tools],
+                            help="the reconciled provisioning (Tool Usage) rows")
+    p.set_defaults(func=lambda args: run_query(args, provisioning_query))
+
+    p = commands.add_parser("sql", parents=[db], help="run an SQL query on the usage/provisioning/partitions tables")
+    p.add_argument("query")
+    p.set_defaults(func=lambda args: run_query(args, None))
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
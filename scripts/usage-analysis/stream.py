@@ -0,0 +1,303 @@
+import sys
+import os
+import time
+from types import SimpleNamespace
+import pandas as pd
+import xlsxwriter
+from openpyxl import load_workbook
+from pandas.io.parsers import TextParser
+import workbook as wb
+import match as mt
+import provision as pr
+import instrument as ins
+import passthrough as pt
+import preflight as pf
+import coalesce as cs
+from columns import usage_header_row
+
+# Streaming ingestion for very large usage logs.
+#
+# The usage sheet is read with openpyxl in read-only mode (or a CSV usage log
+# with the csv module), one row at a time.
+# The header is detected from the first rows, and the session rows are
+# enriched and aggregated in chunks of CHUNK_ROWS straight into the usage
+# aggregate, so the full sheet is never held in memory.  What grows with the
+# number of rows is the aggregate itself: one entry per (project, org, vendor,
+# product, feature, user) plus one 16-byte interval per session with usage,
+# which the concurrency estimate needs.
+#
+# Each chunk is checked as it is aggregated (preflight.py), and the problems
+# of all chunks are reported together once the sheet has been read.  With
+# --coalesce, overlapping sessions are merged within each chunk (coalesce.py);
+# overlaps between rows of different chunks are counted as they are.
+#
+# The processed workbook is written with xlsxwriter in constant-memory mode;
+# the Usage sheet is filled by a second streaming pass over the source.  CSV
+# table output appends the usage table chunk by chunk in the same way.
+# match.py --constant-memory uses the same writer for an in-memory usage
+# frame, passed in chunks of rows (frame_chunks).
+
+CHUNK_ROWS = 20000
+# chunk aggregates are merged into one every MERGE_EVERY chunks
+MERGE_EVERY = 10
+
+# pandas' default header and datetime formats of to_excel
+HEADER_FORMAT = {"bold": True, "border": 1, "align": "center", "valign": "top"}
+DATETIME_FORMAT = "yyyy-mm-dd hh:mm:ss"
+
+def _frame(header, rows):
+    # same column naming and type inference as pd.read_excel(header=...)
+    width = len(header)
+    rows = [(r + [""] * (width - len(r)))[:width] for r in rows]
+    return TextParser([header] + rows, header=0, skip_blank_lines=False).read()
+
+class UsageStream:
+    """Read-only view of a usage workbook or CSV file: finds the usage sheet and its header row."""
+    def __init__(self, file_a):
+        self.file_a = file_a
+        self.book = None
+        if wb.file_format(file_a) == "parquet":
+            print("❌ --stream reads .xlsx and .csv usage logs; %s is a Parquet file." % file_a)
+            sys.exit(1)
+        elif wb.file_format(file_a) == "csv":
+            self.sheet_names = [wb.table_name(file_a)]
+        else:
+            self.book = load_workbook(file_a, read_only=True, data_only=True, keep_links=False)
+            self.sheet_names = list(self.book.sheetnames)
+        self.target_sheet = None
+        self.header_row = 0
+
+        for sheet in self.sheet_names:
+            (header_row, header) = self.sheet_header(sheet)
+            if mt.USG_USERNAME in _frame(header, []).columns:
+                self.target_sheet = sheet
+                self.header_row = header_row
+                self.header = header
+                break
+
+        if not self.target_sheet:
+            print("❌ Could not find a sheet with 'User Name' in first or second row.")
+            sys.exit(1)
+
+    def rows(self, sheet):
+        """The rows of a sheet, as wb.iter_sheet_rows yields them."""
+        if self.book is not None:
+            yield from wb.iter_sheet_rows(self.book[sheet])
+            return
+        with wb.open_csv(self.file_a) as f:
+            yield from wb.iter_csv_rows(f)
+
+    def sheet_header(self, sheet):
+        rows = []
+        it = self.rows(sheet)
+        for row in it:
+            rows.append(row)
+            if len(rows) == 2:
+                break
+        it.close()
+        header_row = usage_header_row(rows)
+        header = rows[header_row] if header_row < len(rows) else []
+        return (header_row, header)
+
+    def chunks(self, chunk_rows=CHUNK_ROWS):
+        """Yield the usage sheet as frames of at most chunk_rows rows (at least one frame)."""
+        rows = []
+        emitted = False
+        it = self.rows(self.target_sheet)
+        for i, row in enumerate(it):
+            if i <= self.header_row:
+                continue
+            rows.append(row)
+            if len(rows) == chunk_rows:
+                yield _frame(self.header, rows)
+                emitted = True
+                rows = []
+        if rows or not emitted:
+            yield _frame(self.header, rows)
+
+    def other_sheets(self, copy_sheets=False):
+        """The non-usage sheets as (sheet name, frame), None for the usage sheet (mt.COPIED_SHEET if copied)."""
+        copyable = pt.copyable_sheets(self.file_a) if copy_sheets else set()
+        sheets = []
+        for sheet in self.sheet_names:
+            if sheet == self.target_sheet:
+                sheets.append((sheet, None))
+                continue
+            if sheet in copyable:
+                sheets.append((sheet, mt.COPIED_SHEET))
+                continue
+            data = list(self.rows(sheet))
+            header_row = usage_header_row(data)
+            if header_row >= len(data):
+                sheets.append((sheet, pd.DataFrame()))
+                continue
+            width = max(len(r) for r in data)
+            header = data[header_row] + [""] * (width - len(data[header_row]))
+            sheets.append((sheet, _frame(header, data[header_row + 1:])))
+        return sheets
+
+    def close(self):
+        if self.book is not None:
+            self.book.close()
+
+def enriched_chunks(stream, feature_lookup, user_lookup, chunk_rows=CHUNK_ROWS, counts=None, unknown=False):
+    for chunk in stream.chunks(chunk_rows):
+        mt.check_usage_columns(chunk.columns)
+        chunk_counts = mt.enrich_usage(chunk, feature_lookup, user_lookup, report=False)
+        if counts is not None:
+            for col, n in chunk_counts.items():
+                counts[col] = counts.get(col, 0) + n
+        if unknown:
+            pf.bucket_unknown(chunk, feature_lookup, user_lookup)
+        yield chunk
+
+def aggregate_stream(stream, feature_lookup, user_lookup, chunk_rows=CHUNK_ROWS, compact=False, unknown=False,
+                     coalesce=None):
+    """
+    Enrich, check and aggregate the usage sheet chunk by chunk; returns
+    (aggregate, rows, columns, validation issues).  Exits if a problem stops the run.
+    With coalesce, overlapping sessions are merged within each chunk.
+    """
+    counts = {}
+    parts = []
+    problems = [pf.check_lookups(feature_lookup, user_lookup)]
+    stops = False
+    nrows = 0
+    columns = None
+    first_row = stream.header_row + 2
+    merged = [0, 0.0]	# rows merged away, hours removed (--coalesce)
+    for chunk in enriched_chunks(stream, feature_lookup, user_lookup, chunk_rows, counts):
+        problems.append(pf.check_usage(chunk, feature_lookup, user_lookup, first_row + nrows))
+        stops = stops or pf.stops_run(problems[-1], unknown)
+        if unknown:
+            pf.bucket_unknown(chunk, feature_lookup, user_lookup)
+        if compact:
+            mt.compact_usage(chunk)
+        if not stops and coalesce is not None:
+            (coalesced, merged_away) = cs.coalesce_sessions(chunk, coalesce)
+            merged[0] += merged_away
+            merged[1] += pd.to_numeric(chunk[mt.USG_TIME], errors="coerce").sum() - coalesced[mt.USG_TIME].sum()
+            parts.append(mt.aggregate_usage(coalesced))
+        elif not stops:	# only the problems of the remaining chunks are needed
+            parts.append(mt.aggregate_usage(chunk))
+        if len(parts) == MERGE_EVERY:
+            parts = [mt.merge_aggregates(parts)]
+        if len(problems) == MERGE_EVERY:
+            problems = [pf.merge_issues(problems)]
+        nrows += len(chunk)
+        columns = list(chunk.columns)
+    for col, n in counts.items():
+        print("    %s: %d matched, %d missing" % (col, n, nrows - n))
+    print("[2.2] Validate usage rows")
+    issues = pf.report(pf.merge_issues(problems), stream.file_a, nrows, unknown)
+    if coalesce is not None:
+        print("[2.3] Coalesce overlapping sessions per user and feature (gap %s, within chunks of %d rows)" % (
+            coalesce, chunk_rows))
+        cs.report(merged[0], nrows, merged[1])
+    agg = mt.merge_aggregates(parts)
+    return (agg, nrows, columns, issues)
+
+def _cell(value):
+    # NaN/NaT are written as empty cells, like to_excel
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    return value
+
+def write_rows(worksheet, rows, row=0):
+    """Write rows in row order (required by constant-memory mode); returns the next row."""
+    for values in rows:
+        for c, value in enumerate(values):
+            value = _cell(value)
+            if value is not None and value != "":
+                worksheet.write(row, c, value)
+        row += 1
+    return row
+
+def write_frame(workbook, sheet_name, df, header_format):
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, [str(c) for c in df.columns], header_format)
+    write_rows(worksheet, df.itertuples(index=False, name=None), 1)
+    return worksheet
+
+def frame_chunks(df, chunk_rows=CHUNK_ROWS):
+    """An in-memory usage frame as consecutive chunks of rows (match.py --constant-memory)."""
+    for lo in range(0, len(df), chunk_rows):
+        yield df.iloc[lo:lo + chunk_rows]
+
+def write_streamed_file(file_a, sheets, usage_columns, usage_chunks, df_pivot_data, df_pivot_data_tool, df_prov,
+                        extra_sheets=()):
+    processed_filename = os.path.splitext(file_a)[0] + "-processed.xlsx"
+    print("[5] Write all to file: %s" % processed_filename)
+    started = ins.write_started()
+    workbook = xlsxwriter.Workbook(processed_filename, {
+        "constant_memory": True,
+        "default_date_format": DATETIME_FORMAT,
+        "nan_inf_to_errors": True,
+    })
+    header_format = workbook.add_format(HEADER_FORMAT)
+    usage_rows = 0
+    for (sheet, df_other) in sheets:
+        if df_other is None:	# usage sheet, streamed again from the source
+            worksheet = workbook.add_worksheet("Usage")
+            worksheet.write_row(0, 0, usage_columns, header_format)
+            row = 1
+            for chunk in usage_chunks:
+                row = write_rows(worksheet, chunk.itertuples(index=False, name=None), row)
+            usage_rows = row - 1
+        elif not isinstance(df_other, str):	# mt.COPIED_SHEET sheets are inserted below
+            write_frame(workbook, sheet, df_other, header_format)
+    write_frame(workbook, "Performer Summary", df_pivot_data, header_format)
+    write_frame(workbook, "Tool Summary", df_pivot_data_tool, header_format)
+    worksheet = write_frame(workbook, mt.SHEET_NAME_STAT, df_prov, header_format)
+    pr.set_color_column(SimpleNamespace(book=workbook, sheets={mt.SHEET_NAME_STAT: worksheet}), df_prov, mt.SHEET_NAME_STAT)
+    for (sheet, df_extra, set_format) in extra_sheets:
+        worksheet = write_frame(workbook, sheet, df_extra, header_format)
+        if set_format:
+            set_format(workbook, worksheet, df_extra)
+    workbook.close()
+    pt.copy_sheets(file_a, processed_filename, mt.copied_sheets(sheets))
+    ins.report_write(started, usage_rows)
+
+    # Set writable permission
+    os.chmod(processed_filename, 0o666)
+    return processed_filename
+
+def process_usage_file_streaming(file_a, feature_lookup, user_lookup, file_d, chunk_rows=CHUNK_ROWS,
+                                 output_formats=("xlsx",), timeline=None, copy_sheets=False, compact=False,
+                                 unknown=False, what_if=None, coalesce=None):
+    """Steps 2.1 - 5 of match.process_usage_file on a streamed usage sheet."""
+    if "parquet" in output_formats:
+        print("❌ --stream writes xlsx and csv output; Parquet needs the whole usage table (run without --stream).")
+        sys.exit(1)
+    t0 = time.perf_counter()
+    stream = UsageStream(file_a)
+    try:
+        (agg, nrows, columns, issues) = aggregate_stream(stream, feature_lookup, user_lookup, chunk_rows, compact,
+                                                         unknown, coalesce)
+        t_read = time.perf_counter() - t0
+        print("    streamed %d rows in %.1f s (%.0f rows/s)" % (nrows, t_read, nrows / max(t_read, 1e-9)))
+
+        (df_pivot_data, df_pivot_data_tool, df_prov) = mt.summarize_usage(agg, file_a, file_d)
+        extra_sheets = pf.validation_sheets(issues, unknown)
+        if timeline:
+            import timeline as tl
+            extra_sheets += tl.timeline_sheets(agg, timeline)
+        if what_if:
+            import whatif as wi
+            extra_sheets += wi.whatif_sheets(agg, df_prov, what_if)
+
+        outputs = []
+        for fmt in output_formats:	# each output streams the usage sheet again
+            usage_chunks = enriched_chunks(stream, feature_lookup, user_lookup, chunk_rows, unknown=unknown)
+            if fmt == "xlsx":
+                outputs.append(write_streamed_file(file_a, stream.other_sheets(copy_sheets), columns, usage_chunks,
+                                                   df_pivot_data, df_pivot_data_tool, df_prov, extra_sheets))
+            else:
+                outputs.append(mt.write_tables(file_a, fmt, usage_chunks, df_pivot_data, df_pivot_data_tool, df_prov,
+                                               extra_sheets))
+    finally:
+        stream.close()
+    t_total = time.perf_counter() - t0
+    print("    %d rows in %.1f s (%.0f rows/s), peak RSS %.0f MB" % (
+        nrows, t_total, nrows / max(t_total, 1e-9), ins.peak_rss_mb()))
+    return ", ".join(outputs)
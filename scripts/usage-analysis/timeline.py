@@ -0,0 +1,134 @@
+import sys
+import numpy as np
+import pandas as pd
+import match as mt
+import concurrency as cc
+
+# Concurrency timeline sheets (--timeline BUCKET).
+#
+# From the session intervals of the usage aggregate, per product feature:
+#   Concurrency Stats    peak, when it is first reached and how long it lasts,
+#                        p95/p99 concurrency and hours at or above N seats,
+#                        for all performers and per performer
+#   Concurrency Timeline peak concurrency of each feature per time bucket
+#                        (e.g. 15min, 1h, 1D)
+#   Peak Hours           hour-of-week heatmap: peak concurrency of each
+#                        feature in each hour of the week over the period
+# Everything is computed with the sorted event arrays of concurrency.py; the
+# period runs from the day of the first session to the day after the last one.
+# p95/p99 are time-weighted over the time the feature is in use: p95 = 3
+# means that at least 95% of the in-use time had 3 or fewer sessions open.
+
+TIMELINE_BUCKET = "1h"
+TIME_ABOVE_N = [1, 2, 3, 5, 10]
+PERCENTILES = [95, 99]
+
+STATS_SHEET = "Concurrency Stats"
+TIMELINE_SHEET = "Concurrency Timeline"
+HEATMAP_SHEET = "Peak Hours"
+ALL = "All"	# Project/Performer of the all-performer rows
+
+FEATURE_KEYS = [mt.VENDOR, mt.PRODUCT, mt.USG_FEATURE]
+PERFORMER_KEYS = [mt.PROJECT, mt.ORG] + FEATURE_KEYS
+KEY_COLUMNS = ["Project", "Performer", "Vendor", "Product", "Product Feature"]
+
+NS_PER_HOUR = 3600 * 10**9
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+def parse_bucket(value):
+    """Bucket length such as 15min, 1h or 1D, as a timedelta64[ns]."""
+    try:
+        bucket = pd.Timedelta(value)
+    except ValueError:
+        bucket = None
+    if bucket is None or bucket <= pd.Timedelta(0):
+        print("❌ Invalid timeline bucket '%s' (e.g. 15min, 1h, 1D)" % value)
+        sys.exit(1)
+    return bucket.to_timedelta64().astype("timedelta64[ns]")
+
+def grouped_sessions(agg, keys):
+    """Group keys (sorted) and the starts, ends and group ids of the sessions of agg grouped by `keys`."""
+    grouped = agg.groupby(keys, sort=True, dropna=False, observed=True)[mt.P_INSTANCES]
+    groups = grouped.size().index.to_frame(index=False)
+    intervals = mt.concat_intervals(grouped)
+    stacked = np.concatenate(intervals) if intervals else cc.NO_INTERVALS
+    ids = np.repeat(np.arange(len(intervals)), [len(a) for a in intervals])
+    return (groups, stacked[:, 0], stacked[:, 1], ids)
+
+def concurrency_stats(groups, starts, ends, ids):
+    ngroups = len(groups)
+    (peaks, first_peak) = cc.first_peak_times(starts, ends, ids, ngroups)
+    spent = cc.level_durations(starts, ends, ids, ngroups) / NS_PER_HOUR
+    levels = spent.shape[1]
+    at_or_above = np.cumsum(spent[:, ::-1], axis=1)[:, ::-1]	# hours at level >= column
+
+    stats = groups.copy()
+    stats["Peak"] = peaks
+    stats["First Peak At"] = first_peak
+    stats["Hours at Peak"] = spent[np.arange(ngroups), np.minimum(peaks, levels - 1)] * (peaks > 0)
+    in_use = at_or_above[:, 1] if levels > 1 else np.zeros(ngroups)
+    share = np.cumsum(spent[:, 1:], axis=1) / np.where(in_use > 0, in_use, 1)[:, None]
+    for p in PERCENTILES:
+        level = 1 + np.argmax(share >= p / 100.0 - 1e-12, axis=1) if levels > 1 else np.zeros(ngroups)
+        stats["P%d" % p] = np.where(in_use > 0, level, 0)
+    for n in TIME_ABOVE_N:
+        stats["Hours >= %d" % n] = at_or_above[:, n] if n < levels else 0.0
+    return stats
+
+def period(starts, ends):
+    """First and last day boundary around the sessions."""
+    day = np.timedelta64(1, "D")
+    origin = starts.min().astype("datetime64[D]")
+    end = ends.max().astype("datetime64[D]") + day
+    return (origin.astype("datetime64[ns]"), end.astype("datetime64[ns]"))
+
+def timeline_frame(groups, starts, ends, ids, origin, end, bucket):
+    nbuckets = int(-(-(end - origin) // bucket))
+    peaks = cc.bucket_peaks(starts, ends, ids, len(groups), origin, bucket, nbuckets)
+    df = pd.DataFrame(peaks.T, columns=list(groups[mt.USG_FEATURE]))
+    df.insert(0, "Bucket Start", origin + np.arange(nbuckets) * bucket)
+    return df
+
+def heatmap_frame(groups, starts, ends, ids, origin, end):
+    hour = np.timedelta64(1, "h")
+    nhours = int((end - origin) // hour)
+    hourly = cc.bucket_peaks(starts, ends, ids, len(groups), origin, hour, nhours)
+    hours = origin.astype("datetime64[h]").astype(np.int64) + np.arange(nhours)
+    how = ((hours // 24 + 3) % 7) * 24 + hours % 24	# 1970-01-01 was a Thursday
+    order = np.argsort(how, kind="stable")
+    first = np.flatnonzero(np.r_[True, np.diff(how[order]) != 0])
+    heat = np.zeros((len(groups), 7 * 24), dtype=np.int64)
+    heat[:, how[order][first]] = np.maximum.reduceat(hourly[:, order], first, axis=1)
+
+    slots = ["%s %02d" % (DAYS[slot // 24], slot % 24) for slot in range(7 * 24)]
+    keys = groups.set_axis(KEY_COLUMNS[2:], axis=1)
+    return pd.concat([keys, pd.DataFrame(heat, columns=slots)], axis=1)
+
+def set_heatmap_colors(workbook, worksheet, df):
+    # white (0) to red (highest) over the hour columns
+    first_col = len(KEY_COLUMNS) - 2
+    if len(df):
+        worksheet.conditional_format(1, first_col, len(df), len(df.columns) - 1, {
+            "type": "2_color_scale", "min_color": "#FFFFFF", "max_color": "#F8696B"})
+
+def timeline_sheets(agg, bucket=TIMELINE_BUCKET):
+    """The timeline sheets as a list of (sheet name, frame, formatter or None)."""
+    print("[3.2] Concurrency timeline per %s, stats and peak hours" % bucket)
+    bucket = parse_bucket(bucket)
+    (features, starts, ends, ids) = grouped_sessions(agg, FEATURE_KEYS)
+    if len(starts) == 0:
+        print("⚠️ No sessions with usage time; timeline sheets skipped.")
+        return []
+    (origin, end) = period(starts, ends)
+
+    stats = concurrency_stats(features, starts, ends, ids)
+    stats.insert(0, mt.ORG, ALL)
+    stats.insert(0, mt.PROJECT, ALL)
+    stats = pd.concat([stats, concurrency_stats(*grouped_sessions(agg, PERFORMER_KEYS))], ignore_index=True)
+    stats.columns = KEY_COLUMNS + list(stats.columns[len(KEY_COLUMNS):])
+
+    return [
+        (STATS_SHEET, stats, None),
+        (TIMELINE_SHEET, timeline_frame(features, starts, ends, ids, origin, end, bucket), None),
+        (HEATMAP_SHEET, heatmap_frame(features, starts, ends, ids, origin, end), set_heatmap_colors),
+    ]
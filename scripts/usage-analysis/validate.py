@@ -0,0 +1,458 @@
+import os
+import re
+import csv
+import html
+import zipfile
+import xml.etree.ElementTree as ET
+import passthrough as pt
+import featurematch as fm
+from columns import (USG_USERNAME, USG_EMAIL, USG_KEY_FEATURE, USAGE_COLUMNS, F_PRODUCT,
+                     F_FEATURE, F_MATCH, USER_SHEET, USER_LAST_NAME, USER_ORGANIZATION, USER_PROJECT_NAME,
+                     USER_EMAIL, USER_NOTES, USER_COLUMNS, PROV_SHEET, PROV_KEYWORDS, MAX_HEADER_SEARCH_ROWS,
+                     CSV_EXTENSIONS, PARQUET_EXTENSIONS, convert_csv_cell, convert_number, usage_header_row,
+                     row_containing, keyword_row, keyword_column)
+
+# Quick checks of the input files (python cli.py validate / inspect-headers).
+#
+# Only the standard library is used, so a check starts and ends well within
+# a second: no pandas, openpyxl or xlsxwriter import.  An .xlsx file is read
+# straight from its zip package; header rows come from an incremental parse
+# that stops after the rows it needs, and the key columns of the usage sheet
+# are pulled out of the sheet XML with one regular expression per column set.
+# The column names and header keywords, the header row rules and the number
+# conversion come from columns.py, which match.py and provision.py use too:
+#   usage         the sheet with "User Name" in its header (row 1 or 2)
+#   features      every sheet with a row holding both "Product" and "Feature"
+#   users         the "Admin-User List" sheet, header row with "LAST NAME"
+#                 and "ORGANIZATION"
+#   provisioning  the "Current Provisioning" sheet, header row (within the
+#                 first 20 rows) matching all the keywords
+# `validate` then reports how many usage rows the feature mapping (its exact,
+# prefix and pattern rules, see featurematch.py) and the user list cover; a
+# usage row whose user has no project stops the pipeline.
+
+SHOW_UNKNOWN = 10	# unknown keys listed by name
+
+NS = "{%s}" % pt.MAIN_NS
+
+def _column_index(letters):
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n - 1
+
+def _column_letters(index):
+    letters = ""
+    index += 1
+    while index:
+        (index, rem) = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+_RPH = re.compile(r"<rPh\b.*?</rPh>", re.S)
+_T = re.compile(r"<t\b[^>]*>(.*?)</t>", re.S)
+_V = re.compile(r"<v>(.*?)</v>", re.S)
+_TYPE = re.compile(r'\st="(\w+)"')
+
+def _unescape(text):
+    return html.unescape(text) if "&" in text else text
+
+def _text(xml):
+    # text of an <si> or <is>: its <t> runs, without phonetic runs
+    if "<rPh" in xml:
+        xml = _RPH.sub("", xml)
+    return _unescape("".join(_T.findall(xml)))
+
+def _cell_value(attrs, v, t, inner, strings):
+    # a cell of the regex scan: its attributes and either <v>, a plain <is><t> or other content ("" if absent)
+    kind = _TYPE.search(attrs) if ' t="' in attrs else None
+    kind = kind.group(1) if kind else "n"
+    if t:
+        return _unescape(t)
+    if inner:
+        if kind == "inlineStr":
+            return _text(inner)
+        m = _V.search(inner)
+        v = m.group(1) if m else None
+    if not v:
+        return ""
+    if kind == "s":
+        return strings[int(v)]
+    if kind in ("str", "e", "inlineStr"):
+        return _unescape(v)
+    if kind == "b":
+        return v == "1"
+    return convert_number(v)
+
+class QuickBook:
+    """Sheets of an .xlsx, .csv or .parquet file, read without pandas."""
+    def __init__(self, path):
+        self.path = path
+        ext = os.path.splitext(path)[1].lower()
+        self.format = "csv" if ext in CSV_EXTENSIONS else "parquet" if ext in PARQUET_EXTENSIONS else "xlsx"
+        self.single_table = self.format != "xlsx"
+        self._strings = None
+        if self.single_table:
+            self.sheet_names = [os.path.splitext(os.path.basename(path))[0]]
+        else:
+            self.zip = zipfile.ZipFile(path)
+            self.parts = {name: part for (name, part, _) in pt.sheet_parts(self.zip) if part is not None}
+            self.sheet_names = list(self.parts)
+
+    def close(self):
+        if not self.single_table:
+            self.zip.close()
+
+    def strings(self):
+        if self._strings is None:
+            self._strings = []
+            if "xl/sharedStrings.xml" in self.zip.namelist():
+                xml = self.zip.read("xl/sharedStrings.xml").decode("utf-8")
+                self._strings = [_text(m.group(1) or "") for m in re.finditer(r"<si>(.*?)</si>|<si/>", xml, re.S)]
+        return self._strings
+
+    def rows(self, sheet):
+        """Yield the rows of a sheet from the first one on, as lists of values ("" for empty cells)."""
+        if self.format == "csv":
+            with open(self.path, newline="", encoding="utf-8-sig") as f:
+                for row in csv.reader(f):
+                    yield [convert_csv_cell(v) for v in row]
+        elif self.format == "parquet":
+            table = _parquet().ParquetFile(self.path)
+            yield list(table.schema_arrow.names)
+            for batch in table.iter_batches(batch_size=MAX_HEADER_SEARCH_ROWS):
+                for row in zip(*[c.to_pylist() for c in batch.columns]):
+                    yield ["" if v is None else v for v in row]
+        else:
+            yield from self._xlsx_rows(sheet)
+
+    def _xlsx_rows(self, sheet):
+        strings = None
+        expected = 1
+        with self.zip.open(self.parts[sheet]) as f:
+            for (_, el) in ET.iterparse(f):
+                if el.tag != NS + "row":
+                    continue
+                r = int(el.get("r", expected))
+                for _ in range(expected, r):
+                    yield []
+                expected = r + 1
+                row = []
+                for c in el.iter(NS + "c"):
+                    ref = c.get("r")
+                    col = _column_index(re.match(r"[A-Z]+", ref).group(0)) if ref else len(row)
+                    row.extend([""] * (col - len(row)))
+                    kind = c.get("t", "n")
+                    if kind == "inlineStr":
+                        value = "".join(t.text or "" for t in c.iter(NS + "t"))
+                    else:
+                        v = c.find(NS + "v")
+                        value = "" if v is None else v.text or ""
+                        if kind == "s" and value:
+                            strings = strings if strings is not None else self.strings()
+                            value = strings[int(value)]
+                        elif kind == "b":
+                            value = value == "1"
+                        elif kind == "n" and value:
+                            value = convert_number(value)
+                    row.append(value)
+                el.clear()
+                while row and row[-1] == "":
+                    row.pop()
+                yield row
+
+    def header(self, sheet, find):
+        """
+        (row index, header values) of the row find(rows) picks from the rows
+        of the sheet (a columns.py header rule), or (None, None).
+        """
+        seen = []
+        def rows():
+            for row in self.rows(sheet):	# read only as far as find() looks
+                seen.append(row)
+                yield row
+        i = find(rows())
+        return (i, seen[i]) if i is not None and i < len(seen) else (None, None)
+
+    def columns(self, sheet, header_row, header, names):
+        """{name: values} of the named columns below header_row ("" for empty cells)."""
+        index = {name: header.index(name) for name in names}
+        if self.format == "parquet":
+            data = _parquet().read_table(self.path, columns=names).to_pydict()
+            return {name: ["" if v is None else v for v in data[name]] for name in names}
+        if self.format == "csv":
+            return self._csv_columns(header_row, index)
+        if self.format == "xlsx":
+            found = self._xlsx_columns(sheet, header_row, index)
+            if found is not None:
+                return found
+        values = {name: [] for name in names}
+        for (i, row) in enumerate(self.rows(sheet)):
+            if i > header_row:
+                for name, col in index.items():
+                    values[name].append(row[col] if col < len(row) else "")
+        return values
+
+    def _csv_columns(self, header_row, index):
+        # only the wanted cells are converted
+        values = {name: [] for name in index}
+        with open(self.path, newline="", encoding="utf-8-sig") as f:
+            rows = csv.reader(f)
+            for _ in range(header_row + 1):
+                next(rows, None)
+            for row in rows:
+                for name, col in index.items():
+                    v = row[col] if col < len(row) else ""
+                    values[name].append(convert_csv_cell(v))
+        return values
+
+    def _xlsx_columns(self, sheet, header_row, index):
+        # one regex pass over the sheet XML for the wanted columns; None when the
+        # cells are not written as <c r="..."> (then the rows are parsed instead)
+        xml = self.zip.read(self.parts[sheet]).decode("utf-8")
+        if xml.count("<c ") + xml.count("<c>") != xml.count('<c r="'):
+            return None
+        data = xml[xml.find("<sheetData"):]
+        letters = {_column_letters(col): name for name, col in index.items()}
+        cells = {name: {} for name in index}
+        pattern = (r'<c r="(%s)(\d+)"([^>]*?)(?:/>|>(?:<v>([^<]*)</v>|<is><t>([^<]*)</t></is>|(.*?))</c>)'
+                   % "|".join(letters))
+        strings = self.strings()
+        for (letter, r, attrs, v, t, inner) in re.findall(pattern, data, re.S):
+            r = int(r)
+            if r <= header_row + 1:
+                continue
+            if t:	# the common cases inline: plain inline string, shared string, number
+                value = _unescape(t)
+            elif v and ' t="' not in attrs:
+                value = convert_number(v)
+            elif v and ' t="s"' in attrs:
+                value = strings[int(v)]
+            else:
+                value = _cell_value(attrs, v, t, inner, strings)
+            cells[letters[letter]][r] = value
+        last = max([header_row + 1] + [max(c) for c in cells.values() if c])
+        rows = range(header_row + 2, last + 1)
+        return {name: [cells[name].get(r, "") for r in rows] for name in index}
+
+def _parquet():
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        print("❌ Parquet files need pyarrow (pip install pyarrow).")
+        raise SystemExit(1)
+    return pyarrow.parquet
+
+# ---------- header detection ----------
+
+def usage_header(book):
+    """(sheet, header row, header) of the usage sheet, or (None, None, None)."""
+    for sheet in book.sheet_names:
+        (header_row, header) = book.header(sheet, usage_header_row)
+        header = [str(v) for v in header] if header is not None else []
+        if USG_USERNAME in header:
+            return (sheet, header_row, header)
+    return (None, None, None)
+
+def feature_headers(book):
+    """[(sheet, header row, header)] of the feature mapping sheets."""
+    found = []
+    for sheet in book.sheet_names:
+        (row, header) = book.header(sheet, lambda rows: row_containing(rows, [F_PRODUCT, F_FEATURE]))
+        if row is not None:
+            found.append((sheet, row, [str(v) for v in header]))
+    return found
+
+def user_header(book):
+    """(sheet, header row, header) of the user list, or (sheet or None, None, None)."""
+    sheet = book.sheet_names[0] if book.single_table else USER_SHEET
+    if sheet not in book.sheet_names:
+        return (None, None, None)
+    (row, header) = book.header(sheet, lambda rows: row_containing(rows, [USER_LAST_NAME, USER_ORGANIZATION]))
+    return (sheet, row, [str(v) for v in header] if header else None)
+
+def provisioning_header(book):
+    """(sheet, header row, {keyword: column}) of the provisioning table, or (sheet or None, None, None)."""
+    sheet = book.sheet_names[0] if book.single_table else PROV_SHEET
+    if sheet not in book.sheet_names:
+        return (None, None, None)
+    (row, header) = book.header(sheet, lambda rows: keyword_row(rows, PROV_KEYWORDS, MAX_HEADER_SEARCH_ROWS))
+    if row is None:
+        return (sheet, None, None)
+    return (sheet, row, {kw: keyword_column(header, kw) for kw in PROV_KEYWORDS})
+
+# ---------- validate ----------
+
+def _missing(value):
+    return value is None or value == "" or (isinstance(value, float) and value != value)
+
+def _names(values, n=SHOW_UNKNOWN):
+    values = sorted(values, key=str)
+    shown = ", ".join(str(v) for v in values[:n])
+    return shown + (", ..." if len(values) > n else "")
+
+def _percent(n, total):
+    return 100.0 * n / total if total else 100.0
+
+def feature_rules(book, sheets):
+    """fm.FeatureMatcher of the Feature (and Match) cells of the feature sheets."""
+    rules = []
+    for (sheet, row, header) in sheets:
+        names = [F_FEATURE] + ([F_MATCH] if F_MATCH in header else [])
+        cols = book.columns(sheet, row, header, names)
+        matches = cols.get(F_MATCH, [None] * len(cols[F_FEATURE]))
+        rules += [fm.rule_kind(f, m) + (None,) for (f, m) in zip(cols[F_FEATURE], matches) if not _missing(f)]
+    return fm.FeatureMatcher(rules)
+
+def user_projects(book, sheet, row, header):
+    """{email: has a project} of the active users (NOTES is not 'remove', organization given)."""
+    cols = book.columns(sheet, row, header, [USER_EMAIL, USER_ORGANIZATION, USER_PROJECT_NAME, USER_NOTES])
+    users = {}
+    for (email, org, project, notes) in zip(*[cols[c] for c in (USER_EMAIL, USER_ORGANIZATION, USER_PROJECT_NAME,
+                                                                  USER_NOTES)]):
+        if str(notes).lower() == "remove" or _missing(org) or _missing(email):
+            continue
+        users[email] = not _missing(project)	# the last row of an email wins
+    return users
+
+def validate(file_a, file_b, file_c, file_d=None):
+    """Check the headers of the input files and the key coverage of the usage rows; returns the number of errors."""
+    errors = 0
+    books = {}
+    try:
+        for path in [file_a, file_b, file_c] + ([file_d] if file_d else []):
+            if not os.path.exists(path):
+                print("❌ %s: file not found" % path)
+                errors += 1
+                continue
+            try:
+                books[path] = QuickBook(path)
+            except (zipfile.BadZipFile, KeyError, ET.ParseError) as e:
+                print("❌ %s: not a readable .xlsx workbook (%s)" % (path, e))
+                errors += 1
+        if errors:
+            return errors
+
+        # --- usage ---
+        usage = books[file_a]
+        (u_sheet, u_row, u_header) = usage_header(usage)
+        if u_sheet is None:
+            print("❌ %s: no sheet with '%s' in its first or second row" % (file_a, USG_USERNAME))
+            return errors + 1
+        missing = [c for c in USAGE_COLUMNS if c not in u_header]
+        print("[usage] %s: sheet '%s', header row %d" % (file_a, u_sheet, u_row + 1))
+        if missing:
+            print("❌ missing column(s): %s" % ", ".join(missing))
+            errors += 1
+
+        # --- features ---
+        f_sheets = feature_headers(books[file_b])
+        if f_sheets:
+            try:
+                matcher = feature_rules(books[file_b], f_sheets)
+                patterns = len(matcher) - len(matcher.exact)
+                print("[features] %s: %d sheet(s) with '%s'/'%s', %d features%s" % (
+                    file_b, len(f_sheets), F_PRODUCT, F_FEATURE, len(matcher.exact),
+                    ", %d prefix/pattern rule(s)" % patterns if patterns else ""))
+            except ValueError as e:
+                print("❌ %s: %s" % (file_b, e))
+                errors += 1
+                f_sheets = []
+        else:
+            print("❌ %s: no sheet with a '%s' and '%s' header row" % (file_b, F_PRODUCT, F_FEATURE))
+            errors += 1
+
+        # --- users ---
+        (c_sheet, c_row, c_header) = user_header(books[file_c])
+        users = {}
+        if c_sheet is None:
+            print("❌ %s: no '%s' sheet" % (file_c, USER_SHEET))
+            errors += 1
+        elif c_row is None:
+            print("❌ %s: no 'LAST NAME'/'%s' header row in sheet '%s'" % (file_c, USER_ORGANIZATION, c_sheet))
+            errors += 1
+        else:
+            c_missing = [c for c in USER_COLUMNS if c not in c_header]
+            if c_missing:
+                print("❌ %s: missing column(s): %s" % (file_c, ", ".join(c_missing)))
+                errors += 1
+            else:
+                users = user_projects(books[file_c], c_sheet, c_row, c_header)
+                print("[users] %s: sheet '%s', header row %d, %d active users" % (file_c, c_sheet, c_row + 1,
+                                                                                  len(users)))
+
+        # --- provisioning ---
+        if file_d:
+            (d_sheet, d_row, d_columns) = provisioning_header(books[file_d])
+            if d_sheet is None:
+                print("❌ %s: no '%s' sheet" % (file_d, PROV_SHEET))
+                errors += 1
+            elif d_row is None:
+                print("❌ %s: no header row with %s within the first %d rows of '%s'" % (
+                    file_d, ", ".join(PROV_KEYWORDS), MAX_HEADER_SEARCH_ROWS, d_sheet))
+                errors += 1
+            else:
+                print("[provisioning] %s: sheet '%s', header row %d" % (file_d, d_sheet, d_row + 1))
+
+        if missing or not f_sheets or not users:
+            return errors
+
+        # --- key coverage of the usage rows ---
+        cols = usage.columns(u_sheet, u_row, u_header, [USG_USERNAME, USG_EMAIL, USG_KEY_FEATURE])
+        rows = [(u, e, f) for (u, e, f) in zip(cols[USG_USERNAME], cols[USG_EMAIL], cols[USG_KEY_FEATURE])
+                if not (_missing(u) and _missing(e) and _missing(f))]
+        n = len(rows)
+        unknown_features = [f for (_, _, f) in rows if matcher.match(f) is None]
+        no_project = [(u, e) for (u, e, _) in rows if not users.get(e, False)]
+        print("[coverage] %d usage rows" % n)
+        if unknown_features:
+            print("⚠️ features: %d of %d rows matched (%.1f%%); %d unknown feature(s): %s" % (
+                n - len(unknown_features), n, _percent(n - len(unknown_features), n),
+                len(set(unknown_features)), _names(set(unknown_features))))
+        else:
+            print("✅ features: all %d rows matched" % n)
+        if no_project:
+            names = set(e if not _missing(e) else u for (u, e) in no_project)
+            print("❌ users: %d of %d rows matched (%.1f%%); %d row(s) of %d user(s) not in the user list "
+                  "or without a project: %s" % (n - len(no_project), n, _percent(n - len(no_project), n),
+                                               len(no_project), len(names), _names(names)))
+            errors += 1
+        else:
+            print("✅ users: all %d rows matched" % n)
+        return errors
+    finally:
+        for book in books.values():
+            book.close()
+
+# ---------- inspect-headers ----------
+
+def _show(values, width=100):
+    text = " | ".join(str(v) for v in values)
+    return text if len(text) <= width else text[:width - 3] + "..."
+
+def inspect_headers(path):
+    """Print the sheets of a file, the header row each reader would use and the first rows."""
+    book = QuickBook(path)
+    try:
+        print("%s (%s)" % (path, book.format))
+        (u_sheet, u_row, u_header) = usage_header(book)
+        f_sheets = {sheet: (row, header) for (sheet, row, header) in feature_headers(book)}
+        (c_sheet, c_row, c_header) = user_header(book)
+        (d_sheet, d_row, d_columns) = provisioning_header(book)
+        for sheet in book.sheet_names:
+            print("  sheet '%s'" % sheet)
+            for (i, row) in enumerate(book.rows(sheet)):
+                if i >= 3:
+                    break
+                print("    row %d: %s" % (i + 1, _show(row)))
+            if sheet == u_sheet:
+                print("    -> usage header, row %d: %s" % (u_row + 1, _show(u_header)))
+            if sheet in f_sheets:
+                print("    -> feature mapping header, row %d: %s" % (f_sheets[sheet][0] + 1, _show(f_sheets[sheet][1])))
+            if sheet == c_sheet and c_row is not None:
+                print("    -> user list header, row %d: %s" % (c_row + 1, _show(c_header)))
+            if sheet == d_sheet and d_row is not None:
+                print("    -> provisioning header, row %d: %s" % (d_row + 1, _show(
+                    "%s=%s" % (kw, col) for kw, col in d_columns.items())))
+    finally:
+        book.close()
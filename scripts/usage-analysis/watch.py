@@ -0,0 +1,417 @@
+import sys
+import os
+import glob
+import json
+import time
+import argparse
+import itertools
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, unquote
+import pandas as pd
+import match as mt
+import batch as bt
+import cache as ch
+import workbook as wb
+
+# Service mode: watch folders for usage exports and process them as they arrive.
+#
+# The feature mapping and the user lists are parsed once and kept warm: the
+# lookups are handed to a bounded pool of worker processes when it starts, and
+# each worker loads the provisioning workbooks up front.  The folders are
+# polled every --interval seconds.  A usage file is processed when it is new or
+# changed, once its size and modification time have held for one poll, so a
+# file that is still being copied is not picked up.  When a feature mapping,
+# user list or provisioning file changes, the lookups are rebuilt, the pool is
+# restarted with them, and all usage files are processed again.  A
+# provisioning file can be given as a glob; the newest match is used.
+#
+# A small HTTP API on localhost reports the jobs and serves the results:
+#   GET /status                      reference files, queue and job counts
+#   GET /jobs                        all jobs, newest first
+#   GET /jobs/<id>                   one job
+#   GET /jobs/<id>/file              the processed workbook
+#   GET /jobs/<id>/tables/<table>    a result table as JSON records, e.g. performer_summary
+#
+#   python watch.py --features F.xlsx --users U.xlsx --provisioning 'P-*.xlsx' [-j 2] incoming/
+#   python watch.py --manifest hubs.json      (the usage globs of each hub are watched)
+
+POLL_SECONDS = 5.0
+PORT = 8765
+# usage files picked up in a watched folder
+USAGE_PATTERNS = ["*.xlsx", "*.csv", "*.parquet"]
+# finished jobs kept for the API
+MAX_JOBS = 1000
+
+def signature(path):
+    """(mtime, size) of a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def newest(pattern):
+    """The newest file matching a path or glob (the pattern itself if nothing matches)."""
+    matched = [f for f in glob.glob(pattern) if os.path.isfile(f)]
+    return max(matched, key=os.path.getmtime) if matched else pattern
+
+def output_paths(file_a, output_formats):
+    base = os.path.splitext(file_a)[0] + "-processed"
+    return [base + ".xlsx" if fmt == "xlsx" else base for fmt in dict.fromkeys(output_formats)]
+
+def init_worker(feature_lookup, user_lookups, cache, provisioning_files):
+    bt.init_worker(feature_lookup, user_lookups, cache)
+    for f in provisioning_files:	# kept in the worker's load-once workbook cache
+        try:
+            wb.open_workbook(f)
+        except Exception:
+            pass		# reported by the jobs that use it
+
+def process_task(*task):
+    """batch.process_task, then drop the usage workbook from the worker's load-once cache."""
+    try:
+        return bt.process_task(*task)
+    finally:
+        wb.release_workbook(task[1])
+
+def now():
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+class Watcher:
+    """
+    Polls the usage globs of the hubs and runs the new or changed files
+    through batch.process_task in a process pool.  `options` are the
+    process_task arguments after the provisioning file.
+    """
+    def __init__(self, file_b, hubs, jobs=None, cache=None, options=()):
+        self.file_b = file_b
+        self.hubs = hubs
+        self.workers = jobs
+        self.cache = cache or ch.Cache(enabled=False)
+        self.options = tuple(options)
+        self.output_formats = self.options[0] if self.options else ("xlsx",)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.jobs = {}		# job id -> job
+        self.futures = {}	# job id -> future of a queued or running job
+        self.pending = {}	# usage file -> id of its queued or running job
+        self.seen = {}		# usage file -> signature at the last poll
+        self.done = {}		# usage file -> (signature, lookup generation) last processed
+        self.pool = None
+        self.generation = 0	# incremented each time the lookups are rebuilt
+        self.references = None	# ((file, signature), ...) the lookups were built from
+        self.provisioning = {}	# hub name -> provisioning file in use
+        self.loaded = None
+        self.started = now()
+        self.restart = False
+
+    def reference_files(self):
+        provisioning = {hub["name"]: newest(hub["provisioning"]) for hub in self.hubs}
+        files = [self.file_b] + [hub["users"] for hub in self.hubs] + list(provisioning.values())
+        return (provisioning, tuple((f, signature(f)) for f in files))
+
+    def load_lookups(self):
+        """Rebuild the lookups and restart the pool if a reference file changed; returns True if it did."""
+        (provisioning, references) = self.reference_files()
+        changed = references != self.references
+        if not changed and not self.restart:
+            return False
+        missing = [f for (f, sig) in references if sig is None]
+        if missing:
+            if self.pool is None:
+                for f in missing:
+                    print("❌ %s: file not found" % f)
+                sys.exit(1)
+            return False	# e.g. being replaced; try again at the next poll
+        self.references = references
+        self.restart = False
+        try:
+            print("[1] Build mapping dictionary from EDA feature file: %s" % self.file_b)
+            feature_lookup = self.cache.cached("features", [self.file_b],
+                                               lambda: mt.setup_feature_dictionary(self.file_b))
+            user_lookups = {}
+            for hub in self.hubs:
+                print("[2] Build mapping dictionary from User list file: %s (%s)" % (hub["users"], hub["name"]))
+                user_lookups[hub["name"]] = self.cache.cached("users", [hub["users"]],
+                                                              lambda: mt.setup_user_dictionary(hub["users"]))
+        except (Exception, SystemExit) as e:
+            if self.pool is None:
+                raise
+            print("❌ Could not rebuild the lookups (%s); keeping the previous ones." % (e or type(e).__name__))
+            return False
+
+        old = self.pool
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                        initargs=(feature_lookup, user_lookups, self.cache,
+                                                  sorted(set(provisioning.values()))))
+        with self.lock:
+            self.provisioning = provisioning
+            if changed:	# all usage files are processed again
+                self.generation += 1
+            self.loaded = now()
+        if old is not None:	# jobs still queued with the old lookups are cancelled
+            old.shutdown(wait=False, cancel_futures=True)
+            if changed:
+                print("[watch] reference files changed: all usage files are processed again")
+        return True
+
+    def usage_files(self, hub):
+        references = [f for (f, _) in self.references] + [f for h in self.hubs for f in glob.glob(h["provisioning"])]
+        references = set(os.path.abspath(f) for f in references)
+        return [f for f in bt.expand_usage_files(hub["usage"])
+                if not os.path.basename(f).startswith(("~$", ".")) and os.path.abspath(f) not in references]
+
+    def mark_up_to_date(self):
+        """Count the usage files whose outputs are newer than them and the reference files as processed."""
+        newest_reference = max(sig[0] for (_, sig) in self.references)
+        for hub in self.hubs:
+            for file_a in self.usage_files(hub):
+                sig = signature(file_a)
+                outputs = [signature(out) for out in output_paths(file_a, self.output_formats)]
+                if sig and all(out and out[0] > max(sig[0], newest_reference) for out in outputs):
+                    self.done[file_a] = (sig, self.generation)
+                    self.seen[file_a] = sig
+
+    def poll(self):
+        """Reload changed lookups, and queue the usage files that are new or changed and no longer growing."""
+        self.load_lookups()
+        ready = []
+        with self.lock:
+            for hub in self.hubs:
+                for file_a in self.usage_files(hub):
+                    sig = signature(file_a)
+                    stable = sig is not None and self.seen.get(file_a) == sig
+                    self.seen[file_a] = sig
+                    if stable and file_a not in self.pending and self.done.get(file_a) != (sig, self.generation):
+                        ready.append((hub, file_a, sig))
+        for (hub, file_a, sig) in ready:
+            self.submit(hub, file_a, sig)
+
+    def submit(self, hub, file_a, sig):
+        with self.lock:
+            job = {"id": next(self.ids), "hub": hub["name"], "usage": file_a, "state": "queued",
+                   "provisioning": self.provisioning[hub["name"]], "lookups": self.generation,
+                   "submitted": now(), "finished": None, "seconds": None,
+                   "output": None, "error": None, "validation": None}
+            self.jobs[job["id"]] = job
+            self.pending[file_a] = job["id"]
+            generation = self.generation
+        task = (hub["name"], file_a, [self.file_b, hub["users"]], job["provisioning"]) + self.options
+        print("[watch] job %d queued: %s" % (job["id"], file_a))
+        try:
+            future = self.pool.submit(process_task, *task)
+        except (BrokenProcessPool, RuntimeError) as e:	# the pool died or is shutting down
+            self.finished(job, sig, generation, None, e)
+            return
+        with self.lock:
+            self.futures[job["id"]] = future
+        future.add_done_callback(lambda f: self.finished(job, sig, generation, f))
+
+    def finished(self, job, sig, generation, future, error=None):
+        with self.lock:
+            self.pending.pop(job["usage"], None)
+            self.futures.pop(job["id"], None)
+            if future is not None and future.cancelled():
+                job["state"] = "cancelled"
+            else:
+                error = error or future.exception()
+                if error is not None:	# e.g. a worker process that died; tried again at the next poll
+                    job.update(state="failed", error="%s: %s" % (type(error).__name__, error))
+                    self.restart = self.restart or isinstance(error, BrokenProcessPool)
+                else:
+                    result = future.result()
+                    job.update(state="failed" if result["error"] else "done", seconds=result["seconds"],
+                               output=result["output"], error=result["error"], validation=result.get("validation"))
+                    self.done[job["usage"]] = (sig, generation)
+            job["finished"] = now()
+            finished = [i for (i, j) in self.jobs.items() if j["finished"]]
+            for i in finished[:max(0, len(finished) - MAX_JOBS)]:
+                del self.jobs[i]
+        status = "❌ " + job["error"] if job["error"] else "✅ " + (job["output"] or job["state"])
+        print("[watch] job %d %s: %s" % (job["id"], job["state"], status))
+
+    def job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+            future = self.futures.get(job_id)
+        if job["state"] == "queued" and future is not None and future.running():
+            job["state"] = "running"
+        return job
+
+    def job_list(self):
+        with self.lock:
+            ids = sorted(self.jobs, reverse=True)
+        return [j for j in (self.job(i) for i in ids) if j is not None]
+
+    def status(self):
+        jobs = self.job_list()
+        states = {}
+        for j in jobs:
+            states[j["state"]] = states.get(j["state"], 0) + 1
+        return {
+            "started": self.started,
+            "lookups_loaded": self.loaded,
+            "lookup_generation": self.generation,
+            "features": self.file_b,
+            "hubs": [{"name": hub["name"], "usage": hub["usage"], "users": hub["users"],
+                      "provisioning": self.provisioning.get(hub["name"])} for hub in self.hubs],
+            "workers": self.pool._max_workers if self.pool else 0,
+            "jobs": states,
+        }
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+
+def read_table(job, table):
+    """A result table of a finished job as a frame, or None (table: e.g. performer_summary)."""
+    for out in (job["output"] or "").split(", "):
+        if os.path.isdir(out):	# --output-format csv / parquet
+            for fmt in ("csv", "parquet"):
+                path = os.path.join(out, table + "." + fmt)
+                if os.path.exists(path):
+                    return pd.read_csv(path) if fmt == "csv" else pd.read_parquet(path)
+        elif out.endswith(".xlsx") and os.path.exists(out):
+            with pd.ExcelFile(out) as book:
+                sheets = {s.lower().replace(" ", "_"): s for s in book.sheet_names}
+                if table in sheets:
+                    return book.parse(sheets[table])
+    return None
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        watcher = self.server.watcher
+        parts = [unquote(p) for p in urlparse(self.path).path.split("/") if p]
+        if parts in ([], ["status"]):
+            return self.send_json(watcher.status())
+        if parts == ["jobs"]:
+            return self.send_json(watcher.job_list())
+        if len(parts) < 2 or parts[0] != "jobs" or not parts[1].isdigit():
+            return self.send_error(404)
+        job = watcher.job(int(parts[1]))
+        if job is None:
+            return self.send_error(404, "no such job")
+        if len(parts) == 2:
+            return self.send_json(job)
+        if parts[2:] == ["file"]:
+            return self.send_workbook(job)
+        if len(parts) == 4 and parts[2] == "tables":
+            df = read_table(job, parts[3]) if job["state"] == "done" else None
+            if df is None:
+                return self.send_error(404, "no such table")
+            return self.send_json(json.loads(df.to_json(orient="records", date_format="iso")))
+        self.send_error(404)
+
+    def send_json(self, value, code=200):
+        body = json.dumps(value, indent=2).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error(self, code, message=None, explain=None):
+        self.send_json({"error": message or self.responses[code][0]}, code)
+
+    def send_workbook(self, job):
+        paths = [p for p in (job["output"] or "").split(", ") if p.endswith(".xlsx") and os.path.exists(p)]
+        if job["state"] != "done" or not paths:
+            return self.send_error(404, "no workbook")
+        with open(paths[0], "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        self.send_header("Content-Disposition", 'attachment; filename="%s"' % os.path.basename(paths[0]))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass		# the job messages are printed by the watcher
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch folders for usage files and process them as they arrive.")
+    parser.add_argument("usage", nargs="*", help="folders or usage file globs to watch (single hub)")
+    parser.add_argument("--manifest", help="batch.py manifest; the usage globs of each hub are watched")
+    parser.add_argument("--features", help="feature mapping file (single hub)")
+    parser.add_argument("--users", help="user list file (single hub)")
+    parser.add_argument("--provisioning", help="current provisioning file or glob, newest match used (single hub)")
+    parser.add_argument("--hub", default="hub", help="hub name (single hub)")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="number of worker processes (default: 2)")
+    parser.add_argument("--interval", type=float, default=POLL_SECONDS, help="seconds between polls (default: 5)")
+    parser.add_argument("--port", type=int, default=PORT, help="port of the HTTP API on 127.0.0.1 (default: 8765)")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the on-disk cache")
+    parser.add_argument("--rebuild-cache", action="store_true", help="ignore cached entries and rebuild them")
+    parser.add_argument("--timeline", metavar="BUCKET", help="add concurrency timeline sheets (e.g. 15min, 1h, 1D)")
+    parser.add_argument("--copy-sheets", action="store_true",
+                        help="copy the other sheets of the usage workbooks as is, with their formatting")
+    parser.add_argument("--compact", action="store_true",
+                        help="keep the name columns of the usage frames as categoricals (less memory)")
+    parser.add_argument("--unknown", action="store_true",
+                        help="count unknown users and unmapped features under 'Unknown' instead of stopping")
+    parser.add_argument("--what-if", metavar="SEATS",
+                        help="add provisioning what-if sheets for these seat counts (e.g. 0-20 or 1,2,4,8)")
+    parser.add_argument("--coalesce", metavar="GAP",
+                        help="merge overlapping sessions of a user and feature within GAP (e.g. 0, 5min)")
+    parser.add_argument("--constant-memory", action="store_true",
+                        help="write the workbooks in xlsxwriter's constant-memory mode (Usage rows in chunks)")
+    parser.add_argument("--output-format", default="xlsx",
+                        help="xlsx, csv, parquet or a comma-separated list (default: xlsx)")
+    args = parser.parse_args(argv)
+    output_formats = mt.parse_output_formats(args.output_format)
+    if args.timeline:
+        import timeline as tl
+        tl.parse_bucket(args.timeline)
+    if args.what_if:
+        import whatif as wi
+        wi.parse_seats(args.what_if)
+    if args.coalesce is not None:
+        import coalesce as cs
+        cs.parse_gap(args.coalesce)
+
+    if args.manifest:
+        (file_b, hubs) = bt.load_manifest(args.manifest, expand=False)
+    elif args.usage and args.features and args.users and args.provisioning:
+        file_b = args.features
+        patterns = []
+        for u in args.usage:
+            patterns += [os.path.join(u, p) for p in USAGE_PATTERNS] if os.path.isdir(u) else [u]
+        hubs = [{"name": args.hub, "usage": patterns, "users": args.users, "provisioning": args.provisioning}]
+    else:
+        parser.print_usage()
+        print("❌ Give either --manifest, or folders with --features, --users and --provisioning.")
+        sys.exit(1)
+
+    cache = ch.Cache(enabled=not args.no_cache, rebuild=args.rebuild_cache)
+    watcher = Watcher(file_b, hubs, args.jobs, cache,
+                      (output_formats, None, args.timeline, args.copy_sheets, args.compact, args.unknown,
+                       args.what_if, args.coalesce, args.constant_memory))
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    except OSError as e:
+        print("❌ Cannot serve the API on port %d: %s" % (args.port, e.strerror))
+        sys.exit(1)
+    server.watcher = watcher
+    watcher.load_lookups()
+    watcher.mark_up_to_date()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print("[watch] watching %s; API on http://127.0.0.1:%d/ (Ctrl-C to stop)" % (
+        ", ".join(p for hub in hubs for p in hub["usage"]), server.server_address[1]))
+    try:
+        while True:
+            watcher.poll()
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print("[watch] stopping")
+    finally:
+        server.shutdown()
+        watcher.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+import match as mt
+import provision as pr
+import concurrency as cc
+import timeline as tl
+
+# Provisioning what-if sheets (--what-if SEATS).
+#
+# For each candidate seat count of a grid (e.g. 0-20 or 1,2,4,8), how much of
+# the time a product was in use, and how many of its sessions, would have been
+# blocked with that many seats, for two allocations:
+#   per performer  every (Project, Performer, Vendor, Product Feature) has its own seats
+#   pooled         the performers of a project share the seats of
+#                  (Project, Vendor, Product Feature)
+# One sweep over the session events (concurrency.level_histograms) gives, per
+# group, the time spent at each concurrency level and the number of sessions
+# started at each level.  Blocked time and sessions with c seats are the sums
+# over the levels above c, so after the sweep a grid of any size costs one
+# cumulative sum and one indexed lookup.  A session counts as blocked if it
+# starts while all seats are in use, as the usage actually happened (blocked
+# sessions are not replayed later).
+#   Provision What-If  per group: the current provision and its blocked time
+#                      and sessions, the fewest seats that keep the blocked
+#                      time at or below BLOCKED_TARGET percent of the in-use
+#                      time, and for pooled rows the per-performer total
+#   What-If Grid       per group and seat count: blocked hours, blocked time %
+#                      and blocked sessions
+
+BLOCKED_TARGET = 1.0	# percent of the in-use time
+EXCEL_MAX_ROWS = 1048575	# data rows of a sheet below the header
+
+RECOMMEND_SHEET = "Provision What-If"
+GRID_SHEET = "What-If Grid"
+PER_PERFORMER = "per performer"
+POOLED = "pooled"
+
+PERFORMER_KEYS = [mt.PROJECT, mt.ORG, mt.VENDOR, mt.PRODUCT]
+POOLED_KEYS = [mt.PROJECT, mt.VENDOR, mt.PRODUCT]
+PROV_KEYS = [pr.PROV_PROJECT, pr.PROV_PERFORMER, pr.PROV_VENDOR, pr.PROV_PRODUCT]
+KEY_COLUMNS = ["Project", "Performer", "Vendor", "Product Feature"]
+
+def parse_seats(value):
+    """Seat counts such as 0-20, 1,2,4,8 or 0-200:5 (range with a step), as a sorted int64 array."""
+    seats = []
+    try:
+        for part in str(value).split(","):
+            (span, _, step) = part.partition(":")
+            (lo, dash, hi) = span.strip().partition("-")
+            (lo, hi, step) = (int(lo), int(hi) if dash else int(lo), int(step) if step else 1)
+            if lo < 0 or hi < lo or step < 1:
+                raise ValueError(part)
+            seats.extend(range(lo, hi + 1, step))
+    except ValueError:
+        print("❌ Invalid seat counts '%s' (e.g. 0-20, 1,2,4,8 or 0-200:5)" % value)
+        sys.exit(1)
+    return np.unique(np.array(seats, dtype=np.int64))
+
+class Curves:
+    """
+    Blocking curves of the groups of the usage aggregate by `keys`: column c
+    of `hours_above` / `sessions_above` holds the hours spent, and the sessions
+    started, above c sessions open (the last column is 0).
+    """
+    def __init__(self, agg, keys):
+        (self.groups, starts, ends, ids) = tl.grouped_sessions(agg, keys)
+        (spent, started) = cc.level_histograms(starts, ends, ids, len(self.groups))
+        self.sessions = np.bincount(ids, minlength=len(self.groups))
+        self.hours_above = self._above(spent / tl.NS_PER_HOUR)
+        self.sessions_above = self._above(started)
+        self.in_use = self.hours_above[:, 0]
+        self.peaks = np.count_nonzero(self.sessions_above, axis=1)	# the peak is reached by a session start
+
+    @staticmethod
+    def _above(per_level):
+        # column c: sum over the levels > c; level 0 (idle) is never counted
+        at_or_above = np.cumsum(per_level[:, ::-1], axis=1)[:, ::-1]
+        return np.concatenate([at_or_above[:, 1:], np.zeros((len(per_level), 1), at_or_above.dtype)], axis=1)
+
+    def blocked(self, seats):
+        """(blocked hours, blocked time %, blocked sessions) of every group (rows) for each seat count (columns)."""
+        column = np.minimum(np.asarray(seats, dtype=np.int64), self.hours_above.shape[1] - 1)
+        hours = self.hours_above[:, column]
+        percent = 100.0 * hours / np.where(self.in_use > 0, self.in_use, 1.0)[:, None]
+        return (hours, percent, self.sessions_above[:, column])
+
+    def recommended(self, target=BLOCKED_TARGET):
+        """Fewest seats that keep the blocked time at or below `target` percent of the in-use time."""
+        levels = np.arange(self.hours_above.shape[1])
+        (_, percent, _) = self.blocked(levels)
+        return np.argmax(percent <= target + 1e-9, axis=1)	# the last column is always 0
+
+def _pad(a):
+    # a zero row after the last one, for row index -1
+    return np.concatenate([a, np.zeros((1,) + a.shape[1:], a.dtype)])
+
+def current_provision(df_prov, keys):
+    """Current Provision of the Tool Usage rows summed by `keys` (of PROV_KEYS), indexed by them."""
+    prov = df_prov[PROV_KEYS].astype(object)
+    prov["current"] = pd.to_numeric(df_prov[pr.PROV_CURRENT_PROV], errors="coerce").fillna(0).to_numpy()
+    prov = prov[prov[keys].notna().all(axis=1) & (prov[pr.PROV_PROJECT] != "")]
+    return prov.groupby(keys, sort=False)["current"].sum()
+
+def allocation_frame(curves, df_prov, prov_keys, allocation, target=BLOCKED_TARGET):
+    """
+    Recommendation rows of one allocation: the usage groups and the
+    provisioned groups without usage.  Returns (frame, row of curves per
+    frame row, -1 for groups without usage).
+    """
+    groups = curves.groups.astype(object)
+    groups.columns = prov_keys
+    groups["_row"] = np.arange(len(groups))
+    current = current_provision(df_prov, prov_keys).reset_index()
+    frame = groups.merge(current, on=prov_keys, how="outer")
+    rows = frame["_row"].fillna(-1).astype(np.int64).to_numpy()
+    provision = frame["current"].fillna(0).to_numpy()
+
+    # groups without usage take the (all zero) row after the last one
+    (hours_above, sessions_above, in_use, sessions, peaks, recommended) = [
+        _pad(a)[rows] for a in (curves.hours_above, curves.sessions_above, curves.in_use, curves.sessions,
+                                curves.peaks, curves.recommended(target))]
+    result = frame[prov_keys].copy()
+    if pr.PROV_PERFORMER not in prov_keys:
+        result.insert(1, pr.PROV_PERFORMER, "All")
+    result.columns = KEY_COLUMNS
+    result["Allocation"] = allocation
+    result["Current Provision"] = provision
+    result["Sessions"] = sessions
+    result["Peak"] = peaks
+    result["Hours in Use"] = in_use
+    for (label, seats) in [("current", np.floor(provision).astype(np.int64)), ("recommended", recommended)]:
+        column = np.minimum(seats, hours_above.shape[1] - 1)
+        blocked = hours_above[np.arange(len(rows)), column]
+        result["Blocked Time %% (%s)" % label] = (100.0 * blocked / np.where(in_use > 0, in_use, 1.0)).round(2)
+        result["Blocked Sessions (%s)" % label] = sessions_above[np.arange(len(rows)), column]
+    result["Recommended"] = recommended
+    result["Change"] = recommended - provision
+    return (result, rows)
+
+def grid_frame(curves, rows, keys_frame, seats):
+    """Blocked hours, time % and sessions of each recommendation row for each seat count, one row per pair."""
+    (hours, percent, sessions) = [_pad(a)[rows] for a in curves.blocked(seats)]
+    grid = keys_frame.loc[keys_frame.index.repeat(len(seats))].reset_index(drop=True)
+    grid["Seats"] = np.tile(seats, len(keys_frame))
+    grid["Blocked Hours"] = hours.ravel()
+    grid["Blocked Time %"] = percent.ravel().round(2)
+    grid["Blocked Sessions"] = sessions.ravel()
+    return grid
+
+def _order(frame):
+    # by project, vendor and product feature; the pooled row before its performers
+    key = lambda s: s.astype(str)
+    return frame.assign(_pooled=(frame["Allocation"] != POOLED)) \
+        .sort_values(["Project", "Vendor", "Product Feature", "_pooled", "Performer"], key=key, kind="stable")
+
+def whatif_sheets(agg, df_prov, seats, target=BLOCKED_TARGET):
+    """The what-if sheets as a list of (sheet name, frame, formatter or None)."""
+    seats = parse_seats(seats) if isinstance(seats, str) else np.asarray(seats, dtype=np.int64)
+    t0 = time.perf_counter()
+    per_performer = Curves(agg, PERFORMER_KEYS)
+    pooled = Curves(agg, POOLED_KEYS)
+    (performer_rows, performer_map) = allocation_frame(per_performer, df_prov, PROV_KEYS, PER_PERFORMER, target)
+    pool_keys = [k for k in PROV_KEYS if k != pr.PROV_PERFORMER]
+    (pooled_rows, pooled_map) = allocation_frame(pooled, df_prov, pool_keys, POOLED, target)
+
+    # per-performer total of each pool, next to its pooled recommendation
+    pool = ["Project", "Vendor", "Product Feature"]
+    totals = performer_rows.groupby(pool, sort=False)["Recommended"].sum().rename("Per-Performer Total")
+    pooled_rows = pooled_rows.merge(totals.reset_index(), on=pool, how="left")
+    performer_rows["Per-Performer Total"] = np.nan
+
+    grid = pd.concat([grid_frame(per_performer, performer_map, performer_rows[KEY_COLUMNS + ["Allocation"]], seats),
+                      grid_frame(pooled, pooled_map, pooled_rows[KEY_COLUMNS + ["Allocation"]], seats)],
+                     ignore_index=True)
+    recommend = _order(pd.concat([performer_rows, pooled_rows], ignore_index=True))
+    grid = _order(grid).drop(columns="_pooled").reset_index(drop=True)
+    recommend = recommend.drop(columns="_pooled").reset_index(drop=True)
+    print("[3.3] Provisioning what-if: %d group(s) x %d seat count(s), per performer and pooled, in %.3f s" % (
+        len(recommend), len(seats), time.perf_counter() - t0))
+
+    sheets = [(RECOMMEND_SHEET, recommend, set_change_colors)]
+    if len(grid) > EXCEL_MAX_ROWS:
+        print("⚠️ %s has %d rows, more than a sheet holds; left out (give fewer seat counts)." % (GRID_SHEET, len(grid)))
+    else:
+        sheets.append((GRID_SHEET, grid, None))
+    return sheets
+
+def set_change_colors(workbook, worksheet, df):
+    # fewer seats than provisioned in green, more in red
+    col = df.columns.get_loc("Change")
+    if len(df):
+        worksheet.conditional_format(1, col, len(df), col, {
+            "type": "cell", "criteria": "<", "value": 0, "format": workbook.add_format({"font_color": "green"})})
+        worksheet.conditional_format(1, col, len(df), col, {
+            "type": "cell", "criteria": ">", "value": 0, "format": workbook.add_format({"font_color": "red"})})
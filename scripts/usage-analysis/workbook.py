@@ -0,0 +1,209 @@
+import os
+import sys
+import csv
+import pandas as pd
+from openpyxl import load_workbook
+from pandas.io.parsers import TextParser
+from columns import CSV_EXTENSIONS, PARQUET_EXTENSIONS, convert_csv_cell, convert_number, row_containing
+
+# Load-once workbook cache.
+#
+# Each input Excel file is opened a single time and the raw cell grid of every
+# sheet is kept in memory.  Header detection runs on those grids (or, for a
+# usage sheet, on a preview of its first rows), and frames are built from them
+# with the same parser pd.read_excel uses, so
+#     open_workbook(f).parse(sheet, header=h)
+# gives the same frame as
+#     pd.read_excel(f, sheet_name=sheet, header=h)
+# without touching the file again.
+#
+# CSV and Parquet files are read as a workbook with a single sheet named after
+# the file (single_table=True), so the same header detection runs on them.
+# Numeric CSV cells are converted to numbers, as Excel stores them; a Parquet
+# table keeps its column types and always has its header in row 0.
+#
+# Only the small lookup workbooks (feature, user and provisioning files) stay
+# cached for the life of the process; a usage workbook is released as soon as
+# its frames are built (release_workbook).
+
+# path -> (mtime, Workbook)
+_CACHE = {}
+
+# rows of a Parquet table shown in its grid (header detection only looks at the top)
+PREVIEW_ROWS = 20
+
+def file_format(path):
+    """'csv', 'parquet' or 'xlsx', by file extension."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in CSV_EXTENSIONS:
+        return "csv"
+    elif ext in PARQUET_EXTENSIONS:
+        return "parquet"
+    return "xlsx"
+
+def table_name(path):
+    # sheet name of a single-table file
+    return os.path.splitext(os.path.basename(path))[0]
+
+def require_parquet():
+    """Exit with a message unless a Parquet engine (pyarrow or fastparquet) is installed."""
+    for engine in ("pyarrow", "fastparquet"):
+        try:
+            __import__(engine)
+            return
+        except ImportError:
+            pass
+    print("❌ Parquet files need pyarrow (pip install pyarrow) or fastparquet.")
+    sys.exit(1)
+
+def convert_cell(cell):
+    # same conversion as pandas' openpyxl reader
+    if cell.value is None:
+        return ""
+    elif cell.data_type == "e":	# error cell
+        return float("nan")
+    elif cell.data_type == "n":
+        return convert_number(cell.value)
+    return cell.value
+
+def iter_sheet_rows(sheet):
+    """
+    Yield the rows of a read-only worksheet as lists of converted cell values,
+    trailing empty cells trimmed.  Empty rows are only yielded when a row
+    with data follows (trailing empty rows are dropped, as pandas does).
+    """
+    sheet.reset_dimensions()
+    return _trim_rows([convert_cell(cell) for cell in row] for row in sheet.rows)
+
+def iter_csv_rows(f, strings=None):
+    """
+    Same as iter_sheet_rows for an open CSV file.  With `strings` (a dict),
+    repeated text cells share one string object, as Excel's shared strings do.
+    """
+    if strings is None:
+        return _trim_rows([convert_csv_cell(value) for value in row] for row in csv.reader(f))
+    share = strings.setdefault
+    return _trim_rows([share(v, v) if isinstance(v, str) else v for v in map(convert_csv_cell, row)]
+                      for row in csv.reader(f))
+
+def open_csv(path):
+    return open(path, newline="", encoding="utf-8-sig")	# utf-8-sig: Excel writes a BOM
+
+def _trim_rows(rows):
+    pending_empty = 0
+    for converted_row in rows:
+        while converted_row and converted_row[-1] == "":
+            converted_row.pop()		# trim trailing empty cells
+        if not converted_row:
+            pending_empty += 1
+            continue
+        for _ in range(pending_empty):
+            yield []
+        pending_empty = 0
+        yield converted_row
+
+def _read_sheet_data(rows):
+    # all rows, padded to the same width
+    data = list(rows)
+    if data:
+        width = max(len(r) for r in data)
+        data = [r + [""] * (width - len(r)) for r in data]
+    return data
+
+class Workbook:
+    def __init__(self, path):
+        self.path = path
+        self.format = file_format(path)
+        self.single_table = self.format != "xlsx"
+        self._data = {}		# sheet name -> list of rows (raw cell values)
+        self._grids = {}	# sheet name -> frame read without header
+        self._tables = {}	# sheet name -> typed Parquet table
+
+        if self.format == "csv":
+            self.sheet_names = [table_name(path)]
+            with open_csv(path) as f:
+                self._data[self.sheet_names[0]] = _read_sheet_data(iter_csv_rows(f, {}))
+        elif self.format == "parquet":
+            require_parquet()
+            self.sheet_names = [table_name(path)]
+            self._tables[self.sheet_names[0]] = pd.read_parquet(path)
+        else:
+            book = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+            try:
+                self.sheet_names = list(book.sheetnames)
+                for name in self.sheet_names:
+                    self._data[name] = _read_sheet_data(iter_sheet_rows(book[name]))
+            finally:
+                book.close()
+
+    def grid(self, sheet):
+        """Raw sheet grid, as pd.read_excel(..., header=None) returns it."""
+        if sheet not in self._grids:
+            if sheet in self._tables:	# header row and the first rows of the table
+                self._grids[sheet] = self.preview(sheet, PREVIEW_ROWS + 1)
+            else:
+                self._grids[sheet] = self.parse(sheet, header=None)
+        return self._grids[sheet]
+
+    def preview(self, sheet, nrows):
+        """The first `nrows` raw rows of a sheet as a frame, without building (or caching) its grid."""
+        if sheet in self._tables:
+            table = self._tables[sheet]
+            rows = [list(table.columns)] + table.head(nrows - 1).astype(object).values.tolist()
+        else:
+            rows = self._data[sheet][:nrows]
+        return pd.DataFrame(rows[:nrows])
+
+    def parse(self, sheet, header=0, dtype=None, nrows=None):
+        """Build a frame from the cached sheet grid using `header` as the header row."""
+        if sheet in self._tables:
+            table = self._tables[sheet]
+            if header == 0:		# as stored, without re-parsing
+                df = table.head(nrows) if nrows is not None else table.copy(deep=False)
+                return df.astype(dtype) if dtype is not None else df
+            data = [list(table.columns)] + table.astype(object).values.tolist()
+        else:
+            data = self._data[sheet]
+        if not data:
+            return pd.DataFrame()
+        parser = TextParser(data, header=header, dtype=dtype, nrows=nrows, skip_blank_lines=False)
+        return parser.read(nrows=nrows)
+
+def open_workbook(path):
+    """Return the cached Workbook for `path`, loading it if new or modified."""
+    key = os.path.abspath(path)
+    mtime = os.path.getmtime(key)
+    cached = _CACHE.get(key)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, Workbook(path))
+        _CACHE[key] = cached
+    return cached[1]
+
+def release_workbook(path):
+    """Drop the cached Workbook for `path` (e.g. once its frames are built)."""
+    _CACHE.pop(os.path.abspath(path), None)
+
+def find_row_containing(grid, values):
+    """Return the index of the first grid row that contains all `values` (exact match), or None."""
+    return row_containing(grid.itertuples(index=False), values)
+
+def _arrow_column(s):
+    # Arrow needs one type per column: blank cells become nulls, and columns
+    # that still mix types (e.g. numbers and text) are written as text;
+    # categorical columns (--compact) are decoded first
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        s = s.astype(object)
+    if s.dtype != object:
+        return s
+    s = s.where(s != "", None)
+    kinds = set(type(v) for v in s.dropna())
+    if len(kinds) <= 1:
+        return s
+    if all(issubclass(k, (int, float)) for k in kinds):
+        return pd.to_numeric(s)
+    return s.map(lambda v: v if v is None else str(v))
+
+def write_parquet(df, path):
+    require_parquet()
+    df = pd.DataFrame({str(c): _arrow_column(df[c]) for c in df.columns})
+    df.to_parquet(path, index=False)
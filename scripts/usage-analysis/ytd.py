@@ -0,0 +1,189 @@
+import sys
+import os
+import time
+import pickle
+import argparse
+import numpy as np
+import match as mt
+import cache as ch
+import store as st
+import concurrency as cc
+import preflight as pf
+import coalesce as cs
+
+# Incremental year-to-date mode.
+#
+# The state file keeps the usage aggregate of every processed month (totals
+# per project, org, vendor, product, feature and user, plus the session
+# intervals the concurrency estimate needs), so a new month's usage log is
+# read once and folded into the state.  The year-to-date Performer/Tool
+# summaries and provisioning comparison are then built from the merged
+# aggregates, without re-reading the earlier workbooks.
+#
+# Months are keyed by YYYY-MM (taken from the session start times, or given
+# with --month).  Processing a month again replaces its entry, so a re-run is
+# idempotent; a month whose usage file, feature mapping and user list are
+# unchanged, processed with the same --unknown and --coalesce, is not read
+# again at all.
+#
+#   python ytd.py --state ytd-2025.pkl --features F.xlsx --users U.xlsx \
+#                 --provisioning P.xlsx CA_DREAMS-Usage-Data-2025.11.xlsx
+# writes ytd-2025-processed.xlsx (Performer Summary, Tool Summary, Tool Usage).
+
+STATE_VERSION = 1
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {"version": STATE_VERSION, "months": {}}
+    with open(path, "rb") as f:
+        state = pickle.load(f)
+    if state.get("version") != STATE_VERSION:
+        print("❌ %s was written by another version of ytd.py; rebuild it from the monthly usage files." % path)
+        sys.exit(1)
+    return state
+
+def save_state(state, path):
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)	# never leave a half-written state behind
+
+def usage_month(df):
+    """The YYYY-MM most sessions of the usage frame start in."""
+    starts = cc.to_datetime64(df["Start Time"].to_numpy())
+    months = starts[~np.isnat(starts)].astype("datetime64[M]")
+    if len(months) == 0:
+        print("❌ No session start times found; give the month with --month YYYY-MM.")
+        sys.exit(1)
+    (values, counts) = np.unique(months, return_counts=True)
+    return str(values[np.argmax(counts)])
+
+def add_month(state, file_a, feature_lookup, user_lookup, cache=None, lookup_files=None, month=None, unknown=False,
+              coalesce=None):
+    """Fold one usage log into the state, replacing an earlier run of the same month; returns the month."""
+    digest = st.inputs_hash([file_a] + list(lookup_files or []))	# as store.load_month
+    for (m, entry) in state["months"].items():
+        if (entry["hash"] == digest and month in (None, m) and entry.get("unknown") == unknown
+                and entry.get("coalesce") == coalesce):
+            print("    %s: %s already folded in, unchanged" % (m, file_a))
+            return m
+
+    print("[2.1] Read usage file: %s" % file_a)
+    if cache is not None and lookup_files:
+        (sheets, df) = cache.cached("usage", [file_a] + list(lookup_files),
+                                    lambda: mt.load_usage_file(file_a, feature_lookup, user_lookup))
+    else:
+        (sheets, df) = mt.load_usage_file(file_a, feature_lookup, user_lookup)
+    pf.validate_usage(df, feature_lookup, user_lookup, file_a, unknown)
+    month = month or usage_month(df)
+
+    previous = state["months"].get(month)
+    if previous is not None:
+        print("⚠️ %s was already processed (from %s on %s); replacing it with %s" % (
+            month, previous["usage"], previous["processed"], file_a))
+    state["months"][month] = {
+        "usage": file_a,
+        "hash": digest,	# usage file and lookup files
+        "rows": len(df),
+        "processed": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "unknown": unknown,
+        "coalesce": coalesce,
+        "agg": mt.aggregate_usage(cs.coalesce_usage(df, coalesce) if coalesce is not None else df),
+    }
+    return month
+
+def ytd_aggregate(state):
+    """Merge the monthly aggregates in month order."""
+    months = sorted(state["months"])
+    return mt.merge_aggregates([state["months"][m]["agg"] for m in months])
+
+def write_ytd(state_file, state, file_d, output_formats=("xlsx",), timeline=None, what_if=None):
+    agg = ytd_aggregate(state)
+    (df_pivot_data, df_pivot_data_tool, df_prov) = mt.summarize_usage(agg, state_file, file_d)
+    extra_sheets = []
+    if timeline:
+        import timeline as tl
+        extra_sheets = tl.timeline_sheets(agg, timeline)
+    if what_if:
+        import whatif as wi
+        extra_sheets += wi.whatif_sheets(agg, df_prov, what_if)
+    outputs = []
+    for fmt in output_formats:
+        if fmt == "xlsx":
+            outputs.append(mt.write_new_file(state_file, [], None, df_pivot_data, df_pivot_data_tool, df_prov,
+                                             extra_sheets))
+        else:
+            outputs.append(mt.write_tables(state_file, fmt, None, df_pivot_data, df_pivot_data_tool, df_prov,
+                                           extra_sheets))
+    return ", ".join(outputs)
+
+def print_months(state):
+    for month in sorted(state["months"]):
+        m = state["months"][month]
+        print("  %s  %8d rows  %s  (%s)" % (month, m["rows"], m["usage"], m["processed"]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fold monthly usage logs into a year-to-date summary.")
+    parser.add_argument("usage", nargs="*", help="usage files of the months to add (or replace)")
+    parser.add_argument("--state", required=True, help="state file of the year, e.g. ytd-2025.pkl")
+    parser.add_argument("--features", help="feature mapping file")
+    parser.add_argument("--users", help="user list file")
+    parser.add_argument("--provisioning", help="current provisioning file")
+    parser.add_argument("--month", help="YYYY-MM of the (single) usage file, instead of the session dates")
+    parser.add_argument("--remove", action="append", default=[], metavar="YYYY-MM", help="drop a month from the state")
+    parser.add_argument("--list", action="store_true", help="list the months in the state and exit")
+    parser.add_argument("--timeline", metavar="BUCKET", help="add concurrency timeline sheets (e.g. 1D)")
+    parser.add_argument("--what-if", metavar="SEATS",
+                        help="add provisioning what-if sheets for these seat counts (e.g. 0-20 or 1,2,4,8)")
+    parser.add_argument("--unknown", action="store_true",
+                        help="count unknown users and unmapped features under 'Unknown' instead of stopping")
+    parser.add_argument("--coalesce", metavar="GAP",
+                        help="merge overlapping sessions of a user and feature within GAP (e.g. 0, 5min)")
+    parser.add_argument("--output-format", default="xlsx",
+                        help="xlsx, csv, parquet or a comma-separated list (default: xlsx)")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the on-disk cache")
+    parser.add_argument("--rebuild-cache", action="store_true", help="ignore cached entries and rebuild them")
+    args = parser.parse_args(argv)
+
+    state = load_state(args.state)
+    if args.list:
+        print_months(state)
+        return
+    if args.month and len(args.usage) > 1:
+        print("❌ --month applies to a single usage file.")
+        sys.exit(1)
+    if not args.provisioning or (args.usage and not (args.features and args.users)):
+        parser.print_usage()
+        print("❌ Give --provisioning, and --features and --users with usage files.")
+        sys.exit(1)
+    output_formats = mt.parse_output_formats(args.output_format)
+    if args.what_if:
+        import whatif as wi
+        wi.parse_seats(args.what_if)
+    if args.coalesce is not None:
+        cs.parse_gap(args.coalesce)
+    cache = ch.Cache(enabled=not args.no_cache, rebuild=args.rebuild_cache)
+
+    for month in args.remove:
+        if state["months"].pop(month, None) is None:
+            print("⚠️ %s is not in %s" % (month, args.state))
+
+    if args.usage:
+        print("[1] Build mapping dictionary from EDA feature file: %s" % args.features)
+        feature_lookup = cache.cached("features", [args.features], lambda: mt.setup_feature_dictionary(args.features))
+        print("[2] Build mapping dictionary from User list file: %s" % args.users)
+        user_lookup = cache.cached("users", [args.users], lambda: mt.setup_user_dictionary(args.users))
+        for file_a in args.usage:
+            add_month(state, file_a, feature_lookup, user_lookup, cache, [args.features, args.users], args.month,
+                      args.unknown, args.coalesce)
+
+    if not state["months"]:
+        print("❌ %s holds no months yet." % args.state)
+        sys.exit(1)
+    save_state(state, args.state)
+    print("Year to date: %d month(s)" % len(state["months"]))
+    print_months(state)
+    write_ytd(args.state, state, args.provisioning, output_formats, args.timeline, args.what_if)
+
+if __name__ == "__main__":
+    main()